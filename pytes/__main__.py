@@ -0,0 +1,5 @@
+import sys
+
+from pytes.cli import main
+
+sys.exit(main())
@@ -0,0 +1,323 @@
+"""
+Output limits of the instrument models and preflight validation.
+
+A Capabilities object holds the limits of one model: amplitude, peak
+voltage, i.e., amplitude / 2 + |offset| which the instrument clips
+silently, frequency, and the number of points, sample values and sample
+rate of arbitrary data. The limits are selected once per model from the
+*IDN? answer, see capabilities_from_idn, and stored in
+SignalGenerator.capabilities. Amplitudes are peak-to-peak into a high
+impedance load, like the values sent by SignalGenerator.
+
+validate_schedule checks a whole compiled schedule before the session
+starts. The setpoints of every channel are collected into arrays, the state
+between the commands is forward-filled, and all limits are checked in one
+vectorized pass. ProtocolRunner.run refuses to start a session with any
+violation, such that no invalid command reaches the hardware mid-session.
+"""
+
+import numpy as np
+
+
+# The minimum amplitude of the authors' hardware setup
+MIN_AMP = 0.002
+
+# Waveform of the channel after each waveform command
+MODES = {'sin': 1.0, 'dc': 2.0, 'noise': 3.0, 'arb': 4.0}
+
+
+class Capabilities():
+    """Output limits of one instrument model
+
+    Parameters
+    ----------
+    name : str
+        Name of the model or family
+    idn_patterns : list of str
+        Case-insensitive prefixes of the model field of *IDN?
+    max_frequency : float
+        Maximum frequency of a sine in Hz
+    max_amp : float (default 20.0)
+        Maximum amplitude in Vpp
+    max_voltage : float (default 10.0)
+        Maximum peak voltage, i.e., amplitude / 2 + |offset|
+    min_frequency : float (default 1e-6)
+        Minimum frequency of a sine in Hz
+    min_amp : float (default MIN_AMP)
+        Minimum amplitude in Vpp
+    arb_points : tuple of int | None (default (2, 16384))
+        Minimum and maximum number of points of arbitrary data, None if
+        arbitrary data is not supported
+    arb_range : tuple of float (default (-2.5, 2.5))
+        Range of the samples of arbitrary data in Volt, see arb_func
+    arb_sps : tuple of float (default (1e-6, 60e6))
+        Range of the sample rate of arbitrary data in samples per second
+
+    """
+    def __init__(self, name, idn_patterns, max_frequency, max_amp=20.0,
+                 max_voltage=10.0, min_frequency=1e-6, min_amp=MIN_AMP,
+                 arb_points=(2, 16384), arb_range=(-2.5, 2.5),
+                 arb_sps=(1e-6, 60e6)):
+        self.name = name
+        self.idn_patterns = [i.lower() for i in idn_patterns]
+        self.max_frequency = max_frequency
+        self.min_frequency = min_frequency
+        self.max_amp = max_amp
+        self.min_amp = min_amp
+        self.max_voltage = max_voltage
+        self.arb_points = arb_points
+        self.arb_range = arb_range
+        self.arb_sps = arb_sps
+
+    def __repr__(self):
+        return f'Capabilities({self.name!r})'
+
+    def check_setpoints(self, t, amp, offset, frequency, mode=None,
+                        index=None, chn=1):
+        """Check the state of a channel at a series of setpoints
+
+        Parameters
+        ----------
+        t : 1-D array
+            Time of the setpoints in seconds
+        amp, offset, frequency : 1-D array
+            State of the channel at every setpoint, NaN if unknown
+        mode : 1-D array | None (default None)
+            Waveform at every setpoint, see MODES, NaN if unknown. The
+            amplitude is not checked for DC, the frequency only for sines.
+        index : 1-D array | None (default None)
+            Index of the command of every setpoint, if None arange
+        chn : 1 | 2 (default 1)
+
+        Returns
+        -------
+        violations : list of dict
+            't', 'index', 'chn', 'param', 'value', 'limit' and 'message'
+            of every violated limit, sorted by time
+
+        """
+        t = np.asarray(t, dtype=float)
+        amp, offset, frequency = [np.asarray(i, dtype=float)
+                                  for i in [amp, offset, frequency]]
+        mode = np.full(len(t), np.nan) if mode is None else \
+            np.asarray(mode, dtype=float)
+        index = np.arange(len(t)) if index is None else np.asarray(index)
+        periodic = (mode != MODES['dc']) & (mode != MODES['arb'])
+        sine = periodic & (mode != MODES['noise'])
+        # An unknown amplitude or offset counts as 0 for the peak voltage
+        peak = np.nan_to_num(np.where(periodic, amp, 0)) / 2 + \
+            np.abs(np.nan_to_num(offset))
+        # Comparisons with NaN are False, unknown values pass
+        checks = [
+            ('amp', amp, periodic & ~(amp >= self.min_amp) & ~np.isnan(amp),
+             self.min_amp, 'below the minimum amplitude'),
+            ('amp', amp, periodic & (amp > self.max_amp), self.max_amp,
+             'above the maximum amplitude'),
+            ('frequency', frequency, sine & ~(frequency >= self.min_frequency)
+             & ~np.isnan(frequency), self.min_frequency,
+             'below the minimum frequency'),
+            ('frequency', frequency, sine & (frequency > self.max_frequency),
+             self.max_frequency, 'above the maximum frequency'),
+            ('peak', peak, (mode != MODES['arb']) &
+             ~(peak <= self.max_voltage), self.max_voltage,
+             'amplitude / 2 + |offset| above the maximum voltage'),
+        ]
+        violations = []
+        for param, values, mask, limit, text in checks:
+            for ind in np.flatnonzero(mask):
+                violations.append({
+                    't': float(t[ind]), 'index': int(index[ind]),
+                    'chn': chn, 'param': param, 'value': float(values[ind]),
+                    'limit': limit,
+                    'message': f'CH{chn} at {t[ind]:.3f} s: {param} '
+                               f'{values[ind]:g} {text} {limit:g}'})
+        return sorted(violations, key=lambda i: (i['t'], i['index']))
+
+    def check_waveform(self, data, sps, t=0.0, index=0, chn=1):
+        """Check arbitrary data and its sample rate
+
+        Returns
+        -------
+        violations : list of dict
+            See check_setpoints. A violation of the sample range lists the
+            indices of all samples out of range in 'samples'.
+
+        """
+        data = np.asarray(data, dtype=float)
+        violations = []
+
+        def add(param, value, limit, text, **extra):
+            violations.append(dict({
+                't': float(t), 'index': int(index), 'chn': chn,
+                'param': param, 'value': value, 'limit': limit,
+                'message': f'CH{chn} at {t:.3f} s: {text}'}, **extra))
+
+        if self.arb_points is None:
+            add('arb_points', data.size, None, f'arbitrary data is not '
+                f'supported by {self.name}')
+            return violations
+        if data.ndim != 1 or not \
+                self.arb_points[0] <= len(data) <= self.arb_points[1]:
+            add('arb_points', data.size, self.arb_points,
+                f'{data.size} points of arbitrary data, {self.name} '
+                f'supports {self.arb_points[0]} to {self.arb_points[1]}')
+        low, high = self.arb_range
+        samples = np.flatnonzero(~((data >= low) & (data <= high)))
+        if samples.size:
+            add('arb_data', float(data.ravel()[samples[0]]), self.arb_range,
+                f'{samples.size} samples of arbitrary data out of '
+                f'[{low:g}, {high:g}] V, first at sample {samples[0]}',
+                samples=samples)
+        if sps is None or not self.arb_sps[0] <= sps <= self.arb_sps[1]:
+            add('sps', sps, self.arb_sps, f'sample rate {sps} out of '
+                f'[{self.arb_sps[0]:g}, {self.arb_sps[1]:g}]')
+        return violations
+
+
+def _family(name, patterns, max_frequency, **kwargs):
+    # One Capabilities per model of a family with its maximum frequency
+    return [Capabilities(f'{name} {model}', [model], freq, **kwargs)
+            for model, freq in zip(patterns, max_frequency)]
+
+
+# Sine frequency of every model, amplitudes into a high impedance load
+MODELS = (
+    _family('Rigol', ['DG1022Z', 'DG1032Z', 'DG1062Z'], [25e6, 30e6, 60e6]) +
+    _family('Rigol', ['DG4062', 'DG4102', 'DG4162', 'DG4202'],
+            [60e6, 100e6, 160e6, 200e6]) +
+    _family('Rigol', ['DG5071', 'DG5072', 'DG5101', 'DG5102', 'DG5251',
+                      'DG5252', 'DG5351', 'DG5352'],
+            [70e6, 70e6, 100e6, 100e6, 250e6, 250e6, 350e6, 350e6]) +
+    # Point-wise upload of arbitrary data is not supported, see pytes.scpi
+    _family('Keysight', ['33509B', '33510B', '33511B', '33519B', '33520B',
+                         '33521B', '33522B'], [20e6] * 7, arb_points=None) +
+    _family('Keysight', ['33611A', '33612A', '33621A', '33622A'],
+            [80e6, 80e6, 120e6, 120e6], arb_points=None) +
+    _family('Siglent', ['SDG1032X', 'SDG1062X', 'SDG2042X', 'SDG2082X',
+                        'SDG2122X'], [30e6, 60e6, 40e6, 80e6, 120e6],
+            arb_points=None))
+
+# Limits of unknown models and of the MockDriver, the most restrictive
+# frequency of the default dialect
+DEFAULT_CAPABILITIES = Capabilities('default', [], 25e6)
+
+_cache = {}
+
+
+def capabilities_from_idn(idn, default=DEFAULT_CAPABILITIES):
+    """Select the limits of a device from its *IDN? answer
+
+    The result is cached per model field.
+
+    Parameters
+    ----------
+    idn : str | bytes
+        Answer of *IDN?, e.g., 'Rigol Technologies,DG1062Z,DG1ZA...,00.01'
+    default : Capabilities (default DEFAULT_CAPABILITIES)
+        Returned if no model matches
+
+    """
+    if isinstance(idn, bytes):
+        idn = idn.decode('utf8', errors='replace')
+    fields = [i.strip().lower() for i in str(idn).split(',')]
+    model = fields[1] if len(fields) > 1 else ''
+    if model not in _cache:
+        matches = [caps for caps in MODELS if any(
+            model.startswith(i) for i in caps.idn_patterns)]
+        # The longest pattern is the most specific model
+        _cache[model] = max(matches, key=lambda caps: max(
+            len(i) for i in caps.idn_patterns), default=None)
+    return _cache[model] or default
+
+
+def _setpoints(cmd):
+    # Waveform and values set by a command, None if it sets none of them
+    kwargs = cmd.kwargs
+    if cmd.method == 'para_set':
+        state = {}
+        for key, val in kwargs.get('para_dict', {}).items():
+            if key == 'sin':
+                state.update(zip(['frequency', 'amp', 'offset'], val[:3]),
+                             mode=MODES['sin'])
+            elif key == 'dc':
+                state.update(amp=0.0, offset=val, mode=MODES['dc'])
+            elif key == 'noise':
+                state.update(amp=val[0], offset=val[1],
+                             mode=MODES['noise'])
+            elif key in ['amp', 'offset', 'frequency']:
+                state[key] = val
+        return state or None
+    elif cmd.method in ['tacs_amp', 'amp']:
+        return {'amp': kwargs.get('value')}
+    elif cmd.method in ['offset', 'frequency']:
+        return {cmd.method: kwargs.get('value')}
+    elif cmd.method == 'arb_func':
+        return {'mode': MODES['arb']}
+    return None
+
+
+def _ffill(values):
+    # Replace NaN by the last valid value before it
+    ind = np.where(np.isnan(values), 0, np.arange(len(values)))
+    np.maximum.accumulate(ind, out=ind)
+    return values[ind]
+
+
+def validate_schedule(schedule, capabilities=DEFAULT_CAPABILITIES):
+    """Check a compiled schedule against the limits of a model
+
+    Parameters
+    ----------
+    schedule : list of pytes.protocol.Command
+        Schedule as returned by compile_protocol, sorted by time
+    capabilities : Capabilities (default DEFAULT_CAPABILITIES)
+
+    Returns
+    -------
+    violations : list of dict
+        Every violation with the time 't' and the position 'index' of the
+        command in the schedule, sorted by time, see
+        Capabilities.check_setpoints
+
+    """
+    fields = ['mode', 'amp', 'offset', 'frequency']
+    violations = []
+    for chn in sorted(set(cmd.chn for cmd in schedule)):
+        rows, index = [], []
+        for ind, cmd in enumerate(schedule):
+            if cmd.chn != chn:
+                continue
+            if cmd.method == 'arb_func':
+                violations += capabilities.check_waveform(
+                    cmd.kwargs.get('data'), cmd.kwargs.get('sps'), t=cmd.t,
+                    index=ind, chn=chn)
+            state = _setpoints(cmd)
+            if state is None:
+                continue
+            rows.append([cmd.t] + [state.get(i, np.nan) for i in fields])
+            index.append(ind)
+        if not rows:
+            continue
+        try:
+            table = np.asarray(rows, dtype=float)
+        except (TypeError, ValueError):
+            raise ValueError(f'Setpoints of CH{chn} must be numbers')
+        # A limit of a single value is reported where the value is set, the
+        # peak voltage wherever it changes
+        given = {'amp': ~np.isnan(table[:, 2]),
+                 'frequency': ~np.isnan(table[:, 4])}
+        # A waveform command resets the values it does not set
+        reset = ~np.isnan(table[:, 1])
+        for col in range(2, 5):
+            keep = np.isnan(table[:, col]) & reset
+            table[keep, col] = -np.inf
+            table[:, col] = _ffill(table[:, col])
+            table[np.isneginf(table[:, col]), col] = np.nan
+        table[:, 1] = _ffill(table[:, 1])
+        row = {ind: i for i, ind in enumerate(index)}
+        violations += [
+            i for i in capabilities.check_setpoints(
+                table[:, 0], table[:, 2], table[:, 3], table[:, 4],
+                mode=table[:, 1], index=index, chn=chn)
+            if i['param'] not in given or given[i['param']][row[i['index']]]]
+    return sorted(violations, key=lambda i: (i['t'], i['index']))
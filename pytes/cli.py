@@ -0,0 +1,104 @@
+"""
+Command line entry point of PyTES, e.g.,
+
+    pytes run protocol.yaml --log timing.csv
+    pytes run protocol.yaml --dry-run
+    pytes serve --dev /dev/usbtmc1
+    pytes gui --profile trace.json
+    pytes emulate --root /tmp/fakedev
+"""
+
+import argparse
+import sys
+
+
+def add_emulate_arguments(parser):
+    # Options of the emulate subcommand, defined here such that the
+    # emulator (tty, pty, Linux only) is only imported when it is used
+    parser.add_argument('--root', required=True,
+                        help='Directory of the fake usbtmcN links')
+    parser.add_argument('--n-dev', default=1, type=int,
+                        help='Number of fake devices')
+    parser.add_argument('--latency', default=0.0, type=float,
+                        help='Delay of every reply in seconds')
+    parser.add_argument('--idn-delay', default=0.0, type=float,
+                        help='Additional delay of *IDN? in seconds')
+    parser.add_argument('--throughput', default=None, type=float,
+                        help='Maximum bytes per second read from the client')
+    parser.add_argument('--drop-rate', default=0.0, type=float,
+                        help='Probability that a reply is not sent')
+    parser.add_argument('--seed', default=None, type=int)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='pytes', description='Control transcranial electrical '
+        'stimulation via signal generators')
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser(
+        'run', help='Run a stimulation protocol (.json/.yaml) headless')
+    run_parser.add_argument('protocol', help='Path to the protocol file')
+    run_parser.add_argument('--dev', default=None,
+                            help='Device location, overrides the protocol')
+    run_parser.add_argument('--driver', default=None,
+                            choices=['USBTMC', 'VISA'],
+                            help='Driver, overrides the protocol')
+    run_parser.add_argument('--log', default=None,
+                            help='Save planned vs actual timestamps as csv')
+    run_parser.add_argument('--check', action='store_true',
+                            help='Only compile and print the schedule')
+    run_parser.add_argument('--dry-run', action='store_true',
+                            help='Run in virtual time against a mock '
+                            'device and print the command timeline')
+
+    serve_parser = subparsers.add_parser(
+        'serve', help='Own the devices and serve local clients')
+    serve_parser.add_argument('--dev', action='append', default=[],
+                              help='Device to connect at start, repeatable')
+    serve_parser.add_argument('--driver', default=None,
+                              choices=['USBTMC', 'VISA'])
+    serve_parser.add_argument('--unix', default=None,
+                              help='Location of the Unix socket')
+    serve_parser.add_argument('--host', default=None,
+                              help='Host of the TCP socket, e.g., 127.0.0.1')
+    serve_parser.add_argument('--port', default=5678, type=int)
+
+    gui_parser = subparsers.add_parser('gui', help='Start the PyTES GUI')
+    gui_parser.add_argument('--profile', default=None, metavar='TRACE',
+                            help='Time all callbacks, detect stalls of the '
+                            'GUI and save the trace as json on exit')
+
+    emulate_parser = subparsers.add_parser(
+        'emulate', help='Serve fake USBTMC devices for tests (Linux)')
+    add_emulate_arguments(emulate_parser)
+
+    args = parser.parse_args(argv)
+    if args.command == 'gui':
+        from pytes.pytes_gui import main as gui_main
+        gui_main(profile=args.profile)
+    elif args.command == 'run':
+        from pytes.protocol import run_protocol
+        run_protocol(args.protocol, dev=args.dev, protocol=args.driver,
+                     log=args.log, check=args.check, dry=args.dry_run)
+    elif args.command == 'serve':
+        from pytes.server import ControlServer
+        server = ControlServer(path=args.unix, host=args.host,
+                               port=args.port if args.host else None,
+                               protocol=args.driver)
+        for dev in args.dev:
+            server.connect(dev)
+        server.run()
+    elif args.command == 'emulate':
+        from pytes.emulator import serve
+        serve(args.root, n_dev=args.n_dev, latency=args.latency,
+              idn_delay=args.idn_delay, throughput=args.throughput,
+              drop_rate=args.drop_rate, seed=args.seed)
+    else:
+        parser.print_help()
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
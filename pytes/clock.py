@@ -0,0 +1,89 @@
+"""
+Clocks of all timing paths, i.e., sleeps, abortable waits and timestamps.
+
+SignalGenerator, MockDriver, the TimelineExecutor, the ProtocolRunner and
+PyTESWindow take a clock argument. RealClock (the default) uses the
+monotonic clock of the system. VirtualClock lets time pass instantly, such
+that a whole session runs in milliseconds against the MockDriver while the
+log of the driver holds the exact command timeline, see
+pytes.protocol.dry_run.
+
+Every thread has its own virtual time. A worker thread starts at the time of
+the thread creating its session (see attach) and advances only by its own
+sleeps and waits, which models threads running concurrently in real time.
+"""
+
+import threading
+import time
+
+
+class RealClock():
+    # System monotonic time
+    virtual = False
+
+    def now(self):
+        return time.monotonic()
+
+    def now_ns(self):
+        return time.monotonic_ns()
+
+    def sleep(self, dur):
+        if dur > 0:
+            time.sleep(dur)
+
+    def wait(self, event, timeout):
+        # Returns True if the event is set before the timeout
+        return event.wait(timeout)
+
+    def wait_until(self, event, t):
+        return event.wait(max(0.0, t - self.now()))
+
+    def attach(self, t):
+        # Called by a new worker thread with the time of its creator
+        pass
+
+
+class VirtualClock():
+    """Time which passes only by sleeping or waiting
+
+    Parameters
+    ----------
+    t0 : float (default 0.0)
+        Time of every thread which has not been attached
+
+    """
+    virtual = True
+
+    def __init__(self, t0=0.0):
+        self.t0 = t0
+        self._local = threading.local()
+
+    def now(self):
+        return getattr(self._local, 't', self.t0)
+
+    def now_ns(self):
+        return int(round(self.now() * 1e9))
+
+    def sleep(self, dur):
+        self._local.t = self.now() + max(0.0, dur)
+
+    def wait(self, event, timeout):
+        if event.is_set():
+            return True
+        if timeout is None:
+            # Nothing but another thread can end an unbounded wait
+            return event.wait()
+        self.sleep(timeout)
+        return event.is_set()
+
+    def wait_until(self, event, t):
+        if event.is_set():
+            return True
+        self._local.t = max(self.now(), t)
+        return event.is_set()
+
+    def attach(self, t):
+        self._local.t = t
+
+
+REAL_CLOCK = RealClock()
@@ -0,0 +1,451 @@
+"""
+Fake USBTMC instrument for end-to-end tests without hardware (Linux).
+
+The emulator serves one pseudo-terminal per fake device and links it as
+<port_root>/usbtmcN, such that USBTMC finds it via
+available_port_list(port_root) and talks to it with the usual os.open,
+os.write and os.read. It implements the subset of SCPI emitted by PyTES in
+the Rigol DG1000Z dialect and keeps the state of both channels.
+
+Faults can be injected to load- and fault-test the driver:
+    - latency: delay of every reply
+    - idn_delay: additional delay of *IDN?
+    - throughput: maximum number of bytes per second read from the client
+    - drop_rate: probability that a reply is never sent
+
+Run it in a separate process, e.g.,
+
+    pytes emulate --root /tmp/fakedev --latency 0.002 --drop-rate 0.01
+
+or with EmulatorProcess from Python. On SIGTERM/SIGINT, the statistics of
+every device are printed as one JSON line.
+
+Unlike a real USBTMC node, a pty has no message boundaries. Commands are
+split at newlines, semicolons and the start of a new rooted header, which
+handles commands written without terminator as long as they are well-formed.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+import tty
+
+
+# Short forms of the SCPI nodes, longest first such that e.g. OFFSET matches
+# OFFS instead of OFF
+_NODES = sorted(['SOUR', 'OUTP', 'VOLT', 'OFFS', 'FREQ', 'PHAS', 'APPL',
+                 'SIN', 'DC', 'NOIS', 'ARB', 'DATA', 'POIN', 'VAL', 'SYST',
+                 'ERR', 'SWE', 'BURS', 'STAR', 'STOP', 'TIME', 'SPAC', 'STAT',
+                 'MODE', 'NCYC', 'INT', 'PER', 'TRIG'], key=len, reverse=True)
+
+_SPLIT = re.compile(r'[;\n]+|(?<=\S)(?=:(?:SOUR|OUTP|SYST))|(?<=\S)(?=\*)',
+                    re.IGNORECASE)
+
+_FUNC_NAMES = {'SIN': 'SIN', 'DC': 'DC', 'NOIS': 'NOISE', 'ARB': 'ARB'}
+
+
+def _normalize(header):
+    # ':SOURce1:VOLTage:OFFSet' -> (('SOUR', 1), ('VOLT', None), ...)
+    nodes = []
+    for node in header.strip(':').upper().split(':'):
+        match = re.fullmatch(r'([A-Z*?]+?)(\d*)(\??)', node)
+        if match is None:
+            return None
+        name, suffix, query = match.groups()
+        short = next((i for i in _NODES if name.startswith(i)), name)
+        nodes.append((short + query, int(suffix) if suffix else None))
+    return nodes
+
+
+def _number(text):
+    return float(text.strip())
+
+
+class ChannelState():
+    # Output configuration of one emulated channel
+    def __init__(self):
+        self.output = False
+        self.func = 'SIN'
+        self.freq = 1000.0
+        self.amp = 5.0
+        self.offset = 0.0
+        self.phase = 0.0
+        self.sps = None
+        self.arb = {}
+        self.n_points = 0
+        # Other settings, e.g., of the sweep and burst engines
+        self.settings = {}
+
+    def apply(self):
+        if self.func == 'ARB':
+            return f'"ARB,{self.sps:g},{self.amp:g},{self.offset:g}"'
+        return (f'"{self.func},{self.freq:g},{self.amp:g},{self.offset:g},'
+                f'{self.phase:g}"')
+
+
+class FakeInstrument():
+    """SCPI state machine of one emulated signal generator
+
+    Parameters
+    ----------
+    idn : str
+        Answer to *IDN?
+    n_chn : int (default 2)
+        Number of output channels
+
+    """
+    def __init__(self, idn='Rigol Technologies,DG1062Z,EMU0000,00.01.14',
+                 n_chn=2):
+        self.idn = idn
+        self.channels = {i: ChannelState() for i in range(1, n_chn + 1)}
+        self.errors = []
+
+    def reset(self):
+        self.channels = {i: ChannelState() for i in self.channels}
+        self.errors = []
+
+    def _error(self, msg):
+        self.errors.append(msg)
+
+    def handle(self, message):
+        """Execute one message and return the replies of its queries
+
+        Parameters
+        ----------
+        message : str
+            One or several commands, e.g., ':OUTPut1 ON;:SOUR1:VOLT?'
+
+        Returns
+        -------
+        replies : list of str
+
+        """
+        replies = []
+        for cmd in _SPLIT.split(message):
+            cmd = cmd.strip()
+            if cmd:
+                reply = self.execute(cmd)
+                if reply is not None:
+                    replies.append(reply)
+        return replies
+
+    def execute(self, cmd):
+        header, _, args = cmd.partition(' ')
+        args = [i.strip() for i in args.split(',')] if args.strip() else []
+        upper = header.upper()
+        if upper.startswith('*'):
+            return self._common(upper, args)
+        nodes = _normalize(header)
+        if nodes is None:
+            self._error('-102,"Syntax error"')
+            return None
+        try:
+            return self._subsystem(nodes, args)
+        except (ValueError, IndexError, KeyError):
+            self._error('-224,"Illegal parameter value"')
+            return None
+
+    def _common(self, header, args):
+        if header == '*IDN?':
+            return self.idn
+        elif header == '*OPC?':
+            return '1'
+        elif header == '*RST':
+            self.reset()
+        elif header in ['*CLS', '*WAI', '*TRG', '*OPC']:
+            if header == '*CLS':
+                self.errors = []
+        else:
+            self._error('-113,"Undefined header"')
+        return None
+
+    def _channel(self, suffix):
+        chn = 1 if suffix is None else suffix
+        return self.channels[chn]
+
+    def _subsystem(self, nodes, args):
+        names = [i[0] for i in nodes]
+        if names == ['SYST', 'ERR?']:
+            return self.errors.pop(0) if self.errors else '0,"No error"'
+
+        if names[0] in ['OUTP', 'OUTP?']:
+            state = self._channel(nodes[0][1])
+            if names[0] == 'OUTP?':
+                return 'ON' if state.output else 'OFF'
+            state.output = args[0].upper() in ['ON', '1']
+            return None
+
+        if names[0] != 'SOUR':
+            self._error('-113,"Undefined header"')
+            return None
+        state = self._channel(nodes[0][1])
+        path = names[1:]
+        if path == ['VOLT']:
+            state.amp = _number(args[0])
+        elif path == ['VOLT?']:
+            return f'{state.amp:g}'
+        elif path == ['VOLT', 'OFFS']:
+            state.offset = _number(args[0])
+        elif path == ['VOLT', 'OFFS?']:
+            return f'{state.offset:g}'
+        elif path == ['FREQ']:
+            state.freq = _number(args[0])
+        elif path == ['FREQ?']:
+            return f'{state.freq:g}'
+        elif path == ['PHAS']:
+            state.phase = _number(args[0])
+        elif path == ['PHAS?']:
+            return f'{state.phase:g}'
+        elif path == ['APPL?']:
+            return state.apply()
+        elif len(path) == 2 and path[0] == 'APPL' and \
+                path[1] in _FUNC_NAMES:
+            self._apply(state, path[1], [_number(i) for i in args])
+        elif path == ['DATA', 'POIN?']:
+            return str(state.n_points)
+        elif path == ['DATA', 'POIN']:
+            state.n_points = int(_number(args[-1]))
+            state.arb = {}
+        elif path == ['DATA', 'VAL']:
+            ind, val = int(_number(args[-2])), int(_number(args[-1]))
+            if not 1 <= ind <= max(state.n_points, 1) or \
+                    not 0 <= val <= 16383:
+                raise ValueError
+            state.arb[ind] = val
+        elif path == ['DATA', 'VAL?']:
+            # Points which were not written hold 0 V
+            return str(state.arb.get(int(_number(args[-1])), 8192))
+        elif all(i.rstrip('?') in _NODES for i in path):
+            key = ':'.join(path)
+            if key.endswith('?'):
+                return ','.join(state.settings.get(key[:-1], ['0']))
+            state.settings[key] = args
+        else:
+            self._error('-113,"Undefined header"')
+        return None
+
+    def _apply(self, state, func, values):
+        state.func = _FUNC_NAMES[func]
+        if func == 'SIN':
+            for attr, val in zip(['freq', 'amp', 'offset', 'phase'], values):
+                setattr(state, attr, val)
+        elif func == 'DC':
+            state.offset = values[2]
+        elif func == 'NOIS':
+            state.amp, state.offset = values[:2]
+        elif func == 'ARB':
+            state.sps = values[0]
+
+
+class FakeDevice():
+    """Serve a FakeInstrument on a pseudo-terminal linked as usbtmcN
+
+    Parameters
+    ----------
+    port_root : str
+        Directory in which the link is created
+    name : str (default 'usbtmc0')
+        Name of the link
+    latency : float (default 0.0)
+        Delay in seconds of every reply
+    idn_delay : float (default 0.0)
+        Additional delay in seconds of the reply to *IDN?
+    throughput : float | None (default None)
+        Maximum number of bytes per second read from the client
+    drop_rate : float (default 0.0)
+        Probability that a reply is not sent
+    seed : int | None (default None)
+        Seed of the random generator of dropped replies
+    instrument : FakeInstrument | None (default None)
+
+    """
+    def __init__(self, port_root, name='usbtmc0', latency=0.0, idn_delay=0.0,
+                 throughput=None, drop_rate=0.0, seed=None, instrument=None):
+        self.instrument = FakeInstrument() if instrument is None \
+            else instrument
+        self.latency = latency
+        self.idn_delay = idn_delay
+        self.throughput = throughput
+        self.drop_rate = drop_rate
+        self._random = random.Random(seed)
+        self.stats = {'messages': 0, 'bytes_in': 0, 'replies': 0,
+                      'dropped': 0}
+
+        self.master_fd, self._slave_fd = os.openpty()
+        # No echo, no line buffering and no newline translation
+        tty.setraw(self._slave_fd)
+        self.path = os.path.join(port_root, name)
+        if os.path.lexists(self.path):
+            os.remove(self.path)
+        os.symlink(os.ttyname(self._slave_fd), self.path)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True,
+                                        name=f'pytes-emulator-{name}')
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _serve(self):
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self.master_fd], [], [], 0.05)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.master_fd, 65536)
+            except OSError:
+                continue
+            self.stats['bytes_in'] += len(data)
+            if self.throughput:
+                # Do not read again before the budget of these bytes is used
+                time.sleep(len(data) / self.throughput)
+            self._respond(data.decode('utf8', errors='replace'))
+
+    def _respond(self, message):
+        self.stats['messages'] += 1
+        replies = self.instrument.handle(message)
+        if not replies:
+            return
+        delay = self.latency
+        if '*IDN?' in message.upper():
+            delay += self.idn_delay
+        if delay > 0:
+            time.sleep(delay)
+        if self.drop_rate > 0 and self._random.random() < self.drop_rate:
+            self.stats['dropped'] += 1
+            return
+        self.stats['replies'] += 1
+        os.write(self.master_fd, (';'.join(replies) + '\n').encode('utf8'))
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(1.0)
+        if os.path.lexists(self.path):
+            os.remove(self.path)
+        for fd in [self.master_fd, self._slave_fd]:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def serve(port_root, n_dev=1, **kwargs):
+    """Serve fake devices until SIGTERM/SIGINT and print their statistics
+
+    Parameters
+    ----------
+    port_root : str
+        Directory of the links usbtmc0 ... usbtmc<n_dev-1>
+    n_dev : int (default 1)
+        Number of fake devices
+    **kwargs
+        Fault parameters passed to FakeDevice
+
+    """
+    os.makedirs(port_root, exist_ok=True)
+    seed = kwargs.pop('seed', None)
+    devices = []
+    for i in range(n_dev):
+        instrument = FakeInstrument(
+            idn=f'Rigol Technologies,DG1062Z,EMU{i:04d},00.01.14')
+        devices.append(FakeDevice(
+            port_root, name=f'usbtmc{i}', instrument=instrument,
+            seed=None if seed is None else seed + i, **kwargs).start())
+    stop = threading.Event()
+
+    def handler(signum, frame):
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
+    print(json.dumps({'ready': [dev.path for dev in devices]}), flush=True)
+    while not stop.wait(0.1):
+        pass
+    for dev in devices:
+        dev.stop()
+    print(json.dumps({dev.path: dev.stats for dev in devices}), flush=True)
+
+
+class EmulatorProcess():
+    """Run the emulator in a child process
+
+    Parameters
+    ----------
+    port_root : str
+        Directory of the fake device links, pass it to
+        USBTMC.available_port_list(port_root)
+    n_dev : int (default 1)
+        Number of fake devices
+    **kwargs
+        latency, idn_delay, throughput, drop_rate and seed, see FakeDevice
+
+    Attributes
+    ----------
+    paths : list of str
+        Locations of the fake devices, available after start
+    stats : dict | None
+        Statistics of every device, available after stop
+
+    """
+    def __init__(self, port_root, n_dev=1, **kwargs):
+        self.port_root = port_root
+        self.n_dev = n_dev
+        self.kwargs = kwargs
+        self.paths = []
+        self.stats = None
+        self._proc = None
+
+    def start(self, timeout=10.0):
+        argv = [sys.executable, '-m', 'pytes', 'emulate', '--root',
+                self.port_root, '--n-dev', str(self.n_dev)]
+        for key, val in self.kwargs.items():
+            if val is not None:
+                argv += ['--' + key.replace('_', '-'), str(val)]
+        self._proc = subprocess.Popen(argv, stdout=subprocess.PIPE, text=True)
+        ready, _, _ = select.select([self._proc.stdout], [], [], timeout)
+        if not ready:
+            self.stop()
+            raise TimeoutError('Emulator did not start')
+        self.paths = json.loads(self._proc.stdout.readline())['ready']
+        return self
+
+    def stop(self):
+        if self._proc is None:
+            return self.stats
+        self._proc.send_signal(signal.SIGTERM)
+        out, _ = self._proc.communicate(timeout=5.0)
+        self._proc = None
+        if out.strip():
+            self.stats = json.loads(out.strip().splitlines()[-1])
+        return self.stats
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    from pytes.cli import add_emulate_arguments
+    parser = argparse.ArgumentParser(prog='pytes emulate',
+                                     description=__doc__.split('\n')[1])
+    add_emulate_arguments(parser)
+    args = parser.parse_args(argv)
+    serve(args.root, n_dev=args.n_dev, latency=args.latency,
+          idn_delay=args.idn_delay, throughput=args.throughput,
+          drop_rate=args.drop_rate, seed=args.seed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""
+Simplification of dense amplitude, offset or frequency trajectories.
+
+Sending every sample of a dense trajectory, e.g., the amplitude envelope of
+a closed-loop paradigm sampled at 100 Hz, saturates the link to the device.
+simplify() reduces the trajectory to the setpoints needed to stay within a
+tolerance and compile_envelope() turns them into a schedule of Command
+objects, which is executed by ProtocolRunner like a compiled protocol.
+
+The instrument holds a setpoint until the next command, i.e., its output
+is a staircase. Two methods are available:
+    hold : Greedy maximal segments whose range fits into 2 * tol, each set
+           to its mid-range value, give the smallest number of setpoints
+           for this zero-order hold.
+    linear : Ramer-Douglas-Peucker on the vertical distance with tol / 2
+             smooths the trajectory into straight lines, which are then
+             reduced with the hold method and tol / 2. The setpoints follow
+             the lines instead of the noise of the trajectory.
+
+The report of both methods states the reduction of the number of commands
+and the maximum deviation of the staircase output from the dense
+trajectory, which is at most tol for both methods.
+"""
+
+import numpy as np
+
+from pytes.protocol import Command, MIN_AMP, ProtocolError
+
+
+# Setter of each parameter, called with value= and chn=
+PARAM_METHODS = {'amp': 'tacs_amp', 'offset': 'offset',
+                 'frequency': 'frequency', 'phase': 'phase'}
+
+
+def hold_segments(values, tol):
+    """Start indices of the maximal segments with a range of at most 2 * tol
+
+    The running maximum and minimum are computed with NumPy over a window
+    which is doubled until the segment ends within it.
+
+    Returns
+    -------
+    starts : 1-D array of int
+
+    """
+    values = np.asarray(values, dtype=float)
+    n_val = len(values)
+    starts, i_start, window = [], 0, 256
+    while i_start < n_val:
+        starts.append(i_start)
+        while True:
+            seg = values[i_start:i_start + window]
+            over = np.flatnonzero(np.maximum.accumulate(seg) -
+                                  np.minimum.accumulate(seg) > 2 * tol)
+            if over.size or i_start + window >= n_val:
+                break
+            window *= 2
+        i_start = i_start + over[0] if over.size else n_val
+    return np.asarray(starts, dtype=int)
+
+
+def rdp_mask(t, values, tol):
+    """Vertices of the Ramer-Douglas-Peucker simplification
+
+    The distance of the samples to the chord of a segment is measured along
+    the value axis and computed for the whole segment at once.
+
+    Returns
+    -------
+    keep : 1-D array of bool
+        True for the samples kept as vertices
+
+    """
+    t = np.asarray(t, dtype=float)
+    values = np.asarray(values, dtype=float)
+    keep = np.zeros(len(values), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(values) - 1)]
+    while stack:
+        i_a, i_b = stack.pop()
+        if i_b - i_a < 2:
+            continue
+        chord = values[i_a] + (values[i_b] - values[i_a]) * \
+            (t[i_a+1:i_b] - t[i_a]) / (t[i_b] - t[i_a])
+        dist = np.abs(values[i_a+1:i_b] - chord)
+        i_max = int(np.argmax(dist))
+        if dist[i_max] > tol:
+            i_mid = i_a + 1 + i_max
+            keep[i_mid] = True
+            stack += [(i_a, i_mid), (i_mid, i_b)]
+    return keep
+
+
+def simplify(t, values, tol, method='hold'):
+    """Reduce a dense trajectory to the setpoints within the tolerance
+
+    Parameters
+    ----------
+    t : 1-D array
+        Increasing sample times in seconds
+    values : 1-D array
+        Trajectory, e.g., amplitude in Volt
+    tol : float
+        Maximum deviation from the trajectory
+    method : 'hold' | 'linear' (default 'hold')
+        Reduction of the trajectory, see module docstring
+
+    Returns
+    -------
+    t_set, v_set : 1-D array
+        Times and values of the setpoints
+    report : dict
+        Number of samples and commands, their ratio 'reduction', and the
+        maximum and RMS deviation of the staircase output held between
+        the setpoints
+
+    """
+    t = np.asarray(t, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if t.ndim != 1 or t.shape != values.shape or len(t) == 0:
+        raise ValueError('t and values must be 1-D arrays of equal length')
+    if np.any(np.diff(t) <= 0):
+        raise ValueError('t must be strictly increasing')
+    if tol < 0:
+        raise ValueError('tol must not be negative')
+
+    if method == 'hold':
+        target, hold_tol = values, tol
+    elif method == 'linear':
+        # Half of the tolerance for the lines, half for their staircase
+        keep = rdp_mask(t, values, tol / 2)
+        target = np.interp(t, t[keep], values[keep])
+        hold_tol = tol / 2
+    else:
+        raise ValueError(f'Unsupported method {method}')
+    starts = hold_segments(target, hold_tol)
+    ends = np.append(starts[1:], len(values))
+    v_set = np.array([(target[i:j].max() + target[i:j].min()) / 2
+                      for i, j in zip(starts, ends)])
+    t_set = t[starts]
+
+    # Staircase output of the setpoints at the sample times
+    dev = np.abs(np.repeat(v_set, ends - starts) - values)
+    report = {'method': method, 'tol': tol, 'n_samples': len(values),
+              'n_commands': len(t_set),
+              'reduction': len(values) / len(t_set),
+              'max_deviation': float(dev.max()),
+              'rms_deviation': float(np.sqrt(np.mean(dev ** 2)))}
+    return t_set, v_set, report
+
+
+def compile_envelope(t, values, tol, param='amp', chn=1, method='hold',
+                     t0=0.0):
+    """Compile a dense trajectory into a schedule of setpoint commands
+
+    Parameters
+    ----------
+    t, values, tol, method
+        See simplify
+    param : 'amp' | 'offset' | 'frequency' | 'phase' (default 'amp')
+        Parameter following the trajectory
+    chn : 1 | 2 (default 1)
+        Output channel
+    t0 : float (default 0.0)
+        Offset in seconds of the schedule relative to the session start
+
+    Returns
+    -------
+    schedule : list of Command
+        Executable with ProtocolRunner(sig_gen).run(schedule)
+    report : dict
+        See simplify
+
+    """
+    if param not in PARAM_METHODS:
+        raise ProtocolError(f'Unsupported parameter {param}, use one of '
+                            f'{list(PARAM_METHODS)}')
+    t = np.asarray(t, dtype=float)
+    t_set, v_set, report = simplify(t - t[0], values, tol, method=method)
+    if param == 'amp' and v_set.min() < MIN_AMP:
+        raise ProtocolError(f'Amplitude setpoint {v_set.min()} is below '
+                            f'the minimum of {MIN_AMP} V')
+    schedule = [Command(t0 + t_i, chn, PARAM_METHODS[param],
+                        {'value': float(v_i)}, 'envelope')
+                for t_i, v_i in zip(t_set, v_set)]
+    return schedule, report
@@ -0,0 +1,174 @@
+"""
+Emergency stop of all outputs of all open devices.
+
+emergency_stop() first interrupts fades, arbitrary waveform uploads and
+link recoveries of every open SignalGenerator and sends a pre-encoded
+output-off command for all of its channels. The off command bypasses the
+I/O lock and is written on a separate file descriptor or VISA session, so
+it is never queued behind a command in progress. Everything else which
+could switch an output on again, i.e., running timeline sessions and
+scheduled commands, is cancelled afterwards, such that the off command
+never waits for them. A command dispatched in between is refused by the
+stopped device. The latency of every device is measured and reported.
+
+The stop stays in effect, i.e., fades, arbitrary waveform uploads and link
+recoveries of the stopped devices end right away, until rearm() is called.
+
+The stop can be triggered by
+    - calling emergency_stop(), e.g., from a keyboard shortcut of the GUI
+    - a signal, after install_signal_handler()
+    - a Watchdog, if the controlling code or process stops heartbeating
+"""
+
+import signal
+import socket
+import threading
+import time
+import weakref
+
+
+# Objects exposing emergency_stop(), registered on creation
+_DEVICES = weakref.WeakSet()
+_ABORTABLES = weakref.WeakSet()
+
+
+def register_device(sig_gen):
+    _DEVICES.add(sig_gen)
+
+
+def register_abortable(obj):
+    # E.g. TimelineExecutor and CommandScheduler, cancelled after the
+    # outputs are switched off
+    _ABORTABLES.add(obj)
+
+
+def emergency_stop(verbose=True):
+    """Cancel all pending actions and switch off all outputs
+
+    Returns
+    -------
+    report : dict
+        'latency' maps every device to the time in seconds from the call to
+        the completed off command, 'worst' is the maximum latency and
+        'failed' lists devices whose off command raised
+
+    """
+    t0 = time.monotonic()
+    latency, failed = {}, []
+    for sig_gen in list(_DEVICES):
+        name = str(getattr(sig_gen.protocol, 'dev_name',
+                           getattr(sig_gen.protocol, 'dev', sig_gen)))
+        try:
+            sig_gen.emergency_stop()
+            latency[name] = time.monotonic() - t0
+        except Exception as e:
+            failed.append(name)
+            print(f'Emergency stop of {name} failed: {e}')
+
+    # The outputs are off already, cancelling may wait for a command in
+    # progress
+    for obj in list(_ABORTABLES):
+        try:
+            obj.emergency_stop()
+        except Exception as e:
+            print(f'Emergency stop of {obj} failed: {e}')
+
+    report = {'latency': latency, 'failed': failed,
+              'worst': max(latency.values(), default=0.0)}
+    if verbose:
+        print(f'EMERGENCY STOP: {len(latency)} device(s) off, worst-case '
+              f'latency {report["worst"]*1e3:.3f} ms')
+    return report
+
+
+def rearm():
+    # Re-enable all devices after an emergency stop
+    for sig_gen in list(_DEVICES):
+        sig_gen.rearm()
+
+
+def install_signal_handler(signums=None):
+    """Trigger the emergency stop on the given signals
+
+    Parameters
+    ----------
+    signums : list | None (default None)
+        Signals to handle, if None, SIGTERM and SIGUSR1 (if available)
+
+    """
+    if signums is None:
+        signums = [signal.SIGTERM]
+        if hasattr(signal, 'SIGUSR1'):
+            signums.append(signal.SIGUSR1)
+
+    def handler(signum, frame):
+        emergency_stop()
+
+    for signum in signums:
+        signal.signal(signum, handler)
+
+
+class Watchdog():
+    """Emergency stop if no heartbeat arrives within the timeout
+
+    Parameters
+    ----------
+    timeout : float (default 1.0)
+        Maximum interval between two heartbeats in seconds
+    address : tuple | None (default None)
+        If given, (host, port) of a UDP socket on which heartbeats of
+        another process are received, see send_heartbeat. Otherwise, call
+        heartbeat() from the controlling code.
+
+    """
+    def __init__(self, timeout=1.0, address=None):
+        self.timeout = timeout
+        self.fired = False
+        self.report = None
+        self._last = time.monotonic()
+        self._stop = threading.Event()
+        self._sock = None
+        if address is not None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.bind(address)
+            self._sock.settimeout(min(timeout / 4, 0.05))
+            threading.Thread(target=self._receive, daemon=True,
+                             name='pytes-watchdog-rx').start()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='pytes-watchdog')
+        self._thread.start()
+
+    def heartbeat(self):
+        self._last = time.monotonic()
+
+    def _receive(self):
+        while not self._stop.is_set():
+            try:
+                self._sock.recv(16)
+                self.heartbeat()
+            except socket.timeout:
+                pass
+            except OSError:
+                return
+
+    def _run(self):
+        while not self._stop.wait(min(self.timeout / 10, 0.05)):
+            if time.monotonic() - self._last > self.timeout:
+                self.fired = True
+                print(f'Watchdog: no heartbeat for {self.timeout} s')
+                self.report = emergency_stop()
+                return
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(1.0)
+        if self._sock is not None:
+            self._sock.close()
+
+
+def send_heartbeat(address, sock=None):
+    # Heartbeat of a controlling process for a Watchdog listening on address
+    if sock is None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.sendto(b'\x01', address)
+    return sock
@@ -0,0 +1,196 @@
+"""
+Timestamped stimulation events for EEG alignment.
+
+SignalGenerator publishes one event per state-changing command, e.g., output
+on/off, fade steps, parameter changes and the completion of an arbitrary
+waveform upload. Each event carries the monotonic timestamps
+(time.monotonic_ns) taken right before and after the write. Events are put
+into a bounded queue and sent by a background thread over UDP or a Unix
+datagram socket, such that publishing never blocks the command path. If the
+queue is full, the event is dropped and counted.
+
+Binary encoding of one event (little endian, 32 bytes + command):
+
+    kind : uint8    chn : uint8    seq : uint32
+    t_before : int64 (ns)    t_after : int64 (ns)    value : float64
+    len(cmd) : uint16    cmd : utf8 bytes
+"""
+
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+
+
+OUTPUT_ON = 1
+OUTPUT_OFF = 2
+FADE_STEP = 3
+PARAM = 4
+ARB_DONE = 5
+COMMAND = 6
+TRIGGER = 7
+
+EVENT_NAMES = {OUTPUT_ON: 'output_on', OUTPUT_OFF: 'output_off',
+               FADE_STEP: 'fade_step', PARAM: 'param', ARB_DONE: 'arb_done',
+               COMMAND: 'command', TRIGGER: 'trigger'}
+
+_HEADER = struct.Struct('<BBIqqdH')
+
+DEFAULT_ADDRESS = ('127.0.0.1', 5679)
+
+
+class Event():
+    """A state change of the stimulation output
+
+    Attributes
+    ----------
+    kind : int
+        One of OUTPUT_ON, OUTPUT_OFF, FADE_STEP, PARAM, ARB_DONE, COMMAND,
+        TRIGGER
+    chn : int
+        Output channel, 0 if not channel specific
+    seq : int
+        Sequence number of the publisher, gaps indicate dropped events
+    t_before, t_after : int
+        time.monotonic_ns() right before and after the write
+    value : float
+        New value of the parameter, e.g., amplitude, nan if not applicable
+    cmd : str
+        The SCPI command sent to the device
+
+    """
+    __slots__ = ['kind', 'chn', 'seq', 't_before', 't_after', 'value', 'cmd']
+
+    def __init__(self, kind, chn, seq, t_before, t_after, value=float('nan'),
+                 cmd=''):
+        self.kind = kind
+        self.chn = chn
+        self.seq = seq
+        self.t_before = t_before
+        self.t_after = t_after
+        self.value = value
+        self.cmd = cmd
+
+    def encode(self):
+        cmd = self.cmd.encode('utf8')[:65535]
+        return _HEADER.pack(self.kind, self.chn, self.seq, self.t_before,
+                            self.t_after, self.value, len(cmd)) + cmd
+
+    @classmethod
+    def decode(cls, data):
+        kind, chn, seq, t_before, t_after, value, n_cmd = \
+            _HEADER.unpack_from(data)
+        cmd = bytes(data[_HEADER.size:_HEADER.size+n_cmd]).decode('utf8')
+        return cls(kind, chn, seq, t_before, t_after, value, cmd)
+
+    def __repr__(self):
+        return (f'Event({EVENT_NAMES.get(self.kind, self.kind)}, '
+                f'chn={self.chn}, seq={self.seq}, t_before={self.t_before}, '
+                f't_after={self.t_after}, value={self.value}, '
+                f'cmd={self.cmd!r})')
+
+
+class EventPublisher():
+    """Send events to a local UDP port or Unix datagram socket
+
+    Parameters
+    ----------
+    address : tuple | str (default ('127.0.0.1', 5679))
+        (host, port) for UDP or the location of a Unix datagram socket
+    maxsize : int (default 4096)
+        Size of the in-memory queue. Events are dropped if it is full.
+
+    Attributes
+    ----------
+    dropped : int
+        Number of events dropped because the queue was full or the receiver
+        was not reachable
+
+    """
+    def __init__(self, address=DEFAULT_ADDRESS, maxsize=4096):
+        self.address = address
+        if isinstance(address, str):
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        else:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._seq = 0
+        self._seq_lock = threading.Lock()
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._send_loop, daemon=True,
+                                        name='pytes-events')
+        self._thread.start()
+
+    def publish(self, kind, chn, t_before, t_after, value=float('nan'),
+                cmd=''):
+        # Never blocks, the event is dropped if the queue is full
+        with self._seq_lock:
+            seq = self._seq
+            self._seq += 1
+        try:
+            self._queue.put_nowait(Event(kind, chn or 0, seq, t_before,
+                                         t_after, value, cmd))
+        except queue.Full:
+            self.dropped += 1
+
+    def _send_loop(self):
+        while True:
+            event = self._queue.get()
+            if event is None:
+                break
+            try:
+                self._sock.sendto(event.encode(), self.address)
+            except OSError:
+                # No receiver listening
+                self.dropped += 1
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(1.0)
+        self._sock.close()
+
+
+class EventListener():
+    """Receive events, e.g., in the EEG recording process
+
+    Parameters
+    ----------
+    address : tuple | str (default ('127.0.0.1', 5679))
+        Same address as given to the EventPublisher
+    timeout : float | None (default None)
+        Timeout in seconds of receive
+
+    """
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=None):
+        if isinstance(address, str):
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            if os.path.exists(address):
+                os.remove(address)
+        else:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(address)
+        self._sock.settimeout(timeout)
+        self.address = address
+
+    def receive(self):
+        data = self._sock.recv(65536)
+        return Event.decode(data)
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.receive()
+            except socket.timeout:
+                return
+
+    def close(self):
+        self._sock.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+def now_ns():
+    # Timestamp source of all events
+    return time.monotonic_ns()
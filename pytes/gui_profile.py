@@ -0,0 +1,328 @@
+"""
+Responsiveness profiler of the Tk main loop of the GUI.
+
+Every Python callback of Tk, i.e., widget commands, event bindings and after
+callbacks, is called through tkinter.CallWrapper. While a TkProfiler is
+installed, tkinter.CallWrapper is replaced by a subclass which times every
+callback. Only callbacks registered after install are timed, hence the
+profiler is installed before the widgets are created, see
+PyTESWindow(profile=True) or `pytes gui --profile trace.json`.
+
+A heartbeat callback runs every `heartbeat` seconds in the main loop. If it
+is late by more than `threshold` seconds, the main loop stalled. While the
+heartbeat is overdue, a watchdog thread samples the Python stack of the main
+thread and the device command in progress, i.e., the SCPI command passed to
+a driver method on the stack. A stall is attributed to the innermost
+callback running during the samples, or to the longest callback since the
+previous heartbeat if the stall ended before the first sample.
+
+report() summarizes the latency of every callback and the stalls, export()
+writes a trace in the Chrome trace event format, which can be opened with
+chrome://tracing or https://ui.perfetto.dev.
+"""
+
+import collections
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import tkinter
+
+import numpy as np
+
+
+# Driver methods whose arguments identify the device command in progress
+DEVICE_CALLS = ['set_cmd', 'write_raw', 'query_cmd', 'read_cmd',
+                'query_block', 'emergency_write']
+# Names of the arguments of DEVICE_CALLS holding the command
+_COMMAND_ARGS = ['scpi_command', 'cmd', 'data']
+
+
+def callback_name(func):
+    """Readable name of a Tk callback
+
+    The function scheduled with after is used instead of the wrapper of
+    tkinter, lambdas are named by their location.
+
+    """
+    if getattr(func, '__qualname__', '') == 'Misc.after.<locals>.callit':
+        try:
+            free = dict(zip(func.__code__.co_freevars,
+                            [i.cell_contents for i in func.__closure__]))
+            return 'after ' + callback_name(free['func'])
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return 'after ' + func.__name__
+    # Entries of an OptionMenu call the command of the menu
+    func = getattr(func, '_setit__callback', None) or func
+    func = getattr(func, '__func__', func)
+    name = getattr(func, '__qualname__', None) or type(func).__name__
+    code = getattr(func, '__code__', None)
+    if '<lambda>' in name and code is not None:
+        name += (f' ({os.path.basename(code.co_filename)}:'
+                 f'{code.co_firstlineno})')
+    return name
+
+
+def device_command(frame):
+    # Command passed to the innermost driver call on the stack, None if
+    # no device I/O is in progress
+    while frame is not None:
+        if frame.f_code.co_name in DEVICE_CALLS:
+            local = frame.f_locals
+            for arg in _COMMAND_ARGS:
+                cmd = local.get(arg)
+                if isinstance(cmd, bytes):
+                    cmd = cmd.decode('utf8', errors='replace')
+                if isinstance(cmd, str):
+                    return f'{frame.f_code.co_name}: {cmd.strip()[:200]}'
+        frame = frame.f_back
+    return None
+
+
+class _ProfiledCallWrapper(tkinter.CallWrapper):
+    # Replaces tkinter.CallWrapper while a profiler is installed
+    profiler = None
+
+    def __call__(self, *args):
+        profiler = _ProfiledCallWrapper.profiler
+        if profiler is None or self.func == profiler._beat:
+            return super().__call__(*args)
+        return profiler._call(self, args)
+
+
+class TkProfiler():
+    """Time the Tk callbacks and detect stalls of the main loop
+
+    Parameters
+    ----------
+    window : tkinter.Tk
+        Root window of the main loop
+    threshold : float (default 0.1)
+        A heartbeat late by more than threshold seconds is a stall
+    heartbeat : float (default 0.02)
+        Interval of the heartbeat in seconds
+    sample_interval : float (default 0.005)
+        Interval of the stack samples during a stall in seconds
+    max_events : int (default 100000)
+        Number of callback calls kept for the trace
+
+    Attributes
+    ----------
+    durations : dict
+        Durations in seconds of all calls, indexed by the callback name
+    stalls : list of dict
+        Start 't' relative to start, 'duration', 'handler', 'device'
+        command, the most frequent 'stack' and all 'samples' of each stall
+    lags : list of float
+        Delay of every heartbeat in seconds
+
+    """
+    def __init__(self, window, threshold=0.1, heartbeat=0.02,
+                 sample_interval=0.005, max_events=100000):
+        self.window = window
+        self.threshold = threshold
+        self.heartbeat = heartbeat
+        self.sample_interval = sample_interval
+        self.durations = collections.defaultdict(list)
+        self.events = collections.deque(maxlen=max_events)
+        self.stalls = []
+        self.lags = []
+        self._active = []
+        self._since_beat = []
+        self._stall = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._beat_cmd = None
+        self._wrapper = None
+        self._main_ident = threading.main_thread().ident
+        self.t0 = time.perf_counter()
+        self._t_beat = self.t0
+
+    def install(self):
+        # Time every callback registered from now on
+        if _ProfiledCallWrapper.profiler is not None:
+            raise RuntimeError('Another TkProfiler is installed')
+        _ProfiledCallWrapper.profiler = self
+        self._wrapper = tkinter.CallWrapper
+        tkinter.CallWrapper = _ProfiledCallWrapper
+        return self
+
+    def uninstall(self):
+        if _ProfiledCallWrapper.profiler is self:
+            _ProfiledCallWrapper.profiler = None
+            tkinter.CallWrapper = self._wrapper
+
+    def start(self):
+        """Install the profiler, start the heartbeat and the watchdog"""
+        if _ProfiledCallWrapper.profiler is not self:
+            self.install()
+        self._main_ident = threading.get_ident()
+        self._stop.clear()
+        self._t_beat = time.perf_counter()
+        # Registered once, the heartbeat is not timed as a callback
+        self._beat_cmd = self.window.register(self._beat)
+        self.window.tk.call('after', int(self.heartbeat * 1e3),
+                            self._beat_cmd)
+        self._thread = threading.Thread(target=self._watch, daemon=True,
+                                        name='pytes-tk-watchdog')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+        self.uninstall()
+
+    def _call(self, wrapper, args):
+        # Run a callback in the main loop and record its duration
+        name = callback_name(wrapper.func)
+        self._active.append(name)
+        t_start = time.perf_counter()
+        try:
+            return self._wrapper.__call__(wrapper, *args)
+        finally:
+            dur = time.perf_counter() - t_start
+            self._active.pop()
+            self.durations[name].append(dur)
+            self.events.append((t_start - self.t0, dur, name,
+                                str(wrapper.widget), len(self._active)))
+            self._since_beat.append((dur, name))
+
+    def _beat(self):
+        now = time.perf_counter()
+        lag = now - self._t_beat - self.heartbeat
+        self.lags.append(lag)
+        with self._lock:
+            stall, self._stall = self._stall, None
+        if lag > self.threshold:
+            self._record_stall(now - lag, lag, stall)
+        self._since_beat = []
+        self._t_beat = now
+        if not self._stop.is_set():
+            self.window.tk.call('after', int(self.heartbeat * 1e3),
+                                self._beat_cmd)
+
+    def _record_stall(self, t_start, duration, stall):
+        samples = [] if stall is None else stall['samples']
+        handler = None
+        # Innermost callback running during the samples
+        for sample in samples:
+            if sample['callbacks']:
+                handler = sample['callbacks'][-1]
+        if handler is None and self._since_beat:
+            handler = max(self._since_beat)[1]
+        devices = [i['device'] for i in samples if i['device']]
+        stacks = collections.Counter(tuple(i['stack']) for i in samples)
+        self.stalls.append({
+            't': t_start - self.t0, 'duration': duration,
+            'handler': handler,
+            'device': collections.Counter(devices).most_common(1)[0][0]
+            if devices else None,
+            'stack': list(stacks.most_common(1)[0][0]) if stacks else [],
+            'samples': samples})
+
+    def _watch(self):
+        # Sample the main thread while the heartbeat is overdue
+        while not self._stop.wait(self.sample_interval):
+            now = time.perf_counter()
+            if now - self._t_beat - self.heartbeat <= self.threshold:
+                continue
+            frame = sys._current_frames().get(self._main_ident)
+            if frame is None:
+                continue
+            sample = {'t': now - self.t0,
+                      'callbacks': list(self._active),
+                      'device': device_command(frame),
+                      'stack': [f'{os.path.basename(i.filename)}:{i.lineno}'
+                                f' {i.name}' for i in
+                                traceback.extract_stack(frame, limit=30)]}
+            del frame
+            with self._lock:
+                if self._stall is None:
+                    self._stall = {'samples': []}
+                self._stall['samples'].append(sample)
+
+    def summary(self):
+        """Latency of every callback
+
+        Returns
+        -------
+        summary : list of dict
+            'name', number of 'calls', 'total', 'mean', 'p95' and 'max'
+            duration in seconds and number of 'stalls' of every callback,
+            sorted by the maximum duration
+
+        """
+        n_stalls = collections.Counter(i['handler'] for i in self.stalls)
+        rows = []
+        for name, durations in self.durations.items():
+            dur = np.asarray(durations)
+            rows.append({'name': name, 'calls': len(dur),
+                         'total': float(dur.sum()),
+                         'mean': float(dur.mean()),
+                         'p95': float(np.percentile(dur, 95)),
+                         'max': float(dur.max()),
+                         'stalls': n_stalls.get(name, 0)})
+        return sorted(rows, key=lambda row: row['max'], reverse=True)
+
+    def report(self, n_top=10):
+        # Slowest callbacks, the stalls and the delay of the heartbeat
+        lags = np.asarray(self.lags) if self.lags else np.zeros(1)
+        return {'callbacks': self.summary()[:n_top],
+                'stalls': [{key: val for key, val in i.items()
+                            if key != 'samples'} for i in self.stalls],
+                'heartbeats': len(self.lags),
+                'lag_p95': float(np.percentile(lags, 95)),
+                'lag_max': float(lags.max())}
+
+    def print_report(self, n_top=10):
+        report = self.report(n_top)
+        print(f'{"callback":<50} {"calls":>6} {"mean/ms":>8} {"p95/ms":>8} '
+              f'{"max/ms":>8} {"stalls":>6}')
+        for row in report['callbacks']:
+            print(f'{row["name"][:50]:<50} {row["calls"]:>6} '
+                  f'{row["mean"]*1e3:>8.1f} {row["p95"]*1e3:>8.1f} '
+                  f'{row["max"]*1e3:>8.1f} {row["stalls"]:>6}')
+        print(f'{len(report["stalls"])} stalls above '
+              f'{self.threshold*1e3:.0f} ms, heartbeat delay p95 '
+              f'{report["lag_p95"]*1e3:.1f} ms, max '
+              f'{report["lag_max"]*1e3:.1f} ms')
+        for stall in report['stalls']:
+            print(f'  {stall["t"]:.3f} s: {stall["duration"]*1e3:.1f} ms in '
+                  f'{stall["handler"]}'
+                  + (f', device {stall["device"]}' if stall['device']
+                     else ''))
+
+    def export(self, path):
+        """Save the callbacks, stalls and stack samples as a trace
+
+        The file in the Chrome trace event format shows the callbacks of
+        the main loop in one row and the stalls with their samples in
+        another row.
+
+        """
+        trace = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid,
+                  'args': {'name': name}}
+                 for tid, name in [(1, 'Tk callbacks'), (2, 'stalls')]]
+        for t_start, dur, name, widget, depth in self.events:
+            trace.append({'name': name, 'ph': 'X', 'pid': 1, 'tid': 1,
+                          'ts': t_start * 1e6, 'dur': dur * 1e6,
+                          'args': {'widget': widget, 'depth': depth}})
+        for stall in self.stalls:
+            trace.append({'name': f'stall in {stall["handler"]}', 'ph': 'X',
+                          'pid': 1, 'tid': 2, 'ts': stall['t'] * 1e6,
+                          'dur': stall['duration'] * 1e6,
+                          'args': {'device': stall['device'],
+                                   'stack': stall['stack']}})
+            for sample in stall['samples']:
+                trace.append({'name': 'sample', 'ph': 'i', 's': 't',
+                              'pid': 1, 'tid': 2, 'ts': sample['t'] * 1e6,
+                              'args': {key: sample[key] for key in
+                                       ['callbacks', 'device', 'stack']}})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+        return path
@@ -0,0 +1,482 @@
+"""
+SignalGenerator in a dedicated I/O process.
+
+In the process of a PsychoPy paradigm or a NumPy-heavy decoder, GIL
+contention and garbage collection can delay stimulation commands by tens of
+milliseconds. IsolatedSignalGenerator starts the driver in its own process
+and offers the SignalGenerator API as a proxy. Calls are pickled into a
+single-producer/single-consumer ring in multiprocessing.shared_memory and
+the I/O process answers through a second ring, without pipes.
+
+The I/O process timestamps every call with time.monotonic_ns(), which is
+system-wide on Linux. The proxy reports the latency from enqueueing a call
+to the start of its write, and the duration of the write.
+
+emergency_stop() of the proxy does not queue behind pending calls. It
+releases a multiprocessing.Semaphore watched by a thread of the I/O
+process, which switches off the outputs and discards all calls enqueued
+before the stop. The proxy returns once the I/O process acknowledges the
+completed off command through a second semaphore, such that the latency
+recorded by pytes.estop is the time until the output is off. If no
+acknowledgement arrives in time, the stop of the device is reported as
+failed.
+"""
+
+import multiprocessing
+import pickle
+import signal
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from pytes import estop
+
+
+_WRAP = 0xFFFFFFFF
+# Lock of this process only, see _fence
+_FENCE = threading.Lock()
+
+
+def _fence():
+    # Full memory barrier between the accesses before and after the call.
+    # Releasing a lock orders all earlier accesses before the release,
+    # acquiring it all later accesses after the acquire, and an acquire
+    # is not reordered before an earlier release (ARMv8, x86-64)
+    _FENCE.acquire()
+    _FENCE.release()
+    _FENCE.acquire()
+    _FENCE.release()
+
+
+class ShmRing():
+    """Single-producer/single-consumer byte ring in shared memory
+
+    Records are a uint32 length followed by the payload, padded to 8 bytes.
+    The header holds the head (written only by the producer) and the tail
+    (written only by the consumer) as uint64 byte counters on separate cache
+    lines, and a 'mark' field for the producer. No lock is shared by the
+    processes, neither side ever waits for the other. Aligned 8-byte
+    stores of a counter are atomic, and a memory barrier between the data
+    and the counter, see _fence, makes sure the other side never sees a
+    counter before the data it covers, also on weakly ordered CPUs, e.g.,
+    ARM. The barrier only involves a lock private to each process.
+
+    push must only be called by one thread of one process at a time, pop
+    by one thread of the other process.
+
+    Parameters
+    ----------
+    name : str | None (default None)
+        Name of an existing ring to attach to. If None, a ring is created.
+    capacity : int (default 1 MiB)
+        Size of the data area in bytes when creating a ring
+
+    """
+    _HEADER = 192
+    # Indices of the uint64 header fields
+    _HEAD, _CAP, _TAIL, _MARK = 0, 1, 8, 16
+
+    def __init__(self, name=None, capacity=1 << 20):
+        if name is None:
+            capacity = (capacity + 7) // 8 * 8
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=self._HEADER + capacity)
+            self._owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self._ctr = np.ndarray((self._HEADER // 8,), dtype=np.uint64,
+                               buffer=self.shm.buf)
+        if self._owner:
+            self._ctr[:] = 0
+            self._ctr[self._CAP] = capacity
+        self.capacity = int(self._ctr[self._CAP])
+        self._data = self.shm.buf[self._HEADER:self._HEADER + self.capacity]
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def mark(self):
+        return int(self._ctr[self._MARK])
+
+    @mark.setter
+    def mark(self, value):
+        self._ctr[self._MARK] = value
+
+    def __len__(self):
+        # Number of bytes in use
+        return int(self._ctr[self._HEAD]) - int(self._ctr[self._TAIL])
+
+    def push(self, payload):
+        """Append one record, returns False if the ring is full"""
+        n_byte = len(payload)
+        rec = 8 + (n_byte + 7) // 8 * 8
+        if rec > self.capacity // 2:
+            raise ValueError(f'Record of {n_byte} bytes exceeds half of the '
+                             f'ring capacity of {self.capacity} bytes')
+        head = int(self._ctr[self._HEAD])
+        pos = head % self.capacity
+        wrap = self.capacity - pos if pos + rec > self.capacity else 0
+        if head + wrap + rec - int(self._ctr[self._TAIL]) > self.capacity:
+            return False
+        # The consumer has finished reading the space before the tail
+        _fence()
+        if wrap:
+            struct.pack_into('<I', self._data, pos, _WRAP)
+            pos = 0
+        struct.pack_into('<I', self._data, pos, n_byte)
+        self._data[pos + 8:pos + 8 + n_byte] = payload
+        # The record is complete before the head covers it
+        _fence()
+        self._ctr[self._HEAD] = head + wrap + rec
+        return True
+
+    def pop(self):
+        """Remove the oldest record, returns None if the ring is empty"""
+        tail = int(self._ctr[self._TAIL])
+        if tail == int(self._ctr[self._HEAD]):
+            return None
+        # The record is not read before the head which covers it
+        _fence()
+        pos = tail % self.capacity
+        n_byte = struct.unpack_from('<I', self._data, pos)[0]
+        if n_byte == _WRAP:
+            tail += self.capacity - pos
+            pos = 0
+            n_byte = struct.unpack_from('<I', self._data, pos)[0]
+        payload = bytes(self._data[pos + 8:pos + 8 + n_byte])
+        # The record is read before the producer may overwrite it
+        _fence()
+        self._ctr[self._TAIL] = tail + 8 + (n_byte + 7) // 8 * 8
+        return payload
+
+    def pop_wait(self, timeout=None, spin=0.001, sleep=0.0001):
+        """Wait for the next record
+
+        The ring is busy-polled for spin seconds, then polled every sleep
+        seconds. Returns None on timeout.
+
+        """
+        t_start = time.monotonic()
+        while True:
+            payload = self.pop()
+            if payload is not None:
+                return payload
+            t_wait = time.monotonic() - t_start
+            if timeout is not None and t_wait > timeout:
+                return None
+            if t_wait > spin:
+                time.sleep(sleep)
+
+    def close(self):
+        # Release the views before the shared memory itself
+        del self._ctr
+        self._data.release()
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+
+def _watch_stop(stop, stopped, stop_ok, cmd_ring, discard):
+    # Thread of the I/O process, the stop is executed even while the main
+    # thread is blocked in a call
+    while True:
+        stop.acquire()
+        # Several stops are handled at once
+        while stop.acquire(False):
+            pass
+        # Calls enqueued before the stop must not switch the output on again
+        discard[0] = cmd_ring.mark
+        report = estop.emergency_stop(verbose=False)
+        # Acknowledge the completed off command to the proxy
+        stop_ok.value = not report['failed']
+        stopped.release()
+
+
+def _io_process(cmd_name, ack_name, stop, stopped, stop_ok, sg_kwargs,
+                spin):
+    # Main function of the I/O process
+    from pytes.signal_generator import SignalGenerator
+    # Ctrl-C in the terminal is handled by the controlling process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    cmd_ring = ShmRing(name=cmd_name)
+    try:
+        ack_ring = ShmRing(name=ack_name)
+    except BaseException:
+        cmd_ring.close()
+        raise
+    discard = [-1]
+
+    def ack(msg):
+        while not ack_ring.push(pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)):
+            time.sleep(0.0001)
+
+    try:
+        try:
+            sig_gen = SignalGenerator(**sg_kwargs)
+        except Exception as e:
+            ack((0, 0, 0, 0, None, repr(e)))
+            return
+        threading.Thread(target=_watch_stop,
+                         args=(stop, stopped, stop_ok, cmd_ring, discard),
+                         daemon=True, name='pytes-io-stop').start()
+        ack((0, 0, 0, 0, sig_gen.encoder.dialect.name, None))
+        _serve_calls(sig_gen, cmd_ring, ack, discard, spin)
+    finally:
+        cmd_ring.close()
+        ack_ring.close()
+
+
+def _serve_calls(sig_gen, cmd_ring, ack, discard, spin):
+    while True:
+        payload = cmd_ring.pop_wait(timeout=1.0, spin=spin)
+        if payload is None:
+            continue
+        seq, t_enqueue, method, args, kwargs = pickle.loads(payload)
+        if method == '__close__':
+            ack((seq, t_enqueue, 0, 0, None, None))
+            break
+        if seq <= discard[0]:
+            ack((seq, t_enqueue, 0, 0, None, 'Discarded by emergency stop'))
+            continue
+        result, error = None, None
+        t_start = time.monotonic_ns()
+        try:
+            result = getattr(sig_gen, method)(*args, **kwargs)
+        except Exception as e:
+            error = repr(e)
+        t_end = time.monotonic_ns()
+        try:
+            ack((seq, t_enqueue, t_start, t_end, result, error))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            ack((seq, t_enqueue, t_start, t_end, None, error))
+
+
+class IsolatedSignalGenerator():
+    """Proxy of a SignalGenerator running in a dedicated I/O process
+
+    Every public SignalGenerator method, e.g., on, off, amp, para_set, is
+    forwarded to the I/O process.
+
+    Parameters
+    ----------
+    dev : str
+        Device location, required because the I/O process cannot prompt
+        for a device
+    protocol : 'USBTMC' | 'VISA' | 'MOCK' | None (default None)
+        Driver of the I/O process, see SignalGenerator
+    wait : bool (default True)
+        If True, calls block until the I/O process has executed them and
+        return their result. If False, calls return their sequence number
+        right after enqueueing, results are available via result(seq).
+    capacity : int (default 1 MiB)
+        Size of each ring in bytes
+    spin : float (default 0.01)
+        Duration in seconds the I/O process busy-polls after a call before
+        it polls every 0.1 ms
+    timeout : float (default 10.0)
+        Timeout in seconds of starting the process and of waiting for a
+        result
+    stop_timeout : float (default 0.5)
+        Time in seconds emergency_stop waits for the I/O process to
+        acknowledge the completed off command
+    **sg_kwargs
+        Further arguments of SignalGenerator, e.g., dialect
+
+    """
+    def __init__(self, dev, protocol=None, wait=True, capacity=1 << 20,
+                 spin=0.01, timeout=10.0, stop_timeout=0.5, **sg_kwargs):
+        self.dev = dev
+        self.wait = wait
+        self.timeout = timeout
+        self.stop_timeout = stop_timeout
+        # Read by estop.emergency_stop for the name of the device
+        self.protocol = None
+        self._seq = 0
+        self._results = {}
+        self.errors = {}
+        self.records = []
+        self._cmd = self._ack = self._proc = None
+        # The rings have a single producer and consumer, calls of several
+        # threads of this process are serialized
+        self._send_lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        sg_kwargs.update(dev=dev, protocol=protocol)
+        ctx = multiprocessing.get_context('spawn')
+        # Unlike setting a multiprocessing.Event, releasing a semaphore
+        # never waits for the other process, which may have died
+        self._stop = ctx.Semaphore(0)
+        self._stopped = ctx.Semaphore(0)
+        self._stop_ok = ctx.Value('b', 0, lock=False)
+        try:
+            self._cmd = ShmRing(capacity=capacity)
+            self._ack = ShmRing(capacity=capacity)
+            self._proc = ctx.Process(
+                target=_io_process, daemon=True, name='pytes-io',
+                args=(self._cmd.name, self._ack.name, self._stop,
+                      self._stopped, self._stop_ok, sg_kwargs, spin))
+            self._proc.start()
+            _, _, _, _, dialect, error = self._wait_ack(0)
+            if error is not None:
+                raise RuntimeError(f'I/O process failed to connect: {error}')
+        except BaseException:
+            # E.g., the I/O process died, the shared memory must not leak
+            self._shutdown(graceful=False)
+            raise
+        self.dialect = dialect
+        estop.register_device(self)
+
+    def __repr__(self):
+        return f'IsolatedSignalGenerator({self.dev!r})'
+
+    def _drain(self):
+        # Collect all available acknowledgements
+        with self._drain_lock:
+            while True:
+                payload = self._ack.pop()
+                if payload is None:
+                    return
+                msg = pickle.loads(payload)
+                seq, t_enqueue, t_start, t_end, result, error = msg
+                if t_start:
+                    self.records.append((t_enqueue, t_start, t_end))
+                if error is not None:
+                    self.errors[seq] = error
+                self._results[seq] = msg
+
+    def _wait_ack(self, seq):
+        t_start = time.monotonic()
+        while seq not in self._results:
+            self._drain()
+            if seq in self._results:
+                break
+            if not self._proc.is_alive():
+                raise RuntimeError('The I/O process terminated')
+            if time.monotonic() - t_start > self.timeout:
+                raise TimeoutError(f'No acknowledgement of call {seq}')
+            time.sleep(0.00005)
+        return self._results.pop(seq)
+
+    def send(self, method, *args, **kwargs):
+        """Enqueue a call without waiting, returns its sequence number"""
+        self._drain()
+        with self._send_lock:
+            self._seq += 1
+            payload = pickle.dumps((self._seq, time.monotonic_ns(), method,
+                                    args, kwargs), pickle.HIGHEST_PROTOCOL)
+            t_start = time.monotonic()
+            while not self._cmd.push(payload):
+                if time.monotonic() - t_start > self.timeout:
+                    raise TimeoutError('The command ring is full')
+                time.sleep(0.0001)
+            return self._seq
+
+    def result(self, seq):
+        """Wait for a call and return its result, raises if it failed"""
+        _, _, _, _, result, error = self._wait_ack(seq)
+        if error is not None:
+            self.errors.pop(seq, None)
+            raise RuntimeError(f'Call {seq} failed in the I/O process: '
+                               f'{error}')
+        return result
+
+    def call(self, method, *args, **kwargs):
+        seq = self.send(method, *args, **kwargs)
+        return self.result(seq) if self.wait else seq
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+
+        def remote(*args, **kwargs):
+            return self.call(method, *args, **kwargs)
+        remote.__name__ = method
+        return remote
+
+    def emergency_stop(self):
+        """Switch off the outputs, bypassing the pending calls
+
+        Pending calls are discarded by the I/O process. Returns once the
+        I/O process acknowledges the completed off command.
+
+        Raises
+        ------
+        TimeoutError
+            If the off command is not acknowledged within stop_timeout, the
+            state of the outputs is unknown
+        RuntimeError
+            If the off command failed in the I/O process or the I/O process
+            is not running
+
+        """
+        if self._proc is None or not self._proc.is_alive():
+            raise RuntimeError(f'The I/O process of {self.dev} is not '
+                               'running, the state of the outputs is unknown')
+        # Acknowledgements of earlier stops
+        while self._stopped.acquire(False):
+            pass
+        self._cmd.mark = self._seq
+        self._stop.release()
+        if not self._stopped.acquire(timeout=self.stop_timeout):
+            raise TimeoutError(f'Emergency stop of {self.dev} not '
+                               f'acknowledged within {self.stop_timeout} s')
+        if not self._stop_ok.value:
+            raise RuntimeError(f'Emergency stop of {self.dev} failed in the '
+                               'I/O process')
+
+    def latency_report(self):
+        """Latency of all acknowledged calls
+
+        Returns
+        -------
+        report : dict
+            Number of calls and the percentiles of 'enqueue_to_write', the
+            time from enqueueing a call to the start of its execution, and
+            of 'write', the duration of the execution, in ms
+
+        """
+        self._drain()
+        if not self.records:
+            return {'n': 0}
+        rec = np.asarray(self.records, dtype=float)
+        report = {'n': len(rec)}
+        for name, dur in [('enqueue_to_write', rec[:, 1] - rec[:, 0]),
+                          ('write', rec[:, 2] - rec[:, 1])]:
+            dur = dur / 1e6
+            p50, p95, p99 = np.percentile(dur, [50, 95, 99])
+            report[name] = {'p50_ms': float(p50), 'p95_ms': float(p95),
+                            'p99_ms': float(p99), 'max_ms': float(dur.max()),
+                            'mean_ms': float(dur.mean())}
+        return report
+
+    def close(self):
+        self._shutdown(graceful=True)
+
+    def _shutdown(self, graceful):
+        # Stop the I/O process and release the shared memory of the rings
+        try:
+            if self._proc is not None and self._proc.is_alive():
+                if graceful:
+                    try:
+                        self._wait_ack(self.send('__close__'))
+                    except (RuntimeError, TimeoutError):
+                        graceful = False
+                if not graceful:
+                    self._proc.terminate()
+                self._proc.join(1.0)
+        finally:
+            for ring in [self._cmd, self._ack]:
+                if ring is not None:
+                    ring.close()
+            self._cmd = self._ack = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
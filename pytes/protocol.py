@@ -0,0 +1,593 @@
+"""
+Declarative stimulation protocols.
+
+A protocol describes the session of each output channel as a list of blocks,
+stored as JSON or YAML file, e.g.,
+
+    device: /dev/usbtmc1
+    protocol: USBTMC
+    channels:
+      1:
+        - {block: config, mode: tACS, amp: 1, freq: 10, phase: 0, offset: 0}
+        - {block: ramp, to: 1, duration: 30}
+        - {block: hold, duration: 600}
+        - {block: ramp, to: 0.002, duration: 30}
+        - {block: off}
+      2:
+        - {block: config, mode: tDCS, amp: 0.002}
+        - {block: sham, amp: 1, ramp: 30, duration: 660}
+
+Supported blocks:
+
+    config : mode ('tACS' | 'tDCS' | 'tRNS' | 'arb') and its parameters,
+             amp, freq, phase, offset, or file/data and sps for 'arb'
+    on / off : switch the output
+    ramp : linear amplitude change to `to` within `duration` seconds, with
+           `rate` updates per second (default 2), starting at `from`
+           (default current amplitude)
+    hold : keep the current state for `duration` seconds
+    sham : ramp up to `amp` and down again within `ramp` seconds each, then
+           no stimulation until `duration` seconds are over
+    repeat : execute `blocks` `count` times
+    envelope : amplitude following the dense trajectory `values` (or the
+               .npy/text `file`) sampled with `rate` per second, reduced
+               to the setpoints within `tol` (default 0.01), see
+               pytes.envelope
+
+In mode tDCS, the amp of config and sham and the `to` of ramp are signed
+DC levels, e.g., negative for cathodal stimulation, with a magnitude of at
+least MIN_AMP. The peak voltage is checked against the limits of the
+device, see pytes.capabilities.
+
+The protocol is compiled into a schedule, i.e., a list of Command objects
+sorted by their offset, which is validated before any command is sent. The
+ProtocolRunner executes the schedule against any object exposing the
+SignalGenerator method set, without loading the GUI. dry_run executes it in
+virtual time against the MockDriver, which gives the exact command timeline
+of a session within milliseconds.
+"""
+
+import csv
+import json
+import os
+import time
+
+import numpy as np
+
+from pytes.capabilities import (Capabilities, DEFAULT_CAPABILITIES, MIN_AMP,
+                                validate_schedule)
+from pytes.clock import REAL_CLOCK, VirtualClock
+from pytes.timeline import Step, Timeline, TimelineExecutor
+
+
+STIM_MODES = ['tACS', 'tDCS', 'tRNS', 'arb']
+
+
+class ProtocolError(ValueError):
+    # Raised when a protocol cannot be compiled into a valid schedule
+    pass
+
+
+class Command():
+    """A single planned call of a SignalGenerator method
+
+    Parameters
+    ----------
+    t : float
+        Offset in seconds relative to the start of the session
+    chn : 1 | 2
+        Output channel
+    method : str
+        Name of the SignalGenerator method, e.g., 'on', 'para_set'
+    kwargs : dict | None (default None)
+        Keyword arguments of the method, excluding chn
+    label : str (default '')
+        Name of the block the command is compiled from
+
+    """
+    def __init__(self, t, chn, method, kwargs=None, label=''):
+        self.t = float(t)
+        self.chn = chn
+        self.method = method
+        self.kwargs = {} if kwargs is None else kwargs
+        self.label = label
+
+    def __call__(self, driver):
+        return getattr(driver, self.method)(chn=self.chn, **self.kwargs)
+
+    def __repr__(self):
+        return (f'Command(t={self.t:.3f}, chn={self.chn}, '
+                f'method={self.method!r}, label={self.label!r})')
+
+
+def load_protocol(path):
+    """Load a protocol from a .json, .yaml or .yml file
+
+    Returns
+    -------
+    protocol : dict
+
+    """
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, 'r') as f:
+        if ext in ['.yaml', '.yml']:
+            try:
+                import yaml
+            except ModuleNotFoundError:
+                print('---------------------------------------------------')
+                print('Use pip install -U pyyaml to load YAML protocols')
+                print('---------------------------------------------------')
+                raise
+            protocol = yaml.safe_load(f)
+        elif ext == '.json':
+            protocol = json.load(f)
+        else:
+            raise ProtocolError(f'Unsupported protocol format {ext}')
+
+    if not isinstance(protocol, dict) or 'channels' not in protocol:
+        raise ProtocolError('A protocol must contain the key "channels"')
+    return protocol
+
+
+class _ChannelState():
+    # Book-keeping of a channel while compiling its blocks
+    def __init__(self, chn):
+        self.chn = chn
+        self.t = 0.0
+        self.mode = None
+        self.amp = None
+        self.offset = 0.0
+
+
+def _positive(block, key, default=None):
+    val = block.get(key, default)
+    if val is None:
+        raise ProtocolError(f'Block {block} requires the key "{key}"')
+    val = float(val)
+    if val < 0 or not np.isfinite(val):
+        raise ProtocolError(f'"{key}" of block {block} must be a finite, '
+                            'non-negative number')
+    return val
+
+
+def _level(block, key, state, default=None):
+    # Peak-to-peak amplitude of tACS and tRNS, or the signed level of tDCS,
+    # e.g., negative for cathodal stimulation
+    if state.mode != 'tDCS':
+        return _positive(block, key, default)
+    val = block.get(key, default)
+    if val is None:
+        raise ProtocolError(f'Block {block} requires the key "{key}"')
+    val = float(val)
+    if not np.isfinite(val) or abs(val) < MIN_AMP:
+        raise ProtocolError(f'"{key}" of block {block} must be a finite DC '
+                            f'level with a magnitude of at least {MIN_AMP}')
+    return val
+
+
+def _amp_command(state, val, label):
+    # The command adjusting the amplitude depends on the stimulation mode
+    if state.mode == 'tACS':
+        return Command(state.t, state.chn, 'tacs_amp', {'value': val}, label)
+    elif state.mode == 'tDCS':
+        return Command(state.t, state.chn, 'offset', {'value': val}, label)
+    elif state.mode == 'tRNS':
+        return Command(state.t, state.chn, 'para_set',
+                       {'para_dict': {'noise': [val, state.offset]}}, label)
+    raise ProtocolError(f'Amplitude of CH{state.chn} cannot be changed in '
+                        f'mode {state.mode}, configure tACS/tDCS/tRNS first')
+
+
+def _config(block, state):
+    mode = block.get('mode')
+    if mode not in STIM_MODES:
+        raise ProtocolError(f'Unsupported stimulation mode {mode}, use one '
+                            f'of {STIM_MODES}')
+    state.mode = mode
+    if mode == 'arb':
+        if 'data' in block:
+            data, sps = block['data'], block.get('sps')
+        elif 'file' in block:
+            import pickle
+            with open(block['file'], 'rb') as f:
+                arb_data = pickle.load(f)
+            data, sps = arb_data['data'], arb_data['sps']
+        else:
+            raise ProtocolError('Mode arb requires either "data" or "file"')
+        if sps is None:
+            raise ProtocolError('Mode arb requires the sampling rate "sps"')
+        state.amp = None
+        return [Command(state.t, state.chn, 'arb_func',
+                        {'data': np.asarray(data, dtype=float),
+                         'sps': sps}, 'config')]
+
+    amp = _level(block, 'amp', state)
+    offset = float(block.get('offset', 0))
+    state.amp, state.offset = amp, offset
+    if mode == 'tACS':
+        para = {'sin': [_positive(block, 'freq'), amp, offset,
+                        float(block.get('phase', 0))]}
+    elif mode == 'tDCS':
+        para = {'dc': amp}
+    else:
+        para = {'noise': [amp, offset]}
+    return [Command(state.t, state.chn, 'para_set', {'para_dict': para},
+                    'config')]
+
+
+def _ramp(block, state):
+    duration = _positive(block, 'duration')
+    rate = _positive(block, 'rate', 2)
+    start = block.get('from', state.amp)
+    if start is None:
+        raise ProtocolError(f'Ramp of CH{state.chn} requires "from" or a '
+                            'preceding config block')
+    stop = _level(block, 'to', state)
+    n_step = max(int(duration * rate), 1)
+    t0 = state.t
+    cmds = []
+    for i_step, val in enumerate(np.linspace(float(start), stop,
+                                             n_step + 1)[1:]):
+        state.t = t0 + (i_step + 1) * duration / n_step
+        cmds.append(_amp_command(state, float(val), 'ramp'))
+    state.t = t0 + duration
+    state.amp = stop
+    return cmds
+
+
+def _sham(block, state):
+    # Ramp up and directly down again, then no stimulation for the rest
+    amp = _level(block, 'amp', state)
+    ramp = _positive(block, 'ramp', 30)
+    duration = _positive(block, 'duration', 2 * ramp)
+    if duration < 2 * ramp:
+        raise ProtocolError('Sham duration must cover both ramps')
+    t0 = state.t
+    # The polarity of a cathodal tDCS sham does not change
+    base = float(np.copysign(MIN_AMP, amp))
+    cmds = [_amp_command(state, base, 'sham'),
+            Command(state.t, state.chn, 'on', label='sham')]
+    state.amp = base
+    cmds += _ramp({'to': amp, 'duration': ramp,
+                   'rate': block.get('rate', 2)}, state)
+    cmds += _ramp({'to': base, 'duration': ramp,
+                   'rate': block.get('rate', 2)}, state)
+    cmds.append(Command(state.t, state.chn, 'off', label='sham'))
+    state.t = t0 + duration
+    return cmds
+
+
+def _envelope(block, state):
+    from pytes.envelope import simplify
+    if 'values' in block:
+        values = np.asarray(block['values'], dtype=float)
+    elif 'file' in block:
+        values = np.load(block['file']) if block['file'].endswith('.npy') \
+            else np.loadtxt(block['file'])
+    else:
+        raise ProtocolError('Envelope block requires "values" or "file"')
+    rate = _positive(block, 'rate')
+    t = np.arange(len(values)) / rate
+    try:
+        t_set, v_set, _ = simplify(t, values, float(block.get('tol', 0.01)),
+                                   method=block.get('method', 'hold'))
+    except ValueError as e:
+        raise ProtocolError(f'Envelope of CH{state.chn}: {e}')
+    if state.mode in ['tACS', 'tRNS'] and v_set.min() < MIN_AMP:
+        raise ProtocolError(f'Envelope of CH{state.chn} goes below the '
+                            f'minimum amplitude of {MIN_AMP} V')
+    t0 = state.t
+    cmds = []
+    for t_i, v_i in zip(t_set, v_set):
+        state.t = t0 + t_i
+        cmds.append(_amp_command(state, float(v_i), 'envelope'))
+    state.t = t0 + len(values) / rate
+    state.amp = float(v_set[-1])
+    return cmds
+
+
+def _compile_blocks(blocks, state, depth=0):
+    if not isinstance(blocks, list):
+        raise ProtocolError(f'Blocks of CH{state.chn} must be a list')
+    if depth > 8:
+        raise ProtocolError('Too deeply nested repeat blocks')
+
+    cmds = []
+    for block in blocks:
+        kind = block.get('block') if isinstance(block, dict) else None
+        if kind is True or kind is False:
+            # YAML 1.1 loads unquoted on/off as booleans
+            kind = 'on' if kind else 'off'
+        if kind == 'config':
+            cmds += _config(block, state)
+        elif kind in ['on', 'off']:
+            cmds.append(Command(state.t, state.chn, kind, label=kind))
+        elif kind == 'ramp':
+            cmds += _ramp(block, state)
+        elif kind == 'hold':
+            state.t += _positive(block, 'duration')
+        elif kind == 'sham':
+            cmds += _sham(block, state)
+        elif kind == 'envelope':
+            cmds += _envelope(block, state)
+        elif kind == 'repeat':
+            count = int(_positive(block, 'count'))
+            for _ in range(count):
+                cmds += _compile_blocks(block.get('blocks'), state, depth+1)
+        else:
+            raise ProtocolError(f'Unsupported block {block}')
+    return cmds
+
+
+def compile_protocol(protocol):
+    """Compile a protocol into a validated schedule
+
+    Parameters
+    ----------
+    protocol : dict
+        Protocol as loaded by load_protocol
+
+    Returns
+    -------
+    schedule : list of Command
+        All commands of all channels, sorted by their offset. Commands with
+        the same offset keep the order of the protocol.
+
+    """
+    schedule = []
+    for chn, blocks in protocol['channels'].items():
+        chn = int(chn)
+        if chn not in [1, 2]:
+            raise ProtocolError(f'Unsupported output channel {chn}')
+        schedule += _compile_blocks(blocks, _ChannelState(chn))
+    schedule.sort(key=lambda cmd: cmd.t)
+    return schedule
+
+
+def check_schedule(schedule, capabilities=None):
+    """Raise a ProtocolError listing all violations of device limits
+
+    Parameters
+    ----------
+    schedule : list of Command
+    capabilities : pytes.capabilities.Capabilities | None (default None)
+        If None, the default limits
+
+    """
+    capabilities = DEFAULT_CAPABILITIES if capabilities is None \
+        else capabilities
+    violations = validate_schedule(schedule, capabilities)
+    if violations:
+        lines = [i['message'] for i in violations[:20]]
+        if len(violations) > 20:
+            lines.append(f'... and {len(violations) - 20} more')
+        raise ProtocolError(f'{len(violations)} violations of the limits of '
+                            f'{capabilities.name}:\n' + '\n'.join(lines))
+
+
+def schedule_duration(schedule):
+    return max((cmd.t for cmd in schedule), default=0.0)
+
+
+class ProtocolRunner():
+    """Execute a compiled schedule and record the timing of every command
+
+    Parameters
+    ----------
+    driver : SignalGenerator-like object
+        Object exposing the SignalGenerator method set
+    spin : float (default 0.002)
+        Duration in seconds busy-waited before each command for a precise
+        onset
+    clock : RealClock | VirtualClock (default REAL_CLOCK)
+        Clock of the session, must be the clock of the driver
+    capabilities : pytes.capabilities.Capabilities | None (default None)
+        Limits the schedule is validated against before it runs, if None
+        the capabilities of the driver or the default limits
+    tolerance : float | None (default 0.1)
+        Maximum delay in seconds of a command, e.g., behind a blocking arb
+        upload or the pauses of para_set. A later command aborts the run
+        with an OverrunError. If None, late commands are executed.
+
+    Attributes
+    ----------
+    records : list of dict
+        Planned and actual timestamps of every executed command
+    t_start : float | None
+        Start time of the last run on the clock
+
+    """
+    def __init__(self, driver, spin=0.002, clock=REAL_CLOCK,
+                 capabilities=None, tolerance=0.1):
+        self.driver = driver
+        self.spin = spin
+        self.clock = clock
+        if capabilities is None:
+            # Remote drivers forward every attribute as a method
+            capabilities = getattr(driver, 'capabilities', None)
+            if not isinstance(capabilities, Capabilities):
+                capabilities = DEFAULT_CAPABILITIES
+        self.capabilities = capabilities
+        self.tolerance = tolerance
+        self.records = []
+        self.t_start = None
+
+    def run(self, schedule, delay=0.1):
+        """Execute the schedule and block until it is finished
+
+        Every channel runs in its own session, all sessions share the start
+        time, such that a blocking command of one channel does not delay
+        the other. On KeyboardInterrupt, a failing command or a command
+        later than the tolerance, the outputs of all channels are switched
+        off. The whole schedule is validated against the capabilities
+        first, no command is sent if a limit is violated.
+
+        Returns
+        -------
+        records : list of dict
+            Sorted by the planned time, also available as self.records if
+            the run is aborted by an error
+
+        Raises
+        ------
+        ProtocolError
+            If the schedule violates the capabilities of the device
+        OverrunError
+            If a command started later than the tolerance
+        Exception
+            The error of a failing command
+
+        """
+        check_schedule(schedule, self.capabilities)
+        timelines = {}
+        for cmd in schedule:
+            if cmd.chn not in timelines:
+                timelines[cmd.chn] = Timeline(on_abort=[
+                    Step(0, self.driver.off, kwargs={'chn': cmd.chn},
+                         label='off')])
+            timelines[cmd.chn].add(cmd.t, cmd, args=(self.driver,),
+                                   label=f'CH{cmd.chn} {cmd.method}')
+
+        executor = TimelineExecutor(clock=self.clock)
+        sessions = executor.start_sync(timelines, delay=delay,
+                                       spin=self.spin,
+                                       tolerance=self.tolerance)
+        sessions = list(sessions.values())
+        self.t_start = sessions[0].t_start if sessions else self.clock.now()
+        try:
+            while any(session.is_alive() for session in sessions):
+                if any(session.error is not None for session in sessions):
+                    # The other channels must not continue on their own
+                    executor.abort()
+                executor.join(0.2)
+        except KeyboardInterrupt:
+            executor.abort()
+            executor.join()
+
+        self.records = sorted(
+            [{'label': label,
+              'planned': t_plan - self.t_start,
+              'actual': t_actual - self.t_start,
+              'finished': t_done - self.t_start,
+              'error': t_actual - t_plan}
+             for session in sessions
+             for label, t_plan, t_actual, t_done in session.records],
+            key=lambda rec: rec['planned'])
+        for session in sessions:
+            if session.error is not None:
+                raise session.error
+        return self.records
+
+    def save(self, path):
+        # Save the records as csv file
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['label', 'planned',
+                                                   'actual', 'finished',
+                                                   'error'])
+            writer.writeheader()
+            writer.writerows(self.records)
+
+    def summary(self):
+        if not self.records:
+            return 'No command executed'
+        err = np.asarray([rec['error'] for rec in self.records]) * 1e3
+        return (f'{len(err)} commands, onset error mean {err.mean():.3f} ms, '
+                f'max {err.max():.3f} ms')
+
+
+def dry_run(protocol, latency=0.0, dialect=None):
+    """Run a protocol in virtual time against the MockDriver
+
+    Sleeps, fades and waits of the session take no real time, such that a
+    session of hours is executed within milliseconds.
+
+    Parameters
+    ----------
+    protocol : dict | list of Command
+        Protocol as loaded by load_protocol, or a compiled schedule
+    latency : float (default 0.0)
+        Simulated duration of every write in seconds
+    dialect : pytes.scpi.Dialect | None (default None)
+        Command dialect, if None the default dialect
+
+    Returns
+    -------
+    result : dict
+        'commands', the list of (t, SCPI command) with t in seconds from
+        the session start, 'duration', the time in seconds until the last
+        command was finished, and 'records', see ProtocolRunner.run
+
+    """
+    from pytes.signal_generator import SignalGenerator
+    schedule = compile_protocol(protocol) if isinstance(protocol, dict) \
+        else protocol
+    clock = VirtualClock()
+    sig_gen = SignalGenerator(protocol='MOCK', dialect=dialect, clock=clock)
+    sig_gen.protocol.latency = latency
+    n_init = len(sig_gen.protocol.log)
+    runner = ProtocolRunner(sig_gen, spin=0.0, clock=clock)
+    records = runner.run(schedule, delay=0.0)
+    # The sessions of the channels log concurrently
+    commands = sorted([(t - runner.t_start, cmd)
+                       for t, cmd in sig_gen.protocol.log[n_init:]],
+                      key=lambda i: i[0])
+    duration = max([rec['finished'] for rec in records] +
+                   [t for t, _ in commands[-1:]], default=0.0)
+    return {'commands': commands, 'duration': duration, 'records': records}
+
+
+def run_protocol(path, dev=None, protocol=None, log=None, check=False,
+                 dry=False):
+    """Load, compile and run a protocol file with a SignalGenerator
+
+    Parameters
+    ----------
+    path : str
+        Location of the .json/.yaml protocol
+    dev, protocol : str | None (default None)
+        Override the device and driver given in the protocol file
+    log : str | None (default None)
+        Location of the csv file for the planned vs actual timestamps
+    check : bool (default False)
+        If True, only compile the protocol and print the schedule
+    dry : bool (default False)
+        If True, run the protocol in virtual time against the MockDriver
+        and print the command timeline, see dry_run
+
+    """
+    config = load_protocol(path)
+    schedule = compile_protocol(config)
+    print(f'{len(schedule)} commands, duration '
+          f'{schedule_duration(schedule):.1f} s')
+    if check:
+        for cmd in schedule:
+            print(cmd)
+        check_schedule(schedule)
+        return schedule
+    if dry:
+        t0 = time.time()
+        result = dry_run(schedule)
+        for t, cmd in result['commands']:
+            print(f'{t:10.3f}  {cmd}')
+        print(f'{len(result["commands"])} SCPI commands, session duration '
+              f'{result["duration"]:.3f} s, simulated in '
+              f'{time.time() - t0:.3f} s')
+        if log is not None:
+            with open(log, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['t', 'command'])
+                writer.writerows(result['commands'])
+        return result
+
+    from pytes.signal_generator import SignalGenerator
+    dev = config.get('device', '/dev/usbtmc1') if dev is None else dev
+    protocol = config.get('protocol') if protocol is None else protocol
+    runner = ProtocolRunner(SignalGenerator(dev=dev, protocol=protocol))
+    t0 = time.time()
+    try:
+        runner.run(schedule)
+    finally:
+        if log is not None:
+            runner.save(log)
+    print(f'Finished after {time.time() - t0:.1f} s, {runner.summary()}')
+    return runner.records
@@ -1,26 +1,190 @@
 
 import os
+import pickle
 import sys
-import time
 import platform
 import numpy as np
 
-import matplotlib
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-
 import tkinter as tk
 import tkinter.font as tkFont
 from tkinter import (Label, Entry, Button, Checkbutton, OptionMenu,
                      StringVar, messagebox, simpledialog)
 
 from pytes.signal_generator import SignalGenerator as SG
+from pytes.events import FADE_STEP
+from pytes import estop
+from pytes.clock import REAL_CLOCK
+from pytes.capabilities import MODES
+from pytes.timeline import Timeline, Step, TimelineExecutor
+
+
+class ChannelConfig():
+    """Typed content of the entries of one channel
+
+    Parameters
+    ----------
+    mode : 'tACS' | 'tDCS' | 'tRNS' | 'Arb'
+        Stimulation type
+    texts : list of str
+        Texts of the entries in the order of names, i.e., arbitrary data
+        path, voltage, frequency, phase, offset, fade in/out and stimulation
+        duration
+
+    Raises
+    ------
+    ValueError
+        If an entry used by the mode or a duration is not a number
+
+    """
+    names = ['arb_path', 'amp', 'freq', 'phase', 'offset', 'fade_dur',
+             'stim_dur']
+    # Entries defining the signal of each mode, the others are ignored
+    used = {'tACS': ['amp', 'freq', 'phase', 'offset'],
+            'tDCS': ['amp'],
+            'tRNS': ['amp', 'offset'],
+            'Arb': ['arb_path']}
+    # Parameters of para_set changed separately in tACS mode
+    keys = {'amp': 'amp', 'freq': 'frequency', 'phase': 'phase',
+            'offset': 'offset'}
+    labels = {'amp': 'Voltage', 'freq': 'Frequency', 'phase': 'Phase',
+              'offset': 'Offset', 'fade_dur': 'Fade In/Out',
+              'stim_dur': 'Stim. Duration'}
+
+    def __init__(self, mode, texts):
+        self.mode = mode
+        texts = dict(zip(self.names, [str(i).strip() for i in texts]))
+        self.arb_path = texts['arb_path']
+        for name in self.names[1:]:
+            try:
+                val = float(texts[name])
+            except ValueError:
+                # Unused entries and empty durations are None
+                if name in self.used[mode] or texts[name] != '' and \
+                        name in ['fade_dur', 'stim_dur']:
+                    raise ValueError(f'{self.labels[name]} must be a '
+                                     f'number, got "{texts[name]}"')
+                val = None
+            setattr(self, name, val)
+
+    def replace(self, **kwargs):
+        # Copy with some values replaced
+        config = object.__new__(ChannelConfig)
+        config.__dict__.update(self.__dict__, **kwargs)
+        return config
+
+    def signal(self):
+        # Values defining the output signal, compared to decide on a redraw
+        return (self.mode,) + tuple(getattr(self, i)
+                                    for i in self.used[self.mode])
+
+    def full(self):
+        # Parameters configuring the channel completely
+        if self.mode == 'tACS':
+            return {'sin': [self.freq, self.amp, self.offset, self.phase]}
+        elif self.mode == 'tDCS':
+            return {'dc': self.amp}
+        elif self.mode == 'tRNS':
+            return {'noise': [self.amp, self.offset]}
+        return {'arb': self.arb_path}
+
+    def commands(self, previous):
+        """Parameters to send to change the device from a previous config
+
+        Parameters
+        ----------
+        previous : ChannelConfig | None
+            Configuration applied before, None if unknown
+
+        Returns
+        -------
+        commands : dict
+            Parameters for SignalGenerator.para_set, {'arb': path} if the
+            arbitrary data must be uploaded, empty if nothing changed
+
+        """
+        if previous is None or previous.mode != self.mode:
+            return self.full()
+        changed = [i for i in self.used[self.mode]
+                   if getattr(self, i) != getattr(previous, i)]
+        if not changed:
+            return {}
+        if self.mode == 'tACS':
+            return {self.keys[i]: getattr(self, i) for i in changed}
+        # A single command configures the other modes completely
+        return self.full()
+
+    def violations(self, capabilities, arb=None):
+        """Limits of a device violated by the configuration
+
+        Parameters
+        ----------
+        capabilities : pytes.capabilities.Capabilities
+        arb : dict | None (default None)
+            Loaded arbitrary data, required in Arb mode
+
+        Returns
+        -------
+        violations : list of dict
+            See Capabilities.check_setpoints
+
+        """
+        if self.mode == 'Arb':
+            return capabilities.check_waveform(arb['data'], arb['sps'])
+        # The level of tDCS is the offset of the DC output
+        dc = self.mode == 'tDCS'
+        mode = {'tACS': 'sin', 'tDCS': 'dc', 'tRNS': 'noise'}[self.mode]
+        return capabilities.check_setpoints(
+            [0.0], [0.0 if dc else self.amp],
+            [self.amp if dc else self.offset],
+            [np.nan if self.freq is None else self.freq],
+            mode=[MODES[mode]])
+
+    def load_arb(self):
+        # Arbitrary data saved as pickle, dict with 'data' and 'sps'
+        with open(self.arb_path, 'rb') as f:
+            return pickle.load(f)
+
+    def waveform(self, arb=None):
+        """Time and values of the signal for the plot
+
+        Parameters
+        ----------
+        arb : dict | None (default None)
+            Loaded arbitrary data, required in Arb mode
 
-matplotlib.use('TkAgg')
+        """
+        if self.mode == 'Arb':
+            len_data = len(arb['data'])
+            return (np.linspace(0.0, len_data/arb['sps'], len_data),
+                    arb['data'])
+        t = np.arange(0.0, 1.0, 0.001)
+        if self.mode == 'tACS':
+            return t, self.offset + self.amp * np.sin(
+                2*np.pi*self.freq*t + self.phase / 180 * np.pi)
+        elif self.mode == 'tDCS':
+            return t, self.amp * np.ones(t.shape)
+        return t, np.random.normal(loc=self.offset, scale=self.amp,
+                                   size=t.shape)
 
 
 class PyTESWindow():
-    def __init__(self, window, fontsize=20):
+    """Main window of the GUI
+
+    Parameters
+    ----------
+    window : tkinter.Tk
+        Root window
+    fontsize : int (default 20)
+        Unused, the font size is derived from the screen size
+    clock : RealClock | VirtualClock (default REAL_CLOCK)
+        Clock of the sessions and the device, see pytes.clock
+    profile : bool | dict (default False)
+        If True or a dict of arguments of pytes.gui_profile.TkProfiler,
+        all callbacks are timed and stalls of the main loop are sampled,
+        see self.profiler
+
+    """
+    def __init__(self, window, fontsize=20, clock=REAL_CLOCK, profile=False):
 
         is_conda = os.path.exists(os.path.join(sys.prefix, 'conda-meta'))
         if is_conda:
@@ -29,14 +193,37 @@ class PyTESWindow():
                                    visulization, please use other version \
                                    of Python')
         self.window = window
+        self.profiler = None
+        if profile:
+            # Installed before the widgets are created, their commands are
+            # registered with the profiling wrapper
+            from pytes.gui_profile import TkProfiler
+            self.profiler = TkProfiler(
+                window, **(profile if isinstance(profile, dict) else {}))
+            self.profiler.start()
         self.dev_available = False
+        # Clock of the sessions and the device, see pytes.clock
+        self.clock = clock
+        # Stimulation sessions run in worker threads, progress is reported
+        # back to the main loop via the executor's queue
+        self.executor = TimelineExecutor(clock=clock)
+        # Configuration of each channel drawn in the plot and sent to the
+        # device, compared with the entries to apply only the changes
+        self.configs = {1: None, 2: None}
+        self.applied = {1: None, 2: None}
+        self.lines = {}
+        # Edits of the entries are applied after a pause of debounce_ms
+        self.debounce_ms = 300
+        self._pending = {}
 
         self.window_geometry()
         self.fontStyle = tkFont.Font(family="Lucida Grande",
                                      size=self.fontsize)
         self.button_place()
         self.wave_display()
-        self.window.mainloop()
+        self.poll_sessions()
+        # Emergency stop of all outputs of all devices
+        self.window.bind_all('<Escape>', lambda event: self.emergency_stop())
 
     def button_place(self):
         # Allocating the spaces for the GUI widgets based on the grid
@@ -81,7 +268,7 @@ class PyTESWindow():
               'Output',
               (self.window.fig_off, lambda: self.signal_out(chn=1), 'bt_out'),
               (self.window.fig_off, lambda: self.signal_out(chn=2), 'bt_out')],
-             [None, None, 'Timer', '', '']],
+             [{'Sync CH1/CH2': None}, None, 'Timer', '', '']],
             dtype='object')
 
         # Images for the labels
@@ -102,6 +289,7 @@ class PyTESWindow():
         self.para_widgets_mat_obj = np.empty(self.para_widgets_mat.shape,
                                              dtype='object')
 
+        # Entries of CH1 and CH2 are in the columns 3 and 4
         self.entry_row_start, self.entry_col_start = 2, 3
         row_start, col_start = 0, 0
         self.click_list, self.bt_out, self.check_list = [], [], []
@@ -114,6 +302,8 @@ class PyTESWindow():
                 tmp_obj = Entry(self.window, font=self.fontStyle)
                 tmp_obj.insert(0, str(grid_val))
                 tmp_obj.grid(row=row+row_start, column=col+col_start)
+                tmp_obj.bind('<KeyRelease>', lambda event, chn=col - 2:
+                             self.schedule_update(chn))
             elif grid_type == str:
                 tmp_obj = Label(self.window, font=self.fontStyle)
                 tmp_obj = Label(self.window, text=grid_val,
@@ -186,6 +376,8 @@ class PyTESWindow():
                 self.para_widgets_mat_obj[
                     id_entry+self.entry_row_start,
                     id_click+self.entry_col_start].config(state=entry_state)
+            # Only a channel whose mode changed is redrawn and sent
+            self.schedule_update(id_click+1)
 
     def dev_list(self):
         """Display the list of clickable devices corresponding to chosen driver
@@ -206,7 +398,10 @@ class PyTESWindow():
                 title='Warning', message='Please select only one protocol!')
             return None
         elif not visa_status and usbtmc_status:
-            from pytes.signal_generator import USBTMC
+            from pytes.signal_generator import USBTMC, VISA
+
+            # Devices still opened by VISA cannot be opened via USBTMC
+            VISA.close_all_sessions()
 
             tmp = USBTMC(inst=False)
             for i, i_dev in enumerate(tmp.available_port_list()):
@@ -259,8 +454,11 @@ class PyTESWindow():
                 messagebox.showwarning('Warning', 'No available devices!')
             print(ind_)
             try:
-                self.sig_gen = SG(dev=dev, protocol=self.protocol)
+                self.sig_gen = SG(dev=dev, protocol=self.protocol,
+                                  clock=self.clock)
                 self.dev_available = True
+                # The new device is configured completely on the next update
+                self.applied = {1: None, 2: None}
                 messagebox.showinfo('Connection Status', 'Connection succeeded!')
             except Exception as e:
                 self.dev_available = False
@@ -275,7 +473,13 @@ class PyTESWindow():
         amplitude, offset and phase.
 
         """
-        self.fig, self.ax = plt.subplots(2, 1, facecolor=(1, 1, 1))
+        # matplotlib is imported on demand, it dominates the start-up time.
+        # The Figure API is used instead of pyplot to avoid a global state.
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+        self.fig = Figure(facecolor=(1, 1, 1))
+        self.ax = self.fig.subplots(2, 1)
         self.curve_color_list = ['xkcd:yellow green', 'xkcd:sky blue']
         self.title_list = ['CH1', 'CH2']
 
@@ -291,13 +495,13 @@ class PyTESWindow():
         self.ax[1].set_xlabel('Time/sec')
         self.ax[1].set_ylabel('Voltage/V')
 
-        plt.ion()
         t = np.arange(0.0, 3.0, 0.01)
         s = np.sin(np.pi*t)
         self.ax[0].plot(t, s)
         self.fig.tight_layout()
 
         canvas = FigureCanvasTkAgg(self.fig, master=self.window)
+        canvas.draw()
         plot_widget = canvas.get_tk_widget()
 
         def update():
@@ -311,217 +515,351 @@ class PyTESWindow():
                          sticky='nsew')
 
     def ax_plt(self, xs, ys, chn):
-
-        self.ax[chn-1].clear()
-        self.ax[chn-1].plot(xs, ys, color=self.curve_color_list[chn-1])
-        self.ax[chn-1].set_title(self.title_list[chn-1])
-        self.ax[chn-1].set_facecolor('xkcd:black')
-        self.ax[chn-1].grid(True)
-        self.ax[chn-1].set_xlabel('Time/sec')
-        self.ax[chn-1].set_ylabel('Voltage/V')
-        self.fig.tight_layout()
-        self.fig.canvas.draw()
+        # Replace the curve of one channel, the other axes are not redrawn
+        ax = self.ax[chn-1]
+        line = self.lines.get(chn)
+        if line is None:
+            ax.clear()
+            self.lines[chn], = ax.plot(xs, ys,
+                                       color=self.curve_color_list[chn-1])
+            ax.set_title(self.title_list[chn-1])
+            ax.set_facecolor('xkcd:black')
+            ax.grid(True)
+            ax.set_xlabel('Time/sec')
+            ax.set_ylabel('Voltage/V')
+        else:
+            line.set_data(xs, ys)
+        ax.relim()
+        ax.autoscale_view()
+        self.fig.canvas.draw_idle()
 
     def para_update(self):
         """Update the plots of the left panel based on the current parameters
         of the right panel
 
-        """
-        for id_click, click in enumerate(self.click_list):
-            click_val = click.get()
-            if click_val == 'tACS':
-                self.sin_update(chn=id_click+1)
-            elif click_val == 'tDCS':
-                self.dc_update(chn=id_click+1)
-            elif click_val == 'tRNS':
-                self.noise_update(chn=id_click+1)
-            elif click_val == 'Arb':
-                self.arb_update(chn=id_click+1)
+        Only the channels whose entries changed are redrawn and sent.
 
-    def load_entry(self):
-        """Load the current values for all entries on the right panel
+        """
+        for id_click, _ in enumerate(self.click_list):
+            self.chn_update(chn=id_click+1)
+
+    def read_channel(self, chn):
+        # Typed content of the entries of a channel
+        texts = [self.para_widgets_mat_obj[i+self.entry_row_start,
+                                           chn-1+self.entry_col_start].get()
+                 for i in range(len(ChannelConfig.names))]
+        return ChannelConfig(self.click_list[chn-1].get(), texts)
+
+    def chn_update(self, chn, live=False):
+        """Apply the entries of a single channel
+
+        The entries are compared with the configuration drawn and sent
+        before. The plot is redrawn only if the signal changed and only the
+        changed parameters are sent to the device.
+
+        Parameters
+        ----------
+        chn : 1 | 2
+            Channel to update
+        live : bool (default False)
+            If True, the update is triggered by an edit. Invalid entries,
+            e.g., a number or a path being typed, are ignored. The device
+            is only configured while the output of the channel is off, such
+            that a half-typed value never reaches a live output, and
+            arbitrary data is never uploaded.
+
+        Returns
+        -------
+        config : ChannelConfig | None
+            Current configuration, None if an entry is invalid or the
+            configuration exceeds the limits of the device
 
         """
-        def customize_float(string_val):
-            try:
-                return float(string_val)
-            except ValueError:
-                return string_val
+        try:
+            config = self.read_channel(chn)
+        except ValueError as e:
+            if not live:
+                messagebox.showwarning('Warning', f'CH{chn}: {e}')
+            return None
 
-        # arb, amp, freq, phase, offset, fade, stim dur
-        self.entry_data = np.empty((7, 2), dtype='object')
-        for (i, j), _ in np.ndenumerate(self.entry_data):
-            self.entry_data[i, j] = customize_float(
-                self.para_widgets_mat_obj[i+self.entry_row_start,
-                                          j+self.entry_col_start].get())
+        drawn = self.configs[chn]
+        arb = None
+        if drawn is None or config.signal() != drawn.signal():
+            if config.mode == 'Arb':
+                arb = self.load_arb(config, live)
+                if arb is None:
+                    return None
+            self.ax_plt(*config.waveform(arb), chn)
+        self.configs[chn] = config
+
+        if not self.dev_available:
+            return config
+        if live and (self.output_on(chn) or self.executor.running(chn)):
+            # Applied by "Update Parameters" or the next output-on
+            return config
+        commands = config.commands(self.applied[chn])
+        if live and 'arb' in commands:
+            # Uploads block the main loop, typing never starts one
+            return config
+        if commands:
+            if 'arb' in commands and arb is None:
+                arb = self.load_arb(config, live)
+                if arb is None:
+                    return None
+            # Nothing exceeding the limits of the device is sent
+            violations = config.violations(self.sig_gen.capabilities, arb)
+            if violations:
+                if not live:
+                    messagebox.showwarning('Warning', '\n'.join(
+                        i['message'] for i in violations))
+                return None
+            if 'arb' in commands:
+                self.sig_gen.sps = arb['sps']
+                self.sig_gen.arb_func(data=arb['data'], chn=chn,
+                                      sps=arb['sps'])
+            else:
+                self.sig_gen.para_set(commands, chn=chn)
+        self.applied[chn] = config
+        return config
+
+    def load_arb(self, config, live=False):
+        # Arbitrary data of the entered path, None if it cannot be loaded,
+        # e.g., while the path is being typed
+        try:
+            return config.load_arb()
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            if not live:
+                messagebox.showwarning('Warning', 'Arbitrary data cannot '
+                                       f'be loaded\n{e}')
+            return None
 
-    def sin_update(self, chn):
-        self.load_entry()
-        amp, freq, phase, offset = self.entry_data[1:5, chn-1]
+    def output_on(self, chn):
+        # The output button shows the output on, see button_status
+        return self.bt_out[chn-1]['state'] != 'normal'
 
-        t = np.arange(0.0, 1.0, 0.001)
-        ch_signal = offset + amp * np.sin(2*np.pi*freq*t + phase / 180 * np.pi)
-        self.ax_plt(t, ch_signal, chn)
+    def schedule_update(self, chn):
+        # Apply the entries of a channel once the edits pause for
+        # debounce_ms, such that typing does not flood the link
+        pending = self._pending.pop(chn, None)
+        if pending is not None:
+            self.window.after_cancel(pending)
+        self._pending[chn] = self.window.after(
+            self.debounce_ms, lambda: self._deferred_update(chn))
 
-        self.scpi_cmd_ch = {'sin': [freq, amp, offset, phase]}
-        if self.dev_available:
-            self.sig_gen.para_set(self.scpi_cmd_ch, chn=chn)
+    def _deferred_update(self, chn):
+        self._pending.pop(chn, None)
+        self.chn_update(chn, live=True)
 
-    def dc_update(self, chn):
-        self.load_entry()
-        amp = self.entry_data[1, chn-1]
+    def signal_out(self, chn):
+        """Control the output of the stimulation signal and switch the status
+        button accordingly.
 
-        t = np.arange(0.0, 1.0, 0.001)
-        ch_signal = amp * np.ones(t.shape)
+        Sessions with fade in/out or a stimulation timer are handed to the
+        timeline executor and run in a worker thread, such that both channels
+        can run at the same time and the GUI stays responsive. Clicking the
+        output button of a running session aborts it immediately. If "Sync
+        CH1/CH2" is checked, both channels start at the same time.
 
-        self.ax_plt(t, ch_signal, chn)
-        self.scpi_cmd_ch = {'dc': amp}
+        """
+        if self.executor.running(chn):
+            # Immediate abort, the session switches off the output itself
+            self.executor.abort(chn)
+            return
+        if self.dev_available and self.sig_gen.stopped:
+            # The emergency stop stays in effect until it is confirmed
+            if not messagebox.askyesno('Emergency Stop', 'Re-arm the '
+                                       'outputs after the emergency stop?'):
+                return
+            estop.rearm()
+
+        chn_list = [1, 2] if self.check_list[2].get() else [chn]
+        if any(self.executor.running(i_chn) for i_chn in chn_list):
+            messagebox.showwarning('Warning', 'Synchronized output requires '
+                                   'both channels to be idle')
+            return
+
+        timelines = {}
+        for i_chn in chn_list:
+            pending = self._pending.pop(i_chn, None)
+            if pending is not None:
+                self.window.after_cancel(pending)
+            if self.chn_update(chn=i_chn) is None:
+                # Invalid entries, an indefinite output can still be
+                # switched off
+                if self.bt_out[i_chn-1]['state'] != 'normal':
+                    self.state_switch(i_chn)
+                return
+            if self.bt_out[i_chn-1]['state'] == 'normal' and \
+                    not self.arb_verified(i_chn):
+                return
+            try:
+                timeline = self.session_timeline(i_chn)
+            except ValueError as e:
+                messagebox.showwarning('Warning', f'CH{i_chn}: {e}')
+                return
+            if timeline is None:
+                # No fade in/out nor limited stimulation duration,
+                # Indefinitely switch the output status
+                self.state_switch(i_chn)
+            else:
+                timelines[i_chn] = timeline
+        if timelines:
+            self.executor.start_sync(timelines)
+
+    def arb_verified(self, chn):
+        # Read back the arbitrary data before the output is switched on,
+        # False if the device does not hold the uploaded data
+        if not self.dev_available or self.configs[chn].mode != 'Arb':
+            return True
+        try:
+            report = self.sig_gen.verify_arb(chn=chn)
+        except Exception as e:
+            messagebox.showwarning('Warning', f'CH{chn}: verification of '
+                                   f'the arbitrary data failed\n{e}')
+            return False
+        if report is None or report['match']:
+            return True
+        # The data is uploaded again on the next update
+        self.applied[chn] = None
+        messagebox.showwarning('Warning', f'CH{chn}: the device does not '
+                               'hold the arbitrary data of the file. Click '
+                               '"Update Parameters" to upload it again.')
+        return False
+
+    def session_timeline(self, chn):
+        """Compile the fade in, stimulation timer and fade out of a channel
+        into a timeline.
+
+        Returns None if neither fade nor stimulation duration is given. The
+        mode and offset are taken from the configuration now, such that
+        the steps do not depend on later edits of the GUI.
+
+        Raises
+        ------
+        ValueError
+            If a fade is given without stimulation duration
 
+        """
+        config = self.configs[chn]
+        amp, fade_dur, stim_dur = config.amp, config.fade_dur, config.stim_dur
+        if stim_dur is None and fade_dur is None:
+            return None
+        elif fade_dur is not None:
+            if stim_dur is None:
+                raise ValueError('When fade is non-empty, duration also '
+                                 'must be non-empty. Otherwise, the fade out '
+                                 'will start right after the fade in done')
+        else:
+            # No fade in/out but has limited stimulation duration
+            fade_dur = 0.0
+
+        off_step = Step(0, self.output_set, args=(chn, False), label='off')
+        timeline = Timeline(on_abort=[off_step])
+        step_per_sec = 2
+        # The worker thread must not read the Tk variables
+        fade_kwargs = {'mode': config.mode, 'offset': config.offset}
+        if fade_dur > 0:
+            step_list = np.linspace(0.002, amp, int(fade_dur*step_per_sec))
+            timeline.add(0, self.fade_step, args=(0.002, chn),
+                         kwargs=fade_kwargs, label='fade')
+        timeline.add(0, self.output_set, args=(chn, True), label='on')
+        t = 0.0
+        if fade_dur > 0:
+            for stim_val in step_list:
+                t += 1 / step_per_sec
+                timeline.add(t, self.fade_step, args=(stim_val, chn),
+                             kwargs=fade_kwargs, label='fade')
+        t += stim_dur
+        if fade_dur > 0:
+            for stim_val in step_list[::-1]:
+                timeline.add(t, self.fade_step, args=(stim_val, chn),
+                             kwargs=fade_kwargs, label='fade')
+                t += 1 / step_per_sec
+        timeline.add(t, self.output_set, args=(chn, False), label='off')
+        return timeline
+
+    def output_set(self, chn, status):
+        # Switch the device output, called from the session worker thread
         if self.dev_available:
-            self.sig_gen.para_set(self.scpi_cmd_ch, chn=chn)
-
-    def noise_update(self, chn):
-        self.load_entry()
-        amp, offset = self.entry_data[[1, 4], chn-1]
-
-        t = np.arange(0.0, 1.0, 0.001)
-        ch_signal = np.random.normal(loc=offset, scale=amp, size=t.shape)
-
-        self.ax_plt(t, ch_signal, chn)
-        self.scpi_cmd_ch = {'noise': [amp, offset]}
+            if status:
+                self.sig_gen.on(chn=chn)
+            else:
+                self.sig_gen.off(chn=chn)
 
+    def amp_adjust(self, val, chn, mode, offset=0.0):
+        # Adjust the stimulation amplitude according to the stimulation type
+        # of the session, called from the session worker thread
         if self.dev_available:
-            self.sig_gen.para_set(self.scpi_cmd_ch, chn=chn)
-
-    def arb_update(self, chn):
-        # read file
-        import pickle
-        self.load_entry()
-        arb_data_path = self.entry_data[0, chn-1]
-        with open(arb_data_path, 'rb') as f:
-            arb_data = pickle.load(f)
-
-        len_data = len(arb_data['data'])
-        t = np.linspace(0.0, len_data/arb_data['sps'], len_data)
-        self.ax_plt(t, arb_data['data'], chn)
-
+            if mode == 'tACS':
+                self.sig_gen.amp(value=val, chn=chn)
+            elif mode == 'tDCS':
+                self.sig_gen.para_set({'offset': val}, chn=chn)
+            elif mode == 'tRNS':
+                self.sig_gen.para_set({'noise': [val, offset]}, chn=chn)
+
+    def fade_step(self, val, chn, mode, offset=0.0):
+        # Amplitude change within a fade, published as FADE_STEP event
         if self.dev_available:
-            self.sig_gen.sps = arb_data['sps']
-            self.sig_gen.arb_func(data=arb_data['data'], chn=chn,
-                                  sps=arb_data['sps'])
+            with self.sig_gen.event_kind(FADE_STEP):
+                self.amp_adjust(val, chn, mode, offset)
+            # The device holds the faded amplitude, poll_sessions records it
+            # in the main thread
+            self.executor.bridge.put((chn, 'amp', float(val)))
+
+    def state_switch(self, chn):
+        # Toggle the output without timer in the main thread
+        button = self.bt_out[chn-1]
+        if button["state"] == "normal":
+            self.output_set(chn, True)
+            self.button_status(chn, True)
+        else:
+            self.output_set(chn, False)
+            self.button_status(chn, False)
+
+    def button_status(self, chn, status):
+        button = self.bt_out[chn-1]
+        if status:
+            button["state"] = "active"
+            button.configure(image=self.window.fig_on)
+        else:
+            button["state"] = "normal"
+            button.configure(image=self.window.fig_off)
 
-    def signal_out(self, chn):
-        """Control the output of the stimulation signal and switch the status
-        button accordingly.
+    def poll_sessions(self, interval=50):
+        """Bridge between the session worker threads and the Tk main loop
 
-        In addition, once the output is turned on and a stimulation timer is
-        set, a counting down window will indicate the residual stimulation time
+        Drains the progress messages of the executor, updates the output
+        buttons and computes the countdown from the session deadline, such
+        that the displayed residual time is independent of the UI load.
 
         """
-        self.load_entry()
-        self.para_update()
-
-        def state_switch(button, channel, forced=None):
-            if forced is None:
-                if button["state"] == "normal":
-                    button["state"] = "active"
-                    if self.dev_available:
-                        self.sig_gen.on(chn=channel)
-                    button.configure(image=self.window.fig_on)
-                    # vlabel.configure(image=self.window.photo1)
-                    # print('active')
-                else:
-                    button["state"] = "normal"
-                    if self.dev_available:
-                        self.sig_gen.off(chn=channel)
-                    button.configure(image=self.window.fig_off)
-                    # vlabel.configure(image=self.window.photo)
-                    # print('normal')
-            elif forced == 'on':
-                if self.dev_available:
-                    self.sig_gen.on(chn=channel)
-                button.configure(image=self.window.fig_on)
-                button["state"] = "active"
-                time.sleep(0.1)
-            elif forced == 'off':
-                if self.dev_available:
-                    self.sig_gen.off(chn=channel)
-                button.configure(image=self.window.fig_off)
-                button["state"] = "normal"
-                time.sleep(0.1)
-            self.window.update()
-
-        def amp_adjust(val, chn):
-            click_list = self.click_list.copy()
-            click = click_list[chn-1]
-            click_val = click.get()
+        for msg in self.executor.poll():
+            chn, kind = msg[0], msg[1]
+            if kind == 'step' and msg[2] in ['on', 'off']:
+                self.button_status(chn, msg[2] == 'on')
+            elif kind == 'amp' and self.applied[chn] is not None:
+                # Sent again on the next update if it differs from the entry
+                self.applied[chn] = self.applied[chn].replace(amp=msg[2])
+            elif kind == 'error':
+                print(f'CH{chn} session failed at step {msg[2]}: {msg[3]}')
+            elif kind == 'done':
+                self.para_widgets_mat_obj[
+                    10, chn+self.entry_col_start-1]['text'] = ''
 
-            if self.dev_available:
-                if click_val == 'tACS':
-                    self.sig_gen.amp(value=val, chn=chn)
-                elif click_val == 'tDCS':
-                    self.sig_gen.para_set({'offset': val}, chn=chn)
-                elif click_val == 'tRNS':
-                    if chn == 1:
-                        offset = self.offset_val_ch1
-                    else:
-                        offset = self.offset_val_ch2
-                    self.sig_gen.para_set({'noise': [val, offset]}, chn=chn)
-
-        def fade(amp, fade_dur, chn, step_per_sec=2, status='start'):
-            print('fade start')
-            sleep_dur = 1 / step_per_sec
-            step_list = np.linspace(0.002, amp, int(fade_dur*step_per_sec))
-            if status == 'start':
-                # self.sig_gen.amp(0.002, chn=chn)
-                amp_adjust(0.002, chn=chn)
-                for stim_val in step_list:
-                    time.sleep(sleep_dur)
-                    amp_adjust(val=stim_val, chn=chn)
-                    print(stim_val)
-            elif status == 'finish':
-                for stim_val in step_list[::-1]:
-                    amp_adjust(val=stim_val, chn=chn)
-                    # self.sig_gen.amp(stim_val, chn=chn)
-                    time.sleep(sleep_dur)
-                print('off output')
-
-            print('fade end')
-
-        def stim_timer(chn, duration):
-            print('Timer start')
-            # Note: tried to use self.window.after, but it does not work as
-            # after is a callback function and cannot block the thread
-            while duration > 0:
-                duration -= 1
+        for chn, session in self.executor.sessions.items():
+            if session.is_alive():
                 self.para_widgets_mat_obj[
-                    10, chn+self.entry_col_start-1]['text'] = duration
-                self.window.update()
-                time.sleep(1)
-            print('Timer end')
-
-        amp, fade_dur, stim_dur = self.entry_data[[1, -2, -1], chn-1]
-        button_out = self.bt_out[chn-1]
-
-        if stim_dur == '' and fade_dur == '':
-            # No fade in/out nor limited stimulation duration,
-            # Indefinitely switch the output status
-            state_switch(button_out, channel=chn)
-        elif fade_dur != '':
-            # Valid input for fade duration
-            assert stim_dur != '', 'When fade is non-empty, duration also \
-                must be non-empty. Otherwise, the fade out will start right \
-                after the fade in done'
-            state_switch(button_out, channel=chn, forced='on')
-            fade(amp=amp, chn=chn, status='start', fade_dur=float(fade_dur))
-            stim_timer(chn=chn, duration=float(stim_dur))
-            fade(amp=amp, chn=chn, status='finish', fade_dur=float(fade_dur))
-            state_switch(button_out, channel=chn, forced='off')
-        else:
-            # No fade in/out but has limited stimulation duration
-            state_switch(button_out, channel=chn, forced='on')
-            stim_timer(chn=chn, duration=float(stim_dur))
-            state_switch(button_out, channel=chn, forced='off')
+                    10, chn+self.entry_col_start-1]['text'] = \
+                    f'{session.remaining():.1f}'
+        self.window.after(interval, self.poll_sessions)
+
+    def emergency_stop(self):
+        report = estop.emergency_stop()
+        for chn in [1, 2]:
+            self.button_status(chn, False)
+        messagebox.showwarning('Emergency Stop', 'All outputs are off.\n'
+                               'Worst-case latency: '
+                               f'{report["worst"]*1e3:.1f} ms')
 
     def refresh(self):
         self.para_widgets_mat_obj[1, 1][0].config(width=2)
@@ -548,9 +886,10 @@ class PyTESWindow():
         self.window_height = screen_height * res_ratio
         self.window_start_x = screen_width * .2
         self.window_start_y = screen_height * .2
-        window.geometry("%dx%d+%d+%d" % (self.window_width, self.window_height,
-                                         self.window_start_x,
-                                         self.window_start_y))
+        self.window.geometry("%dx%d+%d+%d" % (self.window_width,
+                                              self.window_height,
+                                              self.window_start_x,
+                                              self.window_start_y))
         self.window.configure(bg=self._from_rgb((255, 255, 255)))
 
         self.fontsize = np.amin([self.window_width/80,
@@ -561,6 +900,19 @@ class PyTESWindow():
         return "#%02x%02x%02x" % rgb
 
 
-window = tk.Tk()
-window.title('PyTES Toolbox')
-mywin = PyTESWindow(window)
+def main(profile=None):
+    # Entry point of the GUI, e.g., via the console script pytes-gui. If
+    # profile is a path, the responsiveness of the GUI is profiled and the
+    # trace is saved there when the window is closed.
+    window = tk.Tk()
+    window.title('PyTES Toolbox')
+    gui = PyTESWindow(window, profile=profile is not None)
+    window.mainloop()
+    if gui.profiler is not None:
+        gui.profiler.stop()
+        gui.profiler.print_report()
+        print(f'Trace saved to {gui.profiler.export(profile)}')
+
+
+if __name__ == '__main__':
+    main()
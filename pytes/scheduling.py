@@ -0,0 +1,278 @@
+"""
+Latency-compensated scheduled commands.
+
+SignalGenerator.schedule(t, cmd, chn) lets a command take effect at the
+monotonic time t instead of whenever set_cmd happens to return. A per-device
+LatencyModel predicts the write-to-effect latency, i.e., the duration of the
+write plus the processing delay of the instrument, and a timer thread
+dispatches every command early by the predicted latency. The model is
+calibrated with timed *OPC? round-trips and updated with the measured
+duration of every scheduled write. The achieved error of every command is
+recorded to check the timing precision over a session.
+
+An emergency stop cancels the pending commands and increments a generation
+counter. A command which was already taken from the queue and is waiting
+for its dispatch time is checked against both, and against the stop of the
+device, under the I/O lock of the device right before its write. The stop
+of the device is set before its off command is sent, and the off command is
+repeated once the I/O lock is free, such that nothing scheduled before the
+stop is sent after it. The lock of the queue is not held during the write,
+an emergency stop never waits for a write in progress, e.g., for the
+recovery of a lost link.
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+
+import numpy as np
+
+from pytes import estop
+
+
+class LatencyModel():
+    """Write-to-effect latency of one device
+
+    latency = write duration (EWMA of measured writes) + processing delay,
+    where the processing delay is estimated from *OPC? round-trips as half
+    of the round-trip time exceeding the write duration.
+
+    Parameters
+    ----------
+    write : float (default 0.001)
+        Initial estimate of the write duration in seconds
+    processing : float (default 0.0)
+        Initial estimate of the processing delay in seconds
+    alpha : float (default 0.1)
+        Weight of a new sample in the exponentially weighted averages
+
+    """
+    def __init__(self, write=0.001, processing=0.0, alpha=0.1):
+        self.write = write
+        self.write_var = 0.0
+        self.processing = processing
+        self.alpha = alpha
+        self.n_sample = 0
+
+    def update(self, write_dur):
+        # Update the write duration with a measured write
+        diff = write_dur - self.write
+        self.write += self.alpha * diff
+        self.write_var = (1 - self.alpha) * (self.write_var +
+                                             self.alpha * diff ** 2)
+        self.n_sample += 1
+
+    def predict(self):
+        return self.write + self.processing
+
+    @property
+    def std(self):
+        return float(np.sqrt(self.write_var))
+
+    def calibrate(self, sig_gen, n_round=20):
+        """Measure writes and *OPC? round-trips of the connected device
+
+        Parameters
+        ----------
+        sig_gen : SignalGenerator
+            Connected signal generator
+        n_round : int (default 20)
+            Number of round-trips
+
+        Returns
+        -------
+        latency : float
+            Predicted write-to-effect latency in seconds
+
+        """
+        write_dur, rtt = np.zeros(n_round), np.zeros(n_round)
+        for i in range(n_round):
+            t0 = time.monotonic()
+            # *WAI does not change the state of the device
+            sig_gen.set_cmd('*WAI')
+            t1 = time.monotonic()
+            sig_gen.query_cmd('*OPC?')
+            t2 = time.monotonic()
+            write_dur[i], rtt[i] = t1 - t0, t2 - t1
+        self.write = float(np.median(write_dur))
+        self.write_var = float(np.var(write_dur))
+        self.processing = max(0.0, float(np.median(rtt) - self.write) / 2)
+        return self.predict()
+
+
+class ScheduledCommand():
+    """A command to take effect at a given monotonic time
+
+    Attributes
+    ----------
+    t_target : float
+        Requested time of effect
+    t_dispatch : float
+        Planned time of the write, t_target - predicted latency
+    t_write_start, t_write_end : float | None
+        Measured start and end of the write
+    error : float | None
+        Estimated time of effect (end of write + processing delay) minus
+        t_target in seconds
+    exception : Exception | None
+        Raised by the write, if any
+
+    """
+    def __init__(self, t_target, func, latency, label=''):
+        self.t_target = t_target
+        self.func = func
+        self.latency = latency
+        self.t_dispatch = t_target - latency
+        self.label = label
+        self.t_write_start = None
+        self.t_write_end = None
+        self.error = None
+        self.exception = None
+        self.cancelled = False
+        self.done = threading.Event()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+
+class CommandScheduler():
+    """Timer thread dispatching scheduled commands of one SignalGenerator
+
+    Parameters
+    ----------
+    sig_gen : SignalGenerator
+        Signal generator executing the commands
+    model : LatencyModel | None (default None)
+        Latency model of the device. If None, a default model.
+    spin : float (default 0.002)
+        Duration before each dispatch which is busy-waited for precision
+    realtime : bool (default True)
+        Try to run the timer thread with real-time priority (Linux, requires
+        the corresponding privileges, silently ignored otherwise)
+
+    """
+    def __init__(self, sig_gen, model=None, spin=0.002, realtime=True):
+        self.sig_gen = sig_gen
+        self.model = LatencyModel() if model is None else model
+        self.spin = spin
+        self.realtime = realtime
+        self.records = []
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        # Incremented by every emergency stop
+        self._generation = 0
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='pytes-scheduler')
+        self._thread.start()
+        estop.register_abortable(self)
+
+    def _command_func(self, cmd, chn):
+        # SCPI string, parameter dict for para_set or any callable
+        if callable(cmd):
+            return cmd
+        elif isinstance(cmd, str):
+            return lambda: self.sig_gen.set_cmd(cmd)
+        elif isinstance(cmd, dict):
+            # Without the pause after each command, which would count as
+            # write duration
+            return lambda: self.sig_gen.para_set(cmd, chn=chn, delay=0)
+        raise TypeError('Scheduled command must be a SCPI string, a dict '
+                        'of parameters or a callable')
+
+    def schedule(self, t_target, cmd, chn=None, label=''):
+        item = ScheduledCommand(t_target, self._command_func(cmd, chn),
+                                self.model.predict(), label=label or str(cmd))
+        with self._cond:
+            heapq.heappush(self._heap, (item.t_dispatch, next(self._seq),
+                                        item))
+            self._cond.notify()
+        return item
+
+    def _set_priority(self):
+        if not self.realtime or not hasattr(os, 'sched_setscheduler'):
+            return
+        try:
+            # Applies to the calling thread on Linux
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(
+                os.sched_get_priority_min(os.SCHED_FIFO)))
+        except (OSError, AttributeError):
+            pass
+
+    def _run(self):
+        self._set_priority()
+        while True:
+            with self._cond:
+                while not self._stop and (
+                        not self._heap or self._heap[0][0] - time.monotonic()
+                        > self.spin):
+                    timeout = None if not self._heap else \
+                        self._heap[0][0] - time.monotonic() - self.spin
+                    self._cond.wait(timeout)
+                if self._stop:
+                    return
+                t_dispatch, _, item = heapq.heappop(self._heap)
+                generation = self._generation
+            while time.monotonic() < t_dispatch and not item.cancelled:
+                pass
+            self._dispatch(item, generation)
+
+    def _dispatch(self, item, generation):
+        # The check and the write hold the I/O lock of the device, the
+        # repeated off command of an emergency stop follows the write
+        with self.sig_gen._io_lock:
+            if item.cancelled or generation != self._generation or \
+                    self.sig_gen.stopped:
+                item.cancel()
+                item.done.set()
+                return
+            item.t_write_start = time.monotonic()
+            try:
+                item.func()
+            except Exception as e:
+                item.exception = e
+            item.t_write_end = time.monotonic()
+        write_dur = item.t_write_end - item.t_write_start
+        item.error = item.t_write_end + self.model.processing - item.t_target
+        self.model.update(write_dur)
+        self.records.append(item)
+        item.done.set()
+
+    def report(self):
+        """Timing precision of all dispatched commands
+
+        Returns
+        -------
+        report : dict
+            Number of commands, mean, std and maximum absolute error in ms
+
+        """
+        err = np.asarray([item.error for item in self.records
+                          if item.error is not None]) * 1e3
+        if len(err) == 0:
+            return {'n': 0}
+        return {'n': len(err), 'mean_ms': float(err.mean()),
+                'std_ms': float(err.std()),
+                'max_abs_ms': float(np.abs(err).max()),
+                'latency_ms': self.model.predict() * 1e3}
+
+    def emergency_stop(self):
+        # Cancel all pending commands, including one waiting for dispatch
+        with self._cond:
+            self._generation += 1
+            for _, _, item in self._heap:
+                item.cancel()
+                item.done.set()
+            self._heap = []
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        self._thread.join(1.0)
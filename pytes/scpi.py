@@ -0,0 +1,344 @@
+"""
+Precompiled SCPI commands and per-model dialects.
+
+Every command of a dialect is a template, e.g., ':SOUR{chn}:VOLT {0}'. The
+CommandEncoder compiles a template once per channel into a bytes %-format,
+e.g., b':SOUR1:VOLT %.10g\\n', and caches it, such that building a command
+on the hot path is a single bytes formatting without string concatenation,
+upper-casing or encoding. Numeric fields are formatted with the precision of
+the dialect, fields with the format spec 's' are inserted as text.
+
+The dialect is selected from the *IDN? answer of the device when connecting,
+see dialect_from_idn.
+
+CommandEncoder.join sends several commands in one message. After a
+separator, a SCPI header without a leading colon is resolved relative to
+the path of the previous command, hence every template of a SCPI dialect
+starts with a rooted header (':SOUR1:...') or a common command ('*TRG').
+The Siglent commands are not part of a SCPI tree, their headers start with
+the channel ('C1:...').
+"""
+
+import string
+
+
+class Dialect():
+    """Command templates of one family of instruments
+
+    Parameters
+    ----------
+    name : str
+        Name of the dialect
+    idn_patterns : list of str
+        Case-insensitive substrings of the *IDN? answer identifying the
+        instruments using this dialect
+    templates : dict
+        Templates indexed by the command name, a value of None marks a
+        command which is not supported
+    channels : list of int (default [1, 2])
+        Output channels of the instruments
+    precision : int (default 10)
+        Significant digits of numeric fields
+    separator : str (default ';')
+        Separator of several commands sent in one message
+    terminator : str (default '\\n')
+        Terminator of a message
+    trigger_sources : dict | None (default None)
+        Keywords of the trigger sources 'immediate', 'external' and 'bus'
+    spacings : dict | None (default None)
+        Keywords of the sweep spacings 'linear' and 'log'
+
+    """
+    def __init__(self, name, idn_patterns, templates, channels=(1, 2),
+                 precision=10, separator=';', terminator='\n',
+                 trigger_sources=None, spacings=None):
+        self.name = name
+        self.idn_patterns = [i.lower() for i in idn_patterns]
+        self.templates = templates
+        self.channels = list(channels)
+        self.precision = precision
+        self.separator = separator
+        self.terminator = terminator
+        self.trigger_sources = trigger_sources or {
+            'immediate': 'INT', 'external': 'EXT', 'bus': 'MAN'}
+        self.spacings = spacings or {'linear': 'LIN', 'log': 'LOG'}
+
+    def derive(self, name, idn_patterns, **templates):
+        # New dialect sharing all templates which are not overridden
+        merged = dict(self.templates)
+        merged.update(templates)
+        return Dialect(name, idn_patterns, merged, channels=self.channels,
+                       precision=self.precision, separator=self.separator,
+                       terminator=self.terminator,
+                       trigger_sources=self.trigger_sources,
+                       spacings=self.spacings)
+
+    def keyword(self, table, name):
+        # Dialect keyword of a trigger source or sweep spacing as bytes
+        names = getattr(self, table)
+        if name not in names:
+            raise ValueError(f'Unsupported {table[:-1]} {name}, use one of '
+                             f'{list(names)}')
+        return names[name].encode()
+
+    def __repr__(self):
+        return f'Dialect({self.name!r})'
+
+
+RIGOL_DG1000Z = Dialect('Rigol DG1000Z', ['DG1', 'DG8', 'DG9'], {
+    'on': ':OUTPut{chn} ON',
+    'off': ':OUTPut{chn} OFF',
+    'amp': ':SOUR{chn}:VOLT {0}',
+    'offset': ':SOUR{chn}:VOLT:OFFS {0}',
+    'frequency': ':SOUR{chn}:FREQ {0}',
+    'phase': ':SOUR{chn}:PHAS {0}',
+    'sin': ':SOUR{chn}:APPL:SIN {0},{1},{2},{3}',
+    'dc': ':SOUR{chn}:APPL:DC 1,1,{0}',
+    'noise': ':SOUR{chn}:APPL:NOIS {0},{1}',
+    'arb': ':SOUR{chn}:APPL:ARB {0}',
+    'arb_points': ':SOUR{chn}:DATA:POIN VOLATILE,{0}',
+    'arb_value': ':SOUR{chn}:DATA:VAL VOLATILE,{0},{1}',
+    'arb_points?': ':SOUR{chn}:DATA:POIN? VOLATILE',
+    'arb_value?': ':SOUR{chn}:DATA:VAL? VOLATILE,{0}',
+    # The volatile memory can only be read back point by point
+    'arb_block?': None,
+    # start, stop, duration, spacing, trigger source
+    'sweep': (':SOUR{chn}:FREQ:STAR {0};:SOUR{chn}:FREQ:STOP {1};'
+              ':SOUR{chn}:SWE:TIME {2};:SOUR{chn}:SWE:SPAC {3:s};'
+              ':SOUR{chn}:SWE:TRIG:SOUR {4:s};:SOUR{chn}:SWE:STAT ON'),
+    'sweep_off': ':SOUR{chn}:SWE:STAT OFF',
+    # cycles, period, trigger source
+    'burst': (':SOUR{chn}:BURS:MODE TRIG;:SOUR{chn}:BURS:NCYC {0};'
+              ':SOUR{chn}:BURS:INT:PER {1};:SOUR{chn}:BURS:TRIG:SOUR {2:s};'
+              ':SOUR{chn}:BURS:STAT ON'),
+    'burst_off': ':SOUR{chn}:BURS:STAT OFF',
+    # Continuous output from the trigger on
+    'burst_infinite': (':SOUR{chn}:BURS:MODE INF;'
+                       ':SOUR{chn}:BURS:TRIG:SOUR {0:s};'
+                       ':SOUR{chn}:BURS:STAT ON'),
+    'trigger': '*TRG',
+    'output?': ':OUTPut{chn}?',
+    'amp?': ':SOUR{chn}:VOLT?',
+    'offset?': ':SOUR{chn}:VOLT:OFFS?',
+    'frequency?': ':SOUR{chn}:FREQ?',
+    'phase?': ':SOUR{chn}:PHAS?',
+    'apply?': ':SOUR{chn}:APPL?',
+    'error?': ':SYST:ERR?',
+})
+
+RIGOL_DG4000 = RIGOL_DG1000Z.derive('Rigol DG4000', ['DG4', 'DG5'])
+
+KEYSIGHT_33500 = Dialect('Keysight 33500', ['335', '336'], {
+    'on': ':OUTP{chn} ON',
+    'off': ':OUTP{chn} OFF',
+    'amp': ':SOUR{chn}:VOLT {0}',
+    'offset': ':SOUR{chn}:VOLT:OFFS {0}',
+    'frequency': ':SOUR{chn}:FREQ {0}',
+    'phase': ':SOUR{chn}:PHAS {0}',
+    # APPLy has no phase argument
+    'sin': ':SOUR{chn}:APPL:SIN {0},{1},{2};:SOUR{chn}:PHAS {3}',
+    'dc': ':SOUR{chn}:APPL:DC DEF,DEF,{0}',
+    'noise': ':SOUR{chn}:APPL:NOIS DEF,{0},{1}',
+    # Point-wise upload of volatile memory is not supported
+    'arb': None,
+    'arb_points': None,
+    'arb_value': None,
+    'arb_points?': None,
+    'arb_value?': None,
+    'arb_block?': None,
+    'sweep': (':SOUR{chn}:FREQ:STAR {0};:SOUR{chn}:FREQ:STOP {1};'
+              ':SOUR{chn}:SWE:TIME {2};:SOUR{chn}:SWE:SPAC {3:s};'
+              ':TRIG{chn}:SOUR {4:s};:SOUR{chn}:SWE:STAT ON'),
+    'sweep_off': ':SOUR{chn}:SWE:STAT OFF',
+    'burst': (':SOUR{chn}:BURS:MODE TRIG;:SOUR{chn}:BURS:NCYC {0};'
+              ':SOUR{chn}:BURS:INT:PER {1};:TRIG{chn}:SOUR {2:s};'
+              ':SOUR{chn}:BURS:STAT ON'),
+    'burst_off': ':SOUR{chn}:BURS:STAT OFF',
+    'burst_infinite': (':SOUR{chn}:BURS:MODE TRIG;'
+                       ':SOUR{chn}:BURS:NCYC INF;:TRIG{chn}:SOUR {0:s};'
+                       ':SOUR{chn}:BURS:STAT ON'),
+    'trigger': '*TRG',
+    'output?': ':OUTP{chn}?',
+    'amp?': ':SOUR{chn}:VOLT?',
+    'offset?': ':SOUR{chn}:VOLT:OFFS?',
+    'frequency?': ':SOUR{chn}:FREQ?',
+    'phase?': ':SOUR{chn}:PHAS?',
+    'apply?': ':SOUR{chn}:APPL?',
+    'error?': ':SYST:ERR?',
+}, trigger_sources={'immediate': 'IMM', 'external': 'EXT', 'bus': 'BUS'})
+
+SIGLENT_SDG = Dialect('Siglent SDG', ['SDG'], {
+    'on': 'C{chn}:OUTP ON',
+    'off': 'C{chn}:OUTP OFF',
+    'amp': 'C{chn}:BSWV AMP,{0}',
+    'offset': 'C{chn}:BSWV OFST,{0}',
+    'frequency': 'C{chn}:BSWV FRQ,{0}',
+    'phase': 'C{chn}:BSWV PHSE,{0}',
+    'sin': 'C{chn}:BSWV WVTP,SINE,FRQ,{0},AMP,{1},OFST,{2},PHSE,{3}',
+    'dc': 'C{chn}:BSWV WVTP,DC,OFST,{0}',
+    'noise': 'C{chn}:BSWV WVTP,NOISE,STDEV,{0},MEAN,{1}',
+    'arb': None,
+    'arb_points': None,
+    'arb_value': None,
+    'arb_points?': None,
+    'arb_value?': None,
+    'arb_block?': None,
+    'sweep': ('C{chn}:SWWV STATE,ON,START,{0},STOP,{1},TIME,{2},SWMD,{3:s},'
+              'TRSR,{4:s}'),
+    'sweep_off': 'C{chn}:SWWV STATE,OFF',
+    'burst': ('C{chn}:BTWV STATE,ON,GATE_NCYC,NCYC,TIME,{0},PRD,{1},'
+              'TRSR,{2:s}'),
+    'burst_off': 'C{chn}:BTWV STATE,OFF',
+    'burst_infinite': ('C{chn}:BTWV STATE,ON,GATE_NCYC,NCYC,TIME,INF,'
+                       'TRSR,{0:s}'),
+    'trigger': 'C{chn}:BTWV MTRIG',
+    'output?': 'C{chn}:OUTP?',
+    'amp?': 'C{chn}:BSWV?',
+    'offset?': 'C{chn}:BSWV?',
+    'frequency?': 'C{chn}:BSWV?',
+    'phase?': 'C{chn}:BSWV?',
+    'apply?': 'C{chn}:BSWV?',
+    'error?': 'SYST:ERR?',
+}, spacings={'linear': 'LINE', 'log': 'LOG'})
+
+DIALECTS = [RIGOL_DG1000Z, RIGOL_DG4000, KEYSIGHT_33500, SIGLENT_SDG]
+
+DEFAULT_DIALECT = RIGOL_DG1000Z
+
+
+def dialect_from_idn(idn, default=DEFAULT_DIALECT):
+    """Select the dialect of a device from its *IDN? answer
+
+    Parameters
+    ----------
+    idn : str | bytes
+        Answer of *IDN?, e.g., 'Rigol Technologies,DG1062Z,DG1ZA...,00.01'
+    default : Dialect (default RIGOL_DG1000Z)
+        Returned if no dialect matches
+
+    """
+    if isinstance(idn, bytes):
+        idn = idn.decode('utf8', errors='replace')
+    fields = [i.strip().lower() for i in str(idn).split(',')]
+    # Match the model field first, then the whole answer
+    model = fields[1] if len(fields) > 1 else ''
+    for text in [model, ','.join(fields)]:
+        for dialect in DIALECTS:
+            if any(text.startswith(i) if text == model else i in text
+                   for i in dialect.idn_patterns):
+                return dialect
+    return default
+
+
+def block_length(data):
+    """Total length of an IEEE 488.2 definite length block
+
+    Parameters
+    ----------
+    data : bytes
+        Start of the answer, e.g., b'#41024' followed by 1024 bytes
+
+    Returns
+    -------
+    length : int | None
+        Number of bytes of header and payload, None if the header is
+        incomplete
+
+    """
+    start = data.find(b'#')
+    if start < 0 or len(data) < start + 2:
+        return None
+    n_digit = int(data[start+1:start+2])
+    if n_digit == 0:
+        raise ValueError('Indefinite length blocks are not supported')
+    if len(data) < start + 2 + n_digit:
+        return None
+    return start + 2 + n_digit + int(data[start+2:start+2+n_digit])
+
+
+def parse_block(data):
+    # Payload of a complete IEEE 488.2 definite length block
+    length = block_length(data)
+    if length is None or len(data) < length:
+        raise ValueError(f'Incomplete block of {len(data)} bytes')
+    start = data.find(b'#')
+    return data[start + 2 + int(data[start+1:start+2]):length]
+
+
+class CommandEncoder():
+    """Build the bytes of commands from the templates of a dialect
+
+    Parameters
+    ----------
+    dialect : Dialect (default RIGOL_DG1000Z)
+
+    """
+    def __init__(self, dialect=DEFAULT_DIALECT):
+        self.dialect = dialect
+        self._cache = {}
+        self._num = f'%.{dialect.precision}g'.encode()
+
+    def compile(self, key, chn):
+        """Compile the template of a command for one channel
+
+        Returns
+        -------
+        fmt : bytes
+            %-format of the command including the terminator, e.g.,
+            b':SOUR1:VOLT %.10g\\n'
+
+        """
+        fmt = self._cache.get((key, chn))
+        if fmt is None:
+            template = self.dialect.templates.get(key)
+            if template is None:
+                raise NotImplementedError(
+                    f'Command {key} is not supported by {self.dialect.name}')
+            parts, n_field = [], 0
+            for text, field, spec, _ in string.Formatter().parse(template):
+                parts.append(text.replace('%', '%%').encode())
+                if field is None:
+                    continue
+                if field != 'chn':
+                    # %-formats are positional, fields must be in order
+                    if field != str(n_field):
+                        raise ValueError(f'Fields of {key} must be numbered '
+                                         f'in order, got {{{field}}}')
+                    n_field += 1
+                if field == 'chn':
+                    parts.append(str(chn).encode())
+                elif spec == 's':
+                    parts.append(b'%s')
+                else:
+                    parts.append(self._num)
+            fmt = b''.join(parts) + self.dialect.terminator.encode()
+            self._cache[(key, chn)] = fmt
+        return fmt
+
+    def encode(self, key, chn, *values):
+        # Bytes of a single command, text fields must be given as bytes
+        try:
+            return self._cache[key, chn] % values
+        except KeyError:
+            return self.compile(key, chn) % values
+
+    def text(self, key, chn, *values):
+        # The command as string without terminator, e.g., for logging
+        return self.encode(key, chn, *values).decode('utf8').rstrip()
+
+    def supports(self, key):
+        return self.dialect.templates.get(key) is not None
+
+    def join(self, commands):
+        """Concatenate several encoded commands into one message
+
+        Parameters
+        ----------
+        commands : list of bytes
+            Commands as returned by encode
+
+        """
+        term = self.dialect.terminator.encode()
+        sep = self.dialect.separator.encode()
+        return sep.join(cmd[:-len(term)] if term and cmd.endswith(term)
+                        else cmd for cmd in commands) + term
@@ -0,0 +1,346 @@
+"""
+Local control server for PyTES.
+
+Only one process can own the device connection, e.g., the USBTMC file node.
+`pytes serve` starts a daemon which owns the SignalGenerator objects and
+accepts requests from many local clients, e.g., PsychoPy code components and
+the OpenVibe Python box, over a Unix socket (Linux/MacOS) or localhost TCP.
+
+Protocol: every message is one line of JSON.
+    request  : {"id": 1, "dev": "/dev/usbtmc1", "method": "amp",
+                "args": [], "kwargs": {"value": 1, "chn": 1}}
+    response : {"id": 1, "result": null, "error": null}
+
+Every request is answered, if the method fails, the request is not a JSON
+object or the result cannot be serialized, with the error and a null
+result. Arrays, numpy scalars and bytes are converted at any depth of the
+result, e.g., the timeline of sweep.
+
+Clients may pipeline requests, i.e., send several requests before reading
+the responses. Requests of the same device are executed in order; all
+requests pending for a device are executed as one batch in the I/O thread.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import platform
+import socket
+
+import numpy as np
+
+
+DEFAULT_UNIX_PATH = '/tmp/pytes.sock'
+DEFAULT_HOST, DEFAULT_PORT = '127.0.0.1', 5678
+
+
+def _default_address():
+    # asyncio does not support Unix sockets on Windows
+    if 'Windows' in platform.platform():
+        return None, DEFAULT_HOST, DEFAULT_PORT
+    return DEFAULT_UNIX_PATH, None, None
+
+
+def _to_json(val):
+    # Convert the values json cannot serialize, passed as default to
+    # json.dumps, which calls it at any depth of the message
+    if isinstance(val, np.ndarray):
+        return val.tolist()
+    if isinstance(val, np.generic):
+        return val.item()
+    if isinstance(val, bytes):
+        return val.decode('utf8', errors='replace')
+    if isinstance(val, (set, frozenset)):
+        return list(val)
+    raise TypeError(f'Object of type {type(val).__name__} is not JSON '
+                    'serializable')
+
+
+class _Device():
+    # A connected SignalGenerator and the queue of its pending requests,
+    # the queue and the worker task are created in the running loop, see
+    # ControlServer._start_worker
+    def __init__(self, sig_gen):
+        self.sig_gen = sig_gen
+        self.queue = None
+        self.task = None
+
+    def execute(self, batch):
+        # Executed in the I/O thread, one thread hop per batch
+        results = []
+        for method, args, kwargs in batch:
+            try:
+                if method.startswith('_'):
+                    raise AttributeError(f'Private method {method}')
+                res = getattr(self.sig_gen, method)(*args, **kwargs)
+                results.append((res, None))
+            except Exception as e:
+                results.append((None, f'{type(e).__name__}: {e}'))
+        return results
+
+
+class ControlServer():
+    """Asyncio server exposing SignalGenerator objects to local clients
+
+    Parameters
+    ----------
+    path : str | None (default None)
+        Location of the Unix socket. If None and host is None, a default
+        address depending on the operating system is used.
+    host : str | None (default None)
+        Host of the TCP socket, should be a loopback address
+    port : int | None (default None)
+        Port of the TCP socket
+    protocol : 'USBTMC' | 'VISA' | None (default None)
+        Driver used for devices connected on request
+    sig_gen_factory : callable | None (default None)
+        Function creating the SignalGenerator for a given dev, e.g., to use
+        a mock driver. If None, SignalGenerator(dev=dev, protocol=protocol)
+
+    """
+    def __init__(self, path=None, host=None, port=None, protocol=None,
+                 sig_gen_factory=None):
+        if path is None and host is None:
+            path, host, port = _default_address()
+        self.path, self.host, self.port = path, host, port
+        self.protocol = protocol
+        self.sig_gen_factory = sig_gen_factory
+        self.devices = {}
+        self.default_dev = None
+        self.server = None
+        # One lock per dev, such that concurrent clients open it only once
+        self._connect_locks = {}
+
+    def connect(self, dev):
+        # Open the device once, it is shared by all clients
+        if dev is None:
+            dev = self.default_dev
+        if dev is None:
+            raise ValueError('No device is connected, start the server with '
+                             'a device or request a dev explicitly')
+        if dev not in self.devices:
+            if self.sig_gen_factory is not None:
+                sig_gen = self.sig_gen_factory(dev)
+            else:
+                from pytes.signal_generator import SignalGenerator
+                sig_gen = SignalGenerator(dev=dev, protocol=self.protocol)
+            self.devices[dev] = _Device(sig_gen)
+            if self.default_dev is None:
+                self.default_dev = dev
+        return self.devices[dev]
+
+    async def _connect(self, dev):
+        # Open the device in the I/O thread, at most once per dev
+        device = self.devices.get(dev)
+        if device is not None:
+            return device
+        lock = self._connect_locks.setdefault(dev, asyncio.Lock())
+        async with lock:
+            # Another client may have connected while waiting for the lock
+            device = self.devices.get(dev)
+            if device is None:
+                device = await asyncio.get_running_loop().run_in_executor(
+                    None, self.connect, dev)
+        return device
+
+    def _start_worker(self, device):
+        if device.task is None:
+            device.queue = asyncio.Queue()
+            device.task = asyncio.ensure_future(self._device_worker(device))
+
+    async def _device_worker(self, device):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await device.queue.get()]
+            # Batch all requests which are already pending
+            while not device.queue.empty():
+                items.append(device.queue.get_nowait())
+            batch = [(method, args, kwargs)
+                     for method, args, kwargs, _ in items]
+            results = await loop.run_in_executor(None, device.execute, batch)
+            for (*_, fut), res in zip(items, results):
+                if not fut.cancelled():
+                    fut.set_result(res)
+
+    async def _submit(self, request):
+        method = request.get('method', '')
+        if method == 'ping':
+            return 'pong', None
+        elif method == 'devices':
+            return list(self.devices), None
+
+        dev = request.get('dev')
+        try:
+            device = await self._connect(self.default_dev if dev is None
+                                         else dev)
+        except Exception as e:
+            return None, f'Connection failed: {type(e).__name__}: {e}'
+        self._start_worker(device)
+
+        fut = asyncio.get_running_loop().create_future()
+        device.queue.put_nowait((method, request.get('args', []),
+                                 request.get('kwargs', {}), fut))
+        return await fut
+
+    async def _respond(self, request, writer, lock):
+        req_id = None
+        try:
+            if not isinstance(request, dict):
+                raise ValueError('Request must be one JSON object per line')
+            req_id = request.get('id')
+            result, error = await self._submit(request)
+            msg = json.dumps({'id': req_id, 'result': result,
+                              'error': error}, default=_to_json)
+        except Exception as e:
+            msg = json.dumps({'id': req_id, 'result': None,
+                              'error': f'{type(e).__name__}: {e}'})
+        msg += '\n'
+        async with lock:
+            writer.write(msg.encode('utf8'))
+            await writer.drain()
+
+    async def _handle_client(self, reader, writer):
+        lock = asyncio.Lock()
+        pending = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    # Answered with an error
+                    request = None
+                # Do not wait for the response, such that requests pipeline
+                task = asyncio.ensure_future(
+                    self._respond(request, writer, lock))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.wait(pending)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        if self.path is not None:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.server = await asyncio.start_unix_server(
+                self._handle_client, path=self.path)
+            print(f'PyTES server listening on {self.path}')
+        else:
+            self.server = await asyncio.start_server(
+                self._handle_client, host=self.host, port=self.port)
+            print(f'PyTES server listening on {self.host}:{self.port}')
+        return self.server
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve_forever())
+        except KeyboardInterrupt:
+            print('PyTES server stopped')
+        finally:
+            if self.path is not None and os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class SignalGeneratorClient():
+    """Drop-in replacement of SignalGenerator talking to a ControlServer
+
+    Every public SignalGenerator method, e.g., amp, on, off, para_set, is
+    forwarded to the server and executed on the shared device.
+
+    Parameters
+    ----------
+    dev : str | None (default None)
+        Device on the server. If None, the first device of the server.
+    path, host, port : see ControlServer
+    timeout : float | None (default None)
+        Maximum time in seconds to wait for a response, if None, wait
+        forever. After a timeout, the connection is in an unknown state and
+        should be closed.
+
+    """
+    def __init__(self, dev=None, path=None, host=None, port=None,
+                 timeout=None):
+        if path is None and host is None:
+            path, host, port = _default_address()
+        if path is not None:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(path)
+        else:
+            self._sock = socket.create_connection((host, port))
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock.settimeout(timeout)
+        self.timeout = timeout
+        self._file = self._sock.makefile('rb')
+        self._ids = itertools.count()
+        self._responses = {}
+        self.dev = dev
+
+    def _send(self, method, args=(), kwargs=None):
+        req_id = next(self._ids)
+        msg = {'id': req_id, 'dev': self.dev, 'method': method,
+               'args': list(args), 'kwargs': {} if kwargs is None else kwargs}
+        self._sock.sendall((json.dumps(msg, default=_to_json) +
+                            '\n').encode('utf8'))
+        return req_id
+
+    def _recv(self, req_id):
+        while req_id not in self._responses:
+            try:
+                line = self._file.readline()
+            except socket.timeout:
+                raise TimeoutError(f'No response to request {req_id} within '
+                                   f'{self.timeout} s')
+            if not line:
+                raise ConnectionError('PyTES server closed the connection')
+            res = json.loads(line)
+            self._responses[res['id']] = res
+        res = self._responses.pop(req_id)
+        if res['error'] is not None:
+            raise RuntimeError(res['error'])
+        return res['result']
+
+    def call(self, method, *args, **kwargs):
+        return self._recv(self._send(method, args, kwargs))
+
+    def batch(self, calls):
+        """Pipeline several calls and wait for all results
+
+        Parameters
+        ----------
+        calls : list of tuple
+            (method, kwargs) of every call, e.g., [('on', {'chn': 1})]
+
+        """
+        req_ids = [self._send(method, kwargs=kwargs)
+                   for method, kwargs in calls]
+        return [self._recv(req_id) for req_id in req_ids]
+
+    def ping(self):
+        return self.call('ping')
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return lambda *args, **kwargs: self.call(method, *args, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -29,27 +29,42 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE
 
 
 
-This file containts four classes with following hierarchy:
+This file containts five classes with following hierarchy:
 
                                BaseDriver
                                    |
-                        -----------------------
-                        |                     |
-                      VISA                 USBTMC
-                        |                     |
-                        -----------------------
+                  ----------------------------------
+                  |                |               |
+                VISA            USBTMC        MockDriver
+                  |                |               |
+                  ----------------------------------
                                    |
                              SignalGenerator
 """
 
 import os
 import time
+import errno
+import select
+import atexit
+import threading
+import contextlib
 import numpy as np
 import platform
 
+from pytes import estop
+from pytes.clock import REAL_CLOCK
+from pytes.scpi import (CommandEncoder, dialect_from_idn, block_length,
+                        parse_block)
+from pytes.events import (OUTPUT_ON, OUTPUT_OFF, FADE_STEP, PARAM, ARB_DONE,
+                          TRIGGER, EventPublisher, DEFAULT_ADDRESS)
+
 
 class BaseDriver(object):
     # A base class for different types of drivers
+    # Whether queries are answered by an instrument, see verify_arb
+    readback = True
+
     def __init__(self, dev=None):
         super(BaseDriver, self).__init__()
         pass
@@ -57,10 +72,43 @@ class BaseDriver(object):
     def set_cmd(self, scpi_command='', dev_fd=None):
         pass
 
-    def read_cmd(self, length, dev_fd=None):
+    def read_cmd(self, length, dev_fd=None, timeout=None):
+        pass
+
+    def query_cmd(self, scpi_command, length, dev_fd=None, timeout=None):
         pass
 
-    def query_cmd(self, scpi_command, length, dev_fd=None):
+    def write_raw(self, data):
+        # Write a pre-encoded command, see pytes.scpi.CommandEncoder
+        self.set_cmd(data.decode('utf8').strip())
+
+    def query_block(self, scpi_command, timeout=None):
+        # Payload of an IEEE 488.2 definite length block answer
+        data = self.query_cmd(scpi_command, length=65536, timeout=timeout)
+        return parse_block(data if isinstance(data, bytes) else
+                           data.encode('latin-1'))
+
+    def emergency_write(self, data):
+        # Write pre-encoded bytes bypassing any pending command, drivers
+        # use a separate file descriptor or session if possible
+        self.set_cmd(data.decode('utf8').strip())
+
+    def link_lost(self, error):
+        # Whether an error of an I/O call means the device is gone, a
+        # missing answer alone does not
+        return isinstance(error, OSError) and \
+            not isinstance(error, TimeoutError)
+
+    def reopen(self, idn=None):
+        # Open the device answering *IDN? with idn again, see
+        # SignalGenerator.recover. By default, the same location is opened
+        # again, drivers searching the device by idn override this.
+        dev = getattr(self, 'dev', None)
+        self.close()
+        self.__init__(dev=dev)
+        return dev
+
+    def close(self):
         pass
 
 
@@ -71,15 +119,25 @@ class VISA(BaseDriver):
     Disadvantages: Require several installations, e.g., pyvisa, device driver,
                    More details refer to README.md
 
+    All VISA objects of the process share one pyvisa.ResourceManager and a
+    cache of open sessions, indexed by the resource name. Listing devices,
+    creating a SignalGenerator and reconnecting therefore reuse the already
+    opened sessions instead of opening the device again.
+
     Parameters
     ----------
     dev : str | None (default None)
         The string used to index device based on ResourceManager object
+    timeout : int | None (default None)
+        I/O timeout in milliseconds, if None, VISA.timeout
+    chunk_size : int | None (default None)
+        Size in bytes of the chunks of bulk transfers, if None,
+        VISA.chunk_size
 
     Attributes
     ----------
-    dev: str | None (default None)
-        The string used to index device based on ResourceManager object
+    dev: pyvisa resource
+        The opened session of the device
     dev_fd: int
         File descriptor of the device (Not applicable for VISA driver)
 
@@ -88,21 +146,95 @@ class VISA(BaseDriver):
 
 
     """
-    def __init__(self, dev=None, inst=True):
-        try:
-            print('Attempt to use the VISA driver')
-            import pyvisa
-            self.rm = pyvisa.ResourceManager()
-        except ModuleNotFoundError:
-            print('---------------------------------------------------')
-            print('Use pip install -U pyvisa to install pyvisa package')
-            print('---------------------------------------------------')
-
-            raise ModuleNotFoundError
+    # Process-wide defaults, resource manager and session cache. The backend
+    # is passed to pyvisa.ResourceManager, e.g., '@py' for pyvisa-py
+    backend = ''
+    timeout = 2000
+    chunk_size = 20 * 1024
+    _rm = None
+    _sessions = {}
+    _lock = threading.Lock()
+
+    def __init__(self, dev=None, inst=True, timeout=None, chunk_size=None):
+        print('Attempt to use the VISA driver')
+        self.rm = VISA.resource_manager()
+        if timeout is not None:
+            self.timeout = timeout
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
         if inst:
             print(dev)
             self.__dev_init(dev=dev)
 
+    @classmethod
+    def resource_manager(cls):
+        # Create the shared ResourceManager on first use
+        with cls._lock:
+            if cls._rm is None:
+                try:
+                    import pyvisa
+                except ModuleNotFoundError:
+                    print('-' * 51)
+                    print('Use pip install -U pyvisa to install pyvisa '
+                          'package')
+                    print('-' * 51)
+
+                    raise ModuleNotFoundError
+                cls._rm = pyvisa.ResourceManager(cls.backend)
+                atexit.register(cls.close_all_sessions)
+        return cls._rm
+
+    def open_session(self, name):
+        """Open the resource or reuse its cached session
+
+        Parameters
+        ----------
+        name : str
+            VISA resource name, e.g., 'USB0::0x1AB1::0x0642::DG1ZA::INSTR'
+
+        Returns
+        -------
+        session : pyvisa resource
+
+        """
+        with VISA._lock:
+            session = VISA._sessions.get(name)
+            if session is not None:
+                try:
+                    # Raises if the session has been closed meanwhile
+                    session.session
+                except Exception:
+                    session = None
+            if session is None:
+                session = self.rm.open_resource(name)
+                VISA._sessions[name] = session
+        session.timeout = self.timeout
+        session.chunk_size = self.chunk_size
+        return session
+
+    @classmethod
+    def close_session(cls, name):
+        with cls._lock:
+            session = cls._sessions.pop(name, None)
+        if session is not None:
+            try:
+                session.close()
+            except Exception as e:
+                print(e)
+
+    @classmethod
+    def close_all_sessions(cls):
+        # Release all devices, e.g., before opening them via USBTMC
+        for name in list(cls._sessions):
+            cls.close_session(name)
+
+    def configure(self, timeout=None, chunk_size=None):
+        # Change the I/O timeout (ms) and bulk transfer chunk size (bytes)
+        if timeout is not None:
+            self.timeout = self.dev.timeout = timeout
+        if chunk_size is not None:
+            self.chunk_size = self.dev.chunk_size = chunk_size
+
     def __dev_init(self, dev):
         print('init')
         print(dev)
@@ -111,9 +243,75 @@ class VISA(BaseDriver):
             dev_id = input('Available devices are listed above and input ' +
                            'the corresponding id number to select the ' +
                            'desired device.\n')
-            self.dev = dev_instance_list[int(dev_id)]
-        else:
-            self.dev = self.rm.open_resource(dev)
+            dev = dev_instance_list[int(dev_id)]
+        self.dev_name = dev
+        self.dev = self.open_session(dev)
+        # A second, uncached session for the emergency stop
+        try:
+            self._abort_session = self.rm.open_resource(dev)
+        except Exception:
+            self._abort_session = None
+
+    def emergency_write(self, data):
+        session = self._abort_session
+        if session is None:
+            session = self.dev
+        session.write_raw(data)
+
+    def reconnect(self):
+        # Close and reopen the session of the device
+        VISA.close_session(self.dev_name)
+        self.dev = self.open_session(self.dev_name)
+
+    def link_lost(self, error):
+        # Timeouts are VisaIOErrors as well
+        code = getattr(error, 'error_code', None)
+        if code is not None:
+            from pyvisa.constants import StatusCode
+            return code != StatusCode.error_timeout
+        return super().link_lost(error)
+
+    def reopen(self, idn=None):
+        """Open the session of the device again after the link was lost
+
+        The previous resource is tried first, then all other resources are
+        searched for the device answering *IDN? with idn.
+
+        Returns
+        -------
+        dev : str
+            Resource name of the reopened device
+
+        """
+        VISA.close_session(self.dev_name)
+        if self._abort_session is not None:
+            try:
+                self._abort_session.close()
+            except Exception:
+                pass
+        names = [self.dev_name] + [i for i in self.rm.list_resources()
+                                   if i != self.dev_name]
+        for name in names:
+            # Sessions of other devices may be in use by other objects
+            cached = name in VISA._sessions
+            try:
+                session = self.open_session(name)
+                answer = session.query('*IDN?').strip()
+            except Exception:
+                answer = None
+            if answer is not None and (idn is None or answer == idn):
+                self.dev_name, self.dev = name, session
+                try:
+                    self._abort_session = self.rm.open_resource(name)
+                except Exception:
+                    self._abort_session = None
+                return name
+            if not cached:
+                VISA.close_session(name)
+        raise ConnectionError(f'No VISA resource answers *IDN? with {idn}')
+
+    def close(self):
+        VISA.close_session(self.dev_name)
 
     def dev_list(self):
         # Display all VISA compatible interfaces and indicate whethere they can
@@ -125,11 +323,12 @@ class VISA(BaseDriver):
         dev_name_list = self.rm.list_resources()
         for tmp_dev_id, tmp_dev_name in enumerate(dev_name_list):
             try:
-                tmp_dev = self.rm.open_resource(tmp_dev_name)
+                tmp_dev = self.open_session(tmp_dev_name)
                 tmp_msg = tmp_dev.query("*IDN?")
                 info = f'Id: {tmp_dev_id}, Device info: {tmp_msg}'
             except Exception as e:
-                tmp_dev = None
+                # Not a target device, do not keep it opened
+                VISA.close_session(tmp_dev_name)
                 info = f'Id: {tmp_dev_id}, Device info: Uncontrolable via SCPI\
                     commands, not target device'
                 print(e)
@@ -143,11 +342,37 @@ class VISA(BaseDriver):
     def set_cmd(self, scpi_command='', dev_fd=None):
         return self.dev.write(scpi_command)
 
-    def read_cmd(self, length, dev_fd=None):
-        return self.dev.read()
-
-    def query_cmd(self, scpi_command, length, dev_fd=None):
-        return self.dev.query(scpi_command)
+    def write_raw(self, data):
+        return self.dev.write_raw(data)
+
+    def read_cmd(self, length, dev_fd=None, timeout=None):
+        if timeout is None:
+            return self.dev.read()
+        with self._timeout(timeout):
+            return self.dev.read()
+
+    def query_cmd(self, scpi_command, length, dev_fd=None, timeout=None):
+        if timeout is None:
+            return self.dev.query(scpi_command)
+        with self._timeout(timeout):
+            return self.dev.query(scpi_command)
+
+    def query_block(self, scpi_command, timeout=None):
+        self.dev.write(scpi_command)
+        if timeout is None:
+            return parse_block(self.dev.read_raw())
+        with self._timeout(timeout):
+            return parse_block(self.dev.read_raw())
+
+    @contextlib.contextmanager
+    def _timeout(self, timeout):
+        # Timeout in seconds of the calls within the context
+        previous = self.dev.timeout
+        self.dev.timeout = timeout * 1e3
+        try:
+            yield
+        finally:
+            self.dev.timeout = previous
 
 
 class USBTMC(BaseDriver):
@@ -169,17 +394,89 @@ class USBTMC(BaseDriver):
         The location of usbtmc device
     dev_fd: int
         File descriptor of the device
+    timeout: float | None
+        Timeout of reads in seconds, if None (default), a read blocks until
+        the device answers or the kernel driver times out
 
     Returns
     -------
 
     """
+    timeout = None
 
     def __init__(self, dev=None, inst=True):
+        self.dev_fd = self._abort_fd = None
         if inst:
             self.__dev_init(dev)
             self.dev_fd = self.device_open()
             self.__info(dev_fd=self.dev_fd)
+            # A second file descriptor for the emergency stop, such that the
+            # off command is not queued behind a write in progress
+            try:
+                self._abort_fd = os.open(self.dev, os.O_RDWR)
+            except OSError:
+                self._abort_fd = None
+
+    def emergency_write(self, data):
+        os.write(self.dev_fd if self._abort_fd is None else self._abort_fd,
+                 data)
+
+    def close(self):
+        # The numbers of closed descriptors are reused, close them once
+        for fd in [self.dev_fd, self._abort_fd]:
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.dev_fd = self._abort_fd = None
+
+    def _probe(self, dev_fd, timeout=1.0):
+        # Answer to *IDN?, None if the device does not answer in time
+        os.write(dev_fd, b'*IDN?\n')
+        ready, _, _ = select.select([dev_fd], [], [], timeout)
+        if not ready:
+            return None
+        return os.read(dev_fd, 100).decode('utf8', errors='replace').strip()
+
+    def reopen(self, idn=None):
+        """Open the device node again after the link was lost
+
+        The previous location is tried first. If it is missing or answers
+        with another identity, e.g., after the USB bus enumerated the
+        devices anew, all USBTMC nodes of the same directory are searched
+        for the device answering *IDN? with idn.
+
+        Returns
+        -------
+        dev : str
+            Location of the reopened device
+
+        """
+        self.close()
+        port_root = os.path.dirname(self.dev)
+        candidates = [self.dev] + [i for i in
+                                   self.available_port_list(port_root)
+                                   if i != self.dev]
+        for dev in candidates:
+            try:
+                dev_fd = os.open(dev, os.O_RDWR)
+            except OSError:
+                continue
+            try:
+                answer = self._probe(dev_fd, timeout=self.timeout or 1.0)
+            except OSError:
+                answer = None
+            if answer is not None and (idn is None or answer == idn):
+                self.dev, self.dev_fd = dev, dev_fd
+                try:
+                    self._abort_fd = os.open(dev, os.O_RDWR)
+                except OSError:
+                    self._abort_fd = None
+                return dev
+            os.close(dev_fd)
+        raise ConnectionError(f'No device under {port_root} answers *IDN? '
+                              f'with {idn}')
 
     def __dev_init(self, dev):
         """ Initialize the devices based on given device path
@@ -252,8 +549,7 @@ class USBTMC(BaseDriver):
             dev_fd = os.open(dev, os.O_RDWR)
         finally:
             # Use os.fstat to detect file is opened or not
-            dup_check = [os.fstat(i) == os.fstat(dev_fd) for i in range(
-                dev_fd)]
+            dup_check = [self._same_file(i, dev_fd) for i in range(dev_fd)]
             if any(dup_check):
                 print('The device is already opened, use the first opened fd')
                 dev_fd = dup_check.index(True)
@@ -261,6 +557,14 @@ class USBTMC(BaseDriver):
 
             return dev_fd
 
+    @staticmethod
+    def _same_file(fd, dev_fd):
+        try:
+            return os.fstat(fd) == os.fstat(dev_fd)
+        except OSError:
+            # fd is not opened
+            return False
+
     def port_access(self, dev=None):
         # Check current access of given port/dev/address
         if dev is None:
@@ -299,18 +603,40 @@ class USBTMC(BaseDriver):
             in string'
         os.write(dev_fd, scpi_command.encode(encoding='utf8'))
 
-    def read_cmd(self, length=100, dev_fd=None):
+    def write_raw(self, data):
+        os.write(self.dev_fd, data)
+
+    def read_cmd(self, length=100, dev_fd=None, timeout=None):
         # Low level I/O to receive data stream from to device
         if dev_fd is None:
             dev_fd = self.dev_fd
+        if timeout is None:
+            timeout = self.timeout
+        if timeout is not None:
+            ready, _, _ = select.select([dev_fd], [], [], timeout)
+            if not ready:
+                raise TimeoutError(f'No answer within {timeout} s')
         return os.read(dev_fd, length)
 
-    def query_cmd(self, cmd, length=100, dev_fd=None):
+    def query_cmd(self, cmd, length=100, dev_fd=None, timeout=None):
         self.set_cmd(cmd, dev_fd=dev_fd)
         # time.sleep(0.2)
-        res = self.read_cmd(length=length, dev_fd=dev_fd)
+        res = self.read_cmd(length=length, dev_fd=dev_fd, timeout=timeout)
         return res
 
+    def query_block(self, cmd, timeout=None):
+        # A block may arrive in several reads
+        self.set_cmd(cmd)
+        data = self.read_cmd(length=65536, timeout=timeout)
+        length = block_length(data)
+        while length is None or len(data) < length:
+            chunk = self.read_cmd(length=65536, timeout=timeout)
+            if not chunk:
+                raise ValueError(f'Incomplete block of {len(data)} bytes')
+            data += chunk
+            length = block_length(data)
+        return parse_block(data)
+
     def __info(self, dev_fd=None):
         # Retrieve the device information
         self.set_cmd("*IDN?", dev_fd=dev_fd)
@@ -324,6 +650,77 @@ class USBTMC(BaseDriver):
         print("Reset is done!")
 
 
+class MockDriver(BaseDriver):
+    """Driver without hardware, e.g., for offline tests and dry runs
+
+    Every command is recorded with its timestamp instead of being sent.
+
+    Parameters
+    ----------
+    dev : str | None (default None)
+        Name of the mock device, only used for display
+    latency : float (default 0.0)
+        Simulated duration of every write in seconds
+    clock : RealClock | VirtualClock (default REAL_CLOCK)
+        Clock of the timestamps and the simulated latency, see pytes.clock
+
+    A lost link can be simulated with disconnect. There is no waveform
+    memory to read back, verify_arb is skipped.
+
+    Attributes
+    ----------
+    log : list of tuple
+        (clock.now() of the write, SCPI command) of every command
+    responses : dict
+        Responses of queries, indexed by the SCPI command
+
+    """
+    readback = False
+
+    def __init__(self, dev=None, inst=True, latency=0.0, clock=REAL_CLOCK):
+        self.dev = 'MOCK' if dev is None else dev
+        self.latency = latency
+        self.clock = clock
+        # Time until which the simulated link is lost, see disconnect
+        self._t_lost = None
+        self.log = []
+        self.responses = {'*IDN?': 'PyTES,MockDriver,0,0.0.1'}
+
+    def dev_list(self):
+        return [f'Id: 0, Device info: {self.responses["*IDN?"]}'], [self.dev]
+
+    def set_cmd(self, scpi_command='', dev_fd=None):
+        if self._t_lost is not None:
+            raise OSError(errno.ENODEV, 'Link to the mock device lost')
+        if self.latency > 0:
+            self.clock.sleep(self.latency)
+        self.log.append((self.clock.now(), scpi_command))
+
+    def write_raw(self, data):
+        self.set_cmd(data.decode('utf8').strip())
+
+    def read_cmd(self, length=100, dev_fd=None, timeout=None):
+        return b''
+
+    def emergency_write(self, data):
+        self.log.append((self.clock.now(), data.decode('utf8').strip()))
+
+    def query_cmd(self, scpi_command, length=100, dev_fd=None,
+                  timeout=None):
+        self.set_cmd(scpi_command)
+        return self.responses.get(scpi_command, '0')
+
+    def disconnect(self, duration=0.0):
+        # Fail all commands and reopen attempts for duration seconds
+        self._t_lost = self.clock.now() + duration
+
+    def reopen(self, idn=None):
+        if self._t_lost is not None and self.clock.now() < self._t_lost:
+            raise FileNotFoundError(errno.ENOENT, 'Mock device not found')
+        self._t_lost = None
+        return self.dev
+
+
 class SignalGenerator():
     """Convert the python command into low level I/O command (SCPI) and use
     selected driver to communicate with the target hardware
@@ -332,16 +729,25 @@ class SignalGenerator():
     ----------
     dev : str | None (default None)
         The location of usbtmc device
-    protocol : 'USBTMC' | 'VISA' | None (default None)
+    protocol : 'USBTMC' | 'VISA' | 'MOCK' | None (default None)
         The driver for communicate with target hardwares. If None, a default
         driver will be chosen based on the operating system.
-        USBTMC - Linux, VISA - Windows/MacOS
+        USBTMC - Linux, VISA - Windows/MacOS, MOCK - no hardware
     out_chn : 1 | 2 (default 1)
         Output channel to configure
     mode : 'sin' | 'sweep?'
         !!! should be checked one by one and filling in
     amp : float (default 0.5)
         Amplitude of signal in the unit of Volt
+    dialect : pytes.scpi.Dialect | None (default None)
+        Command dialect of the instrument. If None, selected from the
+        answer to *IDN? when connecting.
+    clock : RealClock | VirtualClock (default REAL_CLOCK)
+        Clock of all sleeps, waits and timestamps, see pytes.clock. With a
+        VirtualClock and the MOCK protocol, a session runs in virtual time.
+    auto_reconnect : bool (default True)
+        If True, a lost link to the device is recovered and the state of
+        the channels is restored, see recover
 
     Attributes
     ----------
@@ -349,14 +755,44 @@ class SignalGenerator():
         The location of usbtmc device
     dev_fd: int
         File descriptor of the device
+    idn : str
+        Answer of the device to *IDN?, used to find it again
+    recoveries : list of dict
+        Reports of all recoveries of the link, see recover
+    commanded : dict
+        Last commanded 'output' (1.0 or 0.0), 'amp', 'offset',
+        'frequency' and 'phase' of every channel, as far as known
+    telemetry : pytes.telemetry.TelemetryPoller | None
+        Read-back poller, see start_telemetry
+    arb_checks : dict
+        Latest report of verify_arb of every channel
+    capabilities : pytes.capabilities.Capabilities
+        Output limits of the connected model
 
     Returns
     -------
 
     """
+    # Bounded exponential backoff of the reconnect attempts, in seconds
+    reconnect_attempts = 8
+    reconnect_backoff = 0.05
+    reconnect_max_backoff = 2.0
+    # Verify the waveform memory after every upload of arb_func
+    verify_uploads = True
+    # Commands setting the waveform, which resets the other parameters
+    _waveforms = ['sin', 'dc', 'noise', 'arb']
+    # Commanded values set by the values of a command
+    _fields = {'sin': ['frequency', 'amp', 'offset', 'phase'],
+               'dc': ['offset'], 'noise': ['amp', 'offset'],
+               'amp': ['amp'], 'offset': ['offset'],
+               'frequency': ['frequency'], 'phase': ['phase'],
+               'output': ['output']}
+
     def __init__(self, dev='/dev/usbtmc1', protocol=None, out_chn=1,
-                 mode='sin', amp=0.5):
+                 mode='sin', amp=0.5, dialect=None, clock=REAL_CLOCK,
+                 auto_reconnect=True):
         self.os_ver = platform.platform()
+        self.clock = clock
         if protocol is None:
             if 'Linux' in self.os_ver:
                 protocol = 'USBTMC'
@@ -374,22 +810,370 @@ class SignalGenerator():
             # use super to call base and to avoid call USBTMC
             # self.protocol = super(USBTMC, self)
             self.protocol = VISA(dev=dev)
+        elif protocol == 'MOCK':
+            self.protocol = MockDriver(dev=dev, clock=clock)
         else:
             raise ValueError('Unsupported protocol.')
         # self.protocol.__init__(dev=dev)
 
         self.out_chn = out_chn
+        # Serialize the device I/O, e.g., when both channels are driven by
+        # different threads of the GUI timeline executor
+        self._io_lock = threading.RLock()
+        # Publisher of timestamped events, enabled via publish_events
+        self.events = None
+        self._event_ctx = threading.local()
+        # Timer thread and latency model of scheduled commands
+        self.scheduler = None
+        self.latency_model = None
+        # Set by emergency_stop, interrupts fades, arb uploads and
+        # recoveries until rearm is called
+        self._abort = threading.Event()
+        # Last known state of every channel, replayed by recover
+        self.auto_reconnect = auto_reconnect
+        self.recoveries = []
+        self._recovering = False
+        self._journal = {}
+        self._arb = {}
+        self.commanded = {}
+        # Time of the last command, the telemetry poller yields to commands
+        self._t_io = float('-inf')
+        self.telemetry = None
+        self.arb_checks = {}
+        self.idn = None
+        self.idn = self.identify()
+        # Precompiled commands of the dialect of the connected model
+        if dialect is None:
+            dialect = dialect_from_idn(self.idn)
+        self.encoder = CommandEncoder(dialect)
+        # Imported on connect, the table of models is not needed before
+        from pytes.capabilities import capabilities_from_idn
+        self.capabilities = capabilities_from_idn(self.idn)
+        self._off_all = self.encoder.join(
+            [self.encoder.encode('off', chn) for chn in dialect.channels])
+        # Channels waiting for a trigger, see arm
+        self._armed = None
+        estop.register_device(self)
 
     def set_cmd(self, scpi_command, dev_fd=None):
-        self.protocol.set_cmd(scpi_command=scpi_command, dev_fd=dev_fd)
+        self._io('write', self.protocol.set_cmd, scpi_command=scpi_command,
+                 dev_fd=dev_fd)
+
+    def write_raw(self, data):
+        # Write a pre-encoded command, see pytes.scpi.CommandEncoder
+        self._io('write', self.protocol.write_raw, data)
+
+    def _io(self, role, func, *args, **kwargs):
+        """Call the driver under the I/O lock and recover a lost link
+
+        Parameters
+        ----------
+        role : 'state' | 'query' | 'write'
+            'state' commands are remembered before they are sent, hence
+            restored by the recovery. A 'query' is repeated after the
+            recovery, a failed 'write' is reported as lost.
+        func : callable
+            Method of the driver
+
+        """
+        with self._io_lock:
+            self._t_io = self.clock.now()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if not self.auto_reconnect or self._recovering or \
+                        not self.protocol.link_lost(e):
+                    raise
+                lost = None
+                if role == 'write':
+                    lost = args[0] if args else kwargs.get('scpi_command')
+                    if isinstance(lost, bytes):
+                        lost = lost.decode('utf8', errors='replace').strip()
+                self.recover(error=e, lost=lost)
+                if role == 'query':
+                    return func(*args, **kwargs)
+
+    def _remember(self, chn, key, data, values=()):
+        # Record the latest command of a channel setting key, in order, and
+        # the commanded values
+        journal = self._journal.setdefault(chn, {})
+        commanded = self.commanded.setdefault(chn, {})
+        if key in self._waveforms:
+            for i in self._waveforms + ['amp', 'offset', 'frequency',
+                                        'phase']:
+                journal.pop(i, None)
+                commanded.pop(i, None)
+        journal.pop(key, None)
+        if isinstance(data, str):
+            data = (data + self.encoder.dialect.terminator).encode('utf8')
+        journal[key] = data
+        for field, val in zip(self._fields.get(key, []), values):
+            try:
+                commanded[field] = float(val)
+            except (TypeError, ValueError):
+                commanded.pop(field, None)
+
+    def recover(self, error=None, lost=None):
+        """Reopen the device and restore the state of all channels
+
+        Called when a command fails because the link to the device is lost,
+        e.g., after a USB hiccup. The device is searched by its answer to
+        *IDN?, as its location may change, with at most reconnect_attempts
+        attempts and an exponential backoff from reconnect_backoff up to
+        reconnect_max_backoff seconds. The last command of every parameter,
+        the running sweep or burst and the output state of all channels
+        are then sent in one message, outputs last. Arbitrary data is
+        uploaded again only if the instrument does not hold all of its
+        points anymore.
+
+        Parameters
+        ----------
+        error : Exception | None (default None)
+            Error indicating the lost link
+        lost : str | None (default None)
+            Failed command which is not part of the restored state
+
+        Returns
+        -------
+        report : dict
+            'duration' of the recovery in seconds, the number of
+            'attempts', the location 'dev' of the device, the number of
+            'replayed' commands, the channels with 'arb_uploaded' data and
+            the 'lost' command or None
+
+        """
+        t_loss = self.clock.now()
+        print(f'Link to the device lost: {error}')
+        if not callable(getattr(self.protocol, 'reopen', None)):
+            raise ConnectionError(f'Link to {self.idn} lost, '
+                                  f'{type(self.protocol).__name__} cannot '
+                                  'reopen the device') from error
+        delay = self.reconnect_backoff
+        self._recovering = True
+        try:
+            for attempt in range(1, self.reconnect_attempts + 1):
+                try:
+                    with self._io_lock:
+                        dev = self.protocol.reopen(self.idn)
+                        n_replayed, uploaded = self._restore()
+                    break
+                except Exception as e:
+                    if not self.protocol.link_lost(e):
+                        raise
+                    error = e
+                # Waiting on the abort event ends the recovery on
+                # emergency stop
+                if attempt == self.reconnect_attempts or \
+                        self.clock.wait(self._abort, delay):
+                    raise ConnectionError(f'Device {self.idn} not '
+                                          f'recovered after {attempt} '
+                                          'attempts') from error
+                delay = min(2 * delay, self.reconnect_max_backoff)
+        finally:
+            self._recovering = False
+
+        report = {'t_loss': t_loss, 'duration': self.clock.now() - t_loss,
+                  'attempts': attempt, 'dev': dev, 'replayed': n_replayed,
+                  'arb_uploaded': uploaded, 'lost': lost}
+        self.recoveries.append(report)
+        print(f'Link recovered after {report["duration"]*1e3:.1f} ms and '
+              f'{attempt} attempt(s), {n_replayed} commands replayed, '
+              + ('no command lost' if lost is None else f'lost: {lost}'))
+        return report
+
+    def _restore(self):
+        # Send the journal of all channels in one message, outputs last
+        config, outputs, uploads = [], [], []
+        for chn, journal in self._journal.items():
+            for key, data in journal.items():
+                (outputs if key == 'output' else config).append(data)
+            if 'arb' in journal and chn in self._arb and \
+                    not self._arb_resident(chn):
+                uploads.append(chn)
+        n_replayed = len(config) + len(outputs)
+        if uploads:
+            # Outputs are switched on only after the uploads
+            if config:
+                self.protocol.write_raw(self.encoder.join(config))
+            for chn in uploads:
+                self._upload_arb(chn)
+            config = []
+        if config or outputs:
+            self.protocol.write_raw(self.encoder.join(config + outputs))
+        return n_replayed, uploads
+
+    def _arb_resident(self, chn):
+        # Whether the instrument still holds all points of the arb data
+        arb = self._arb[chn]
+        if not arb['complete'] or not self.encoder.supports('arb_points?'):
+            return False
+        try:
+            n_points = int(float(self.protocol.query_cmd(
+                self.encoder.text('arb_points?', chn))))
+        except Exception:
+            return False
+        return n_points == len(arb['data'])
+
+    def identify(self):
+        # Answer of the device to *IDN?, '' if the query fails
+        try:
+            idn = self.query_cmd('*IDN?')
+        except Exception as e:
+            print(f'*IDN? failed: {e}')
+            return ''
+        if isinstance(idn, bytes):
+            idn = idn.decode('utf8', errors='replace')
+        return idn.strip()
+
+    def publish_events(self, address=DEFAULT_ADDRESS, maxsize=4096):
+        """Publish a timestamped event for every state-changing command
+
+        Parameters
+        ----------
+        address : tuple | str (default ('127.0.0.1', 5679))
+            (host, port) for UDP or the location of a Unix datagram socket
+        maxsize : int (default 4096)
+            Size of the event queue, events are dropped if it is full
+
+        Returns
+        -------
+        events : EventPublisher
+
+        """
+        if self.events is not None:
+            self.events.close()
+        self.events = EventPublisher(address=address, maxsize=maxsize)
+        return self.events
+
+    @contextlib.contextmanager
+    def event_kind(self, kind):
+        # Override the kind of the events published by the current thread,
+        # e.g., amplitude changes within a fade are published as FADE_STEP
+        prev = getattr(self._event_ctx, 'kind', None)
+        self._event_ctx.kind = kind
+        try:
+            yield
+        finally:
+            self._event_ctx.kind = prev
+
+    def _state_cmd(self, scpi_command, kind, chn, value=float('nan')):
+        # Send a state-changing command and publish its event
+        if self.events is None:
+            self._io('state', self.protocol.set_cmd, scpi_command)
+            return
+        kind = getattr(self._event_ctx, 'kind', None) or kind
+        with self._io_lock:
+            t_before = self.clock.now_ns()
+            self._io('state', self.protocol.set_cmd, scpi_command)
+            t_after = self.clock.now_ns()
+        self.events.publish(kind, chn, t_before, t_after, value, scpi_command)
+
+    def _state_write(self, data, kind, chn, value=float('nan')):
+        # Same as _state_cmd for a pre-encoded command
+        if self.events is None:
+            self._io('state', self.protocol.write_raw, data)
+            return
+        kind = getattr(self._event_ctx, 'kind', None) or kind
+        with self._io_lock:
+            t_before = self.clock.now_ns()
+            self._io('state', self.protocol.write_raw, data)
+            t_after = self.clock.now_ns()
+        self.events.publish(kind, chn, t_before, t_after, value,
+                            data.decode('utf8').rstrip())
 
     def read_cmd(self, length=100, dev_fd=None):
-        self.protocol.read_cmd(length=length, dev_fd=dev_fd)
+        with self._io_lock:
+            return self.protocol.read_cmd(length=length, dev_fd=dev_fd)
 
     def query_cmd(self, scpi_command, length=100, dev_fd=None):
-        res = self.protocol.query_cmd(cmd=scpi_command, length=length,
-                                      dev_fd=dev_fd)
-        return res
+        return self._io('query', self.protocol.query_cmd, scpi_command,
+                        length=length, dev_fd=dev_fd)
+
+    def emergency_stop(self):
+        """Interrupt fades and uploads and switch off both outputs
+
+        The pre-encoded off command bypasses the I/O lock. Use
+        pytes.estop.emergency_stop() to stop all devices and cancel timeline
+        sessions and scheduled commands as well.
+
+        """
+        self._abort.set()
+        # A recovered link must not switch the outputs on again
+        for chn in self.encoder.dialect.channels:
+            self._remember(chn, 'output', self.encoder.encode('off', chn),
+                           (0,))
+        self.protocol.emergency_write(self._off_all)
+        if self.scheduler is not None:
+            self.scheduler.emergency_stop()
+        # A command in progress on the regular session may still arrive
+        # after the off command, so repeat it once the I/O lock is free
+        threading.Thread(target=self._confirm_off, daemon=True).start()
+
+    def _confirm_off(self):
+        with self._io_lock:
+            self.protocol.emergency_write(self._off_all)
+
+    def rearm(self):
+        """Allow fades and arb uploads again after an emergency stop
+
+        The emergency stop stays in effect until rearm is called, starting
+        a fade or an upload does not clear it. Use pytes.estop.rearm() to
+        rearm all devices.
+
+        """
+        self._abort.clear()
+
+    @property
+    def stopped(self):
+        # True after an emergency stop until rearm
+        return self._abort.is_set()
+
+    def _check_armed(self):
+        if self._abort.is_set():
+            raise RuntimeError('Emergency stop in effect, call rearm() '
+                               'first')
+
+    def schedule(self, t_monotonic, cmd, chn=None, label=''):
+        """Let a command take effect at a given time
+
+        The command is dispatched by a timer thread, ahead of t_monotonic by
+        the write-to-effect latency predicted by self.latency_model. Call
+        calibrate_latency once after connecting for a device specific model.
+
+        Parameters
+        ----------
+        t_monotonic : float
+            time.monotonic() at which the command should take effect
+        cmd : str | dict | callable
+            SCPI command, parameters passed to para_set, or a function
+        chn : 1 | 2 | None (default None)
+            Output channel for parameter dicts
+        label : str (default '')
+            Description of the command in the records
+
+        Returns
+        -------
+        item : ScheduledCommand
+            Handle to wait for or cancel the command, and to read the
+            achieved timing error once it is dispatched
+
+        """
+        if self.scheduler is None:
+            from pytes.scheduling import CommandScheduler
+            self.scheduler = CommandScheduler(
+                self, model=self.latency_model)
+            self.latency_model = self.scheduler.model
+        return self.scheduler.schedule(t_monotonic, cmd, chn=chn,
+                                       label=label)
+
+    def calibrate_latency(self, n_round=20):
+        # Learn the write-to-effect latency from timed round-trips
+        from pytes.scheduling import LatencyModel
+        if self.latency_model is None:
+            self.latency_model = LatencyModel()
+        latency = self.latency_model.calibrate(self, n_round=n_round)
+        print(f'Predicted write-to-effect latency: {latency*1e3:.3f} ms')
+        return latency
 
     def chn_check(self, chn):
         # To ensure the output channel is not None
@@ -402,44 +1186,124 @@ class SignalGenerator():
         # Get current configurations of both channels
         # For sine mode, the parameters are in the order of frequency,
         # amplitude, offset and phase
-        for i in [1, 2]:
-            self.set_cmd(':SOURce' + str(i) + ':APPLy?')
-            time.sleep(0.2)
+        res = {}
+        for i in self.encoder.dialect.channels:
+            res[i] = self.query_cmd(self.encoder.text('apply?', i))
             print(f'CHN{str(i)}:')
-            print(self.query_cmd())
+            print(res[i])
+        return res
+
+    def start_telemetry(self, rate=2.0, **kwargs):
+        """Poll the read-back of all channels in a background thread
 
-    def para_set(self, para_dict, chn=None):
+        Parameters
+        ----------
+        rate : float (default 2.0)
+            Polls per second
+        **kwargs
+            Passed to pytes.telemetry.TelemetryPoller
+
+        Returns
+        -------
+        poller : TelemetryPoller
+            Holds the time series of the read-back values and mismatches
+
+        """
+        from pytes.telemetry import TelemetryPoller
+        if self.telemetry is not None:
+            self.telemetry.stop()
+        self.telemetry = TelemetryPoller(self, rate=rate, **kwargs).start()
+        return self.telemetry
+
+    def verify_arb(self, chn=None, **kwargs):
+        """Read back the waveform memory and compare it with the upload
+
+        Parameters
+        ----------
+        chn : 1 | 2 (default 1)
+            Output channel
+        **kwargs
+            Passed to pytes.verify.verify_arb, e.g., method or n_samples
+
+        Returns
+        -------
+        report : dict | None
+            See pytes.verify.verify_arb, None if the driver or the dialect
+            cannot read back the memory
+
+        """
+        from pytes.verify import verify_arb
+        chn = self.chn_check(chn)
+        if not self.protocol.readback or not (
+                self.encoder.supports('arb_value?') or
+                self.encoder.supports('arb_block?')):
+            return None
+        report = verify_arb(self, chn, **kwargs)
+        self.arb_checks[chn] = report
+        if not report['match']:
+            print(f'CH{chn}: arbitrary data differs from the upload at '
+                  f'{len(report["mismatches"])} of {report["n_checked"]} '
+                  f'checked points, {report["points_read"]} of '
+                  f'{report["n_points"]} points held')
+        return report
+
+    def para_set(self, para_dict, chn=None, delay=0.05):
         # To conveniently configure multiple parameters in one python command
+        # delay is the pause in seconds after each command
         chn = self.chn_check(chn)
         special_dict = {'offset': 'VOLT:OFFS',
                         'sin': ['APPL:SIN', '', '', '', ''],
                         'dc': 'APPL:DC 1,1,',
                         'noise': ['APPL:NOIS', '']}
         for key, val in para_dict.items():
-            if key not in special_dict.keys():
-                self.set_cmd(self.prefix + ':' + key[:4].upper() + ' ' +
-                             str(val).upper())
+            # Scalar values are published with the event
+            value = val if isinstance(val, (int, float)) else float('nan')
+            values = val if isinstance(val, (list, tuple)) else [val]
+            if self.encoder.supports(key) and all(
+                    isinstance(i, (int, float, np.number)) for i in values):
+                # Numeric parameters of the dialect use the precompiled
+                # command, the others are sent in the Rigol syntax
+                try:
+                    data = self.encoder.encode(key, chn, *values)
+                except TypeError:
+                    raise ValueError(f'Wrong number of values for {key}: '
+                                     f'{val}')
+                self._remember(chn, key, data, values)
+                self._state_write(data, PARAM, chn, value)
+            elif key not in special_dict.keys():
+                cmd = self.prefix + ':' + key[:4].upper() + ' ' + \
+                    str(val).upper()
+                self._remember(chn, key, cmd, values)
+                self._state_cmd(cmd, PARAM, chn, value)
             else:
                 if type(special_dict[key]) == list:
                     suffix = ''
                     for i, j in zip(special_dict[key], val):
                         suffix += f'{i} {str(j).upper()},'
-                    self.set_cmd(self.prefix + ':' + suffix[:-1])
-                    print(self.prefix + ':' + suffix[:-1])
+                    cmd = self.prefix + ':' + suffix[:-1]
+                    self._remember(chn, key, cmd, values)
+                    self._state_cmd(cmd, PARAM, chn)
                 else:
-                    self.set_cmd(self.prefix + ':' + special_dict[key] + ' ' +
-                                 str(val).upper())
-            time.sleep(0.05)
+                    cmd = self.prefix + ':' + special_dict[key] + ' ' + \
+                        str(val).upper()
+                    self._remember(chn, key, cmd, values)
+                    self._state_cmd(cmd, PARAM, chn, value)
+            if delay > 0:
+                self.clock.sleep(delay)
 
     def on(self, chn=None):
         # Turn on the output channel
         chn = self.chn_check(chn)
-        self.set_cmd(f':OUTPut{chn} ON')
+        data = self.encoder.encode('on', chn)
+        self._remember(chn, 'output', data, (1,))
+        self._state_write(data, OUTPUT_ON, chn)
 
     def off(self, chn=None):
         # Turn off the output channel
         chn = self.chn_check(chn)
-        self.set_cmd(':OUTPut' + str(chn) + ' OFF')
+        data = self.encoder.encode('off', chn)
+        self._remember(chn, 'output', data, (0,))
+        self._state_write(data, OUTPUT_OFF, chn)
 
     def _single_para_set(self, para='amp', value=None, query=False, chn=None):
         """ Configure the single paramter or get the current configuration
@@ -460,17 +1324,16 @@ class SignalGenerator():
         assert value is not None or query, 'When query is False, valid \
             value must be given'
         chn = self.chn_check(chn)
-
-        para_dict = {'amp': ':VOLT',
-                     'offset': ':VOLT:OFFS',
-                     'frequency': ':FREQ',
-                     'phase': ':PHAS',
-                     }
+        assert para in ['amp', 'offset', 'frequency', 'phase'], \
+            f'Unsupported parameter {para}'
 
         if query:
-            print(self.query_cmd(f':SOUR{str(chn)}{para_dict[para]}?'))
+            print(self.query_cmd(self.encoder.text(para + '?', chn)))
         else:
-            self.set_cmd(f':SOUR{str(chn)}{para_dict[para]} {str(value)}')
+            value = float(value)
+            data = self.encoder.encode(para, chn, value)
+            self._remember(chn, para, data, (value,))
+            self._state_write(data, PARAM, chn, value)
 
     def amp(self, value=None, chn=1, stim_mode='tACS'):
         """ Adjust the amplitude of stimulation signal
@@ -496,6 +1359,275 @@ class SignalGenerator():
     def phase(self, value=None, query=False, chn=None):
         self._single_para_set(para='phase', value=value, query=query, chn=chn)
 
+    def sweep(self, start, stop, duration, spacing='linear', chn=None,
+              trigger_source='immediate'):
+        """ Let the sweep engine of the instrument change the frequency
+
+        All settings are sent in one message, the frequency is then stepped
+        by the instrument instead of the host. With the trigger source
+        'immediate', the sweep repeats every duration seconds, otherwise
+        one sweep runs per trigger.
+
+        Parameters
+        ----------
+        start, stop : float
+            Start and stop frequency in Hz
+        duration : float
+            Duration of one sweep in seconds
+        spacing : 'linear' | 'log' (default 'linear')
+            Course of the frequency over the sweep
+        chn : 1 | 2 (default 1)
+            Output channel to configure
+        trigger_source : 'immediate' | 'external' | 'bus'
+            (default 'immediate')
+            Start of the sweeps, 'bus' starts a sweep on *TRG
+
+        Returns
+        -------
+        timeline : dict
+            The settings and the expected frequency 'freq' (Hz) at the times
+            't' (s) relative to the start of a sweep
+
+        """
+        chn = self.chn_check(chn)
+        if duration <= 0 or start <= 0 or stop <= 0:
+            raise ValueError('Frequencies and duration must be positive')
+        dialect = self.encoder.dialect
+        data = self.encoder.encode(
+            'sweep', chn, start, stop, duration,
+            dialect.keyword('spacings', spacing),
+            dialect.keyword('trigger_sources', trigger_source))
+        self._remember(chn, 'engine', data)
+        # The frequency is changed by the instrument
+        self.commanded.get(chn, {}).pop('frequency', None)
+        self._state_write(data, PARAM, chn)
+
+        t = np.linspace(0, duration, 101)
+        if spacing == 'log':
+            freq = start * (stop / start) ** (t / duration)
+        else:
+            freq = start + (stop - start) * t / duration
+        return {'mode': 'sweep', 'chn': chn, 'trigger': trigger_source,
+                'repeat': trigger_source == 'immediate', 'start': start,
+                'stop': stop, 'duration': duration, 'spacing': spacing,
+                't': t, 'freq': freq}
+
+    def burst(self, cycles, period, chn=None, trigger_source='immediate',
+              freq=None):
+        """ Let the burst engine of the instrument output trains of cycles
+
+        All settings are sent in one message. With the trigger source
+        'immediate', a burst starts every period seconds, otherwise one
+        burst is output per trigger.
+
+        Parameters
+        ----------
+        cycles : int
+            Number of cycles of the current waveform per burst
+        period : float
+            Interval between the starts of two bursts in seconds
+        chn : 1 | 2 (default 1)
+            Output channel to configure
+        trigger_source : 'immediate' | 'external' | 'bus'
+            (default 'immediate')
+            Start of the bursts, 'bus' starts a burst on *TRG
+        freq : float | None (default None)
+            Frequency of the waveform in Hz, set in the same message. If
+            None, the current frequency is queried for the timeline.
+
+        Returns
+        -------
+        timeline : dict
+            The settings and the expected on ('t_on') and off ('t_off')
+            time of a burst in seconds relative to its start
+
+        """
+        chn = self.chn_check(chn)
+        if int(cycles) != cycles or cycles < 1 or period <= 0:
+            raise ValueError('cycles must be a positive integer and period '
+                             'must be positive')
+        commands = []
+        if freq is not None:
+            commands.append(self.encoder.encode('frequency', chn, freq))
+            self._remember(chn, 'frequency', commands[-1], (freq,))
+        else:
+            try:
+                freq = float(self.query_cmd(
+                    self.encoder.text('frequency?', chn)))
+            except (ValueError, TypeError):
+                freq = float('nan')
+        burst_dur = cycles / freq if freq and freq > 0 else float('nan')
+        if trigger_source == 'immediate' and burst_dur > period:
+            raise ValueError(f'A burst of {cycles} cycles at {freq} Hz lasts '
+                             f'{burst_dur} s, longer than the period')
+        commands.append(self.encoder.encode(
+            'burst', chn, int(cycles), period,
+            self.encoder.dialect.keyword('trigger_sources', trigger_source)))
+        self._remember(chn, 'engine', commands[-1])
+        self._state_write(self.encoder.join(commands), PARAM, chn)
+
+        return {'mode': 'burst', 'chn': chn, 'trigger': trigger_source,
+                'repeat': trigger_source == 'immediate', 'cycles': cycles,
+                'period': period, 'freq': freq, 't_on': 0.0,
+                't_off': burst_dur}
+
+    def engine_off(self, chn=None):
+        # Return from sweep or burst mode to the continuous output
+        chn = self.chn_check(chn)
+        data = self.encoder.join([self.encoder.encode('sweep_off', chn),
+                                  self.encoder.encode('burst_off', chn)])
+        self._remember(chn, 'engine', data)
+        self._state_write(data, PARAM, chn)
+
+    def arm(self, para_dict=None, chn=None, trigger_source='bus',
+            cycles=None, trigger_line=None):
+        """ Prepare the stimulation onset, such that fire() starts it
+
+        The parameters are loaded, the burst engine of the channels waits
+        for the trigger and the outputs are switched on, all ahead of time.
+        Until the trigger, the outputs stay at the idle level of the burst.
+        The trigger command is pre-encoded, such that firing is a single
+        minimal write.
+
+        Parameters
+        ----------
+        para_dict : dict | None (default None)
+            Parameters loaded before arming, see para_set
+        chn : 1 | 2 | list (default 1)
+            Output channel(s) started by the same trigger
+        trigger_source : 'bus' | 'external' (default 'bus')
+            'bus' starts on the *TRG command sent by fire(), 'external' on
+            the trigger input of the instrument
+        cycles : int | None (default None)
+            Number of cycles output per trigger, if None, the output
+            continues until it is disarmed or switched off
+        trigger_line : callable | None (default None)
+            Function asserting the external trigger line, e.g., of a DAQ
+            card, called by fire() instead of sending *TRG
+
+        """
+        if trigger_source not in ['bus', 'external']:
+            raise ValueError('trigger_source must be "bus" or "external"')
+        chns = chn if isinstance(chn, (list, tuple)) else [chn]
+        chns = [self.chn_check(i) for i in chns]
+        source = self.encoder.dialect.keyword('trigger_sources',
+                                              trigger_source)
+        t0 = self.clock.now()
+        commands = []
+        for i in chns:
+            if para_dict:
+                self.para_set(para_dict, chn=i, delay=0)
+            if cycles is None:
+                commands.append(self.encoder.encode('burst_infinite', i,
+                                                    source))
+            else:
+                # The internal period is not used with these trigger sources
+                commands.append(self.encoder.encode('burst', i, int(cycles),
+                                                    1.0, source))
+            self._remember(i, 'engine', commands[-1])
+            commands.append(self.encoder.encode('on', i))
+            self._remember(i, 'output', commands[-1], (1,))
+        self._state_write(self.encoder.join(commands), PARAM, chns[0])
+
+        if trigger_line is None and trigger_source == 'external':
+            fire_data = None
+        else:
+            # One trigger command per distinct message, e.g., a single *TRG
+            # for both channels
+            fire_data = self.encoder.join(list(dict.fromkeys(
+                self.encoder.encode('trigger', i) for i in chns)))
+        self._armed = {'chns': chns, 'data': fire_data, 'line': trigger_line,
+                       'arm_dur': self.clock.now() - t0}
+        return self._armed
+
+    def fire(self):
+        """ Start the output of the armed channels
+
+        Returns
+        -------
+        t_before, t_after : int
+            clock.now_ns() before and after the trigger
+
+        """
+        armed = self._armed
+        if armed is None:
+            raise RuntimeError('No channel is armed, call arm() first')
+        if armed['line'] is not None:
+            t_before = self.clock.now_ns()
+            armed['line']()
+            t_after = self.clock.now_ns()
+        elif armed['data'] is None:
+            raise RuntimeError('The channels wait for the external trigger '
+                               'input, assert it in hardware or pass '
+                               'trigger_line to arm()')
+        else:
+            with self._io_lock:
+                t_before = self.clock.now_ns()
+                self._io('write', self.protocol.write_raw, armed['data'])
+                t_after = self.clock.now_ns()
+        if self.events is not None:
+            for i in armed['chns']:
+                self.events.publish(TRIGGER, i, t_before, t_after)
+        return t_before, t_after
+
+    def disarm(self):
+        # Switch off the armed channels and leave the burst mode
+        if self._armed is None:
+            return
+        commands = []
+        for i in self._armed['chns']:
+            commands += [self.encoder.encode('off', i),
+                         self.encoder.encode('burst_off', i)]
+            self._remember(i, 'output', commands[-2], (0,))
+            self._remember(i, 'engine', commands[-1])
+        self._state_write(self.encoder.join(commands), OUTPUT_OFF,
+                          self._armed['chns'][0])
+        self._armed = None
+
+    def measure_fire(self, n_round=100, interval=0.05, **arm_kwargs):
+        """ Distribution of the arming and firing latency
+
+        Every round arms the channels, waits for interval seconds and fires.
+        The outputs are switched on during the measurement, disconnect the
+        electrodes first.
+
+        Parameters
+        ----------
+        n_round : int (default 100)
+            Number of arm/fire rounds
+        interval : float (default 0.05)
+            Pause between arming and firing in seconds
+        **arm_kwargs
+            Passed to arm, e.g., chn or trigger_source
+
+        Returns
+        -------
+        report : dict
+            Percentiles, mean and std in ms of 'arm', the duration of
+            arming, and 'fire', the duration from calling fire() to the
+            completed trigger write
+
+        """
+        arm_dur, fire_dur = np.zeros(n_round), np.zeros(n_round)
+        for i in range(n_round):
+            arm_dur[i] = self.arm(**arm_kwargs)['arm_dur']
+            self.clock.sleep(interval)
+            t0 = self.clock.now_ns()
+            _, t_after = self.fire()
+            fire_dur[i] = (t_after - t0) / 1e9
+        self.disarm()
+
+        report = {}
+        for name, dur in [('arm', arm_dur), ('fire', fire_dur)]:
+            dur = dur * 1e3
+            p50, p95, p99 = np.percentile(dur, [50, 95, 99])
+            report[name] = {'min_ms': float(dur.min()), 'p50_ms': float(p50),
+                            'p95_ms': float(p95), 'p99_ms': float(p99),
+                            'max_ms': float(dur.max()),
+                            'mean_ms': float(dur.mean()),
+                            'std_ms': float(dur.std())}
+        return report
+
     def arb_func(self, data, sps=None, chn=None):
         """ Output a predefined 1-D signal with arbitrary shape.
 
@@ -528,19 +1660,56 @@ class SignalGenerator():
         data = (data + 2.5) * 16383 / 5
         data = data.astype('int')  # The data sent via SCPI must be INT
         n_data = len(data)
-        self.set_cmd(':SOUR' + str(chn) + ':APPL:ARB ' + str(self.sps))
-        time.sleep(0.1)
-        self.set_cmd(':SOUR' + str(chn) +
-                     ':DATA:POIN VOLATILE, ' + str(n_data))
-        time.sleep(0.1)
-        for ind in range(len(data)):
-            data_str = ':SOUR' + str(chn) + \
-                ':DATA:VALue VOLATILE,' + str(ind+1) + ', ' + str(data[ind])
-            self.set_cmd(data_str)
-            time.sleep(2/self.sps)
+        self._check_armed()
+        t_upload = self.clock.now_ns()
+        # Kept until the upload is complete, recover uploads it again
+        self._arb[chn] = {'data': data, 'complete': False}
+        write = self.encoder.encode('arb', chn, self.sps)
+        self._remember(chn, 'arb', write)
+        self._io('state', self.protocol.write_raw, write)
+        # Waiting on the abort event ends the upload on emergency stop
+        if self.clock.wait(self._abort, 0.1):
+            return data[:0]
+        n_sent = self._upload_arb(chn)
+        if n_sent < n_data:
+            return data[:n_sent]
+        if self.events is not None:
+            # The event spans the whole upload, its value is the data length
+            self.events.publish(ARB_DONE, chn, t_upload, self.clock.now_ns(),
+                                float(n_data),
+                                f':SOUR{chn}:DATA:POIN {n_data}')
+        if self.verify_uploads:
+            try:
+                self.verify_arb(chn=chn)
+            except Exception as e:
+                print(f'CH{chn}: verification of the arbitrary data '
+                      f'failed: {e}')
 
         return data
 
+    def _upload_arb(self, chn):
+        # Send the points of the arb data of a channel one by one, returns
+        # the number of points sent
+        arb = self._arb[chn]
+        data = arb['data']
+        n_recovery = len(self.recoveries)
+        self._io('state', self.protocol.write_raw,
+                 self.encoder.encode('arb_points', chn, len(data)))
+        if self.clock.wait(self._abort, 0.1):
+            return 0
+        value_fmt = self.encoder.compile('arb_value', chn)
+        for ind, val in enumerate(data.tolist()):
+            self._io('state', self.protocol.write_raw,
+                     value_fmt % (ind + 1, val))
+            if len(self.recoveries) != n_recovery:
+                # The recovery has uploaded all points again
+                return len(data)
+            if self.clock.wait(self._abort, 2/self.sps):
+                print('Upload of arbitrary data aborted')
+                return ind + 1
+        arb['complete'] = True
+        return len(data)
+
     def fade(self, amp=0.5, fade_dur=5, chn=1, step_per_sec=2, fademode='in'):
         """ Control the fade in/out of the current signal
 
@@ -557,8 +1726,8 @@ class SignalGenerator():
             The frequency of updating amplitude in one second.
             A larger number indicates a more frequent update and vice versa.
         fademode : 'in' | 'out' (default 'in')
-            'fadein' indicates the amplitude of signal increases
-            'fadeout' indicates the amplitude of signal decreases
+            'in' indicates the amplitude of signal increases
+            'out' indicates the amplitude of signal decreases
 
         """
 
@@ -566,13 +1735,18 @@ class SignalGenerator():
         # 0.002V is the minimum input voltage of the authors' hardware setup
         # step list is the list of amplitudes to update
         step_list = np.linspace(0.002, amp, int(fade_dur*step_per_sec))
-        if fademode == 'fadein':
-            self.amp(0.002, chn=chn)
-            for stim_val in step_list:
-                time.sleep(sleep_dur)
-                self.amp(val=stim_val, chn=chn)
-        elif fademode == 'out':
-            for stim_val in step_list[::-1]:
-                self.amp(val=stim_val, chn=chn)
-                time.sleep(sleep_dur)
-            print('off output')
+        self._check_armed()
+        with self.event_kind(FADE_STEP):
+            # Waiting on the abort event ends the fade on emergency stop
+            if fademode in ['in', 'fadein']:
+                self.amp(0.002, chn=chn)
+                for stim_val in step_list:
+                    if self.clock.wait(self._abort, sleep_dur):
+                        return
+                    self.amp(value=stim_val, chn=chn)
+            elif fademode in ['out', 'fadeout']:
+                for stim_val in step_list[::-1]:
+                    self.amp(value=stim_val, chn=chn)
+                    if self.clock.wait(self._abort, sleep_dur):
+                        return
+                print('off output')
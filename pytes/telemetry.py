@@ -0,0 +1,333 @@
+"""
+Read-back telemetry of a signal generator.
+
+A TelemetryPoller queries the output state, amplitude, frequency and offset
+of every channel and the error queue (SYST:ERR?) of the instrument at a
+fixed rate. All queries of a poll are sent in one message and answered in
+one round-trip; instruments answering only one query per message are
+detected and polled query by query. The poller yields to the commands of
+the experiment: a poll is skipped while a command is in progress or was
+sent less than `quiet` seconds ago, so a command waits at most for the
+round-trip of a poll which had already started.
+
+The read-back values are stored in a fixed-size TelemetrySeries together
+with the commanded values (SignalGenerator.commanded) and the mismatches
+between both.
+"""
+
+import collections
+import re
+import threading
+
+import numpy as np
+
+
+FIELDS = ['output', 'amp', 'frequency', 'offset']
+
+# Keys of the comma-separated answers of Siglent, e.g., 'C1:BSWV WVTP,SINE,
+# FRQ,10HZ,AMP,1V,OFST,0V,PHSE,0'
+_KEYWORDS = {'amp': 'AMP', 'offset': 'OFST', 'frequency': 'FRQ',
+             'phase': 'PHSE'}
+
+
+def parse_reply(field, reply):
+    """Value of a field from the answer to its query, NaN if unreadable
+
+    Parameters
+    ----------
+    field : 'output' | 'amp' | 'frequency' | 'offset' | 'phase'
+    reply : str | bytes
+
+    """
+    if isinstance(reply, bytes):
+        reply = reply.decode('utf8', errors='replace')
+    text = reply.strip().strip('"').upper()
+    if field == 'output':
+        match = re.search(r'\b(ON|OFF|1|0)\b', text)
+        return np.nan if match is None else float(match.group(1) in
+                                                  ['ON', '1'])
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    match = re.search(_KEYWORDS.get(field, field.upper()) +
+                      r',([-+0-9.E]+)', text)
+    return float(match.group(1)) if match else np.nan
+
+
+class TelemetrySeries():
+    """Fixed-size time series of read-back and commanded values
+
+    The arrays are allocated once, the oldest samples are overwritten when
+    the series is full.
+
+    Parameters
+    ----------
+    capacity : int
+        Maximum number of samples
+    chns : list of int
+        Channels of the samples
+    fields : list of str
+        Fields of the samples, see FIELDS
+
+    Attributes
+    ----------
+    t : 1-D array, shape (capacity,)
+        Time of the samples
+    values, commanded : 3-D array, shape (capacity, n_chn, n_field)
+        Read-back and commanded values, NaN if unknown
+    mismatch : 3-D bool array, shape (capacity, n_chn, n_field)
+        True where the read-back differs from the commanded value
+
+    """
+    def __init__(self, capacity, chns, fields=FIELDS):
+        self.capacity = capacity
+        self.chns = list(chns)
+        self.fields = list(fields)
+        shape = (capacity, len(self.chns), len(self.fields))
+        self.t = np.full(capacity, np.nan)
+        self.values = np.full(shape, np.nan)
+        self.commanded = np.full(shape, np.nan)
+        self.mismatch = np.zeros(shape, dtype=bool)
+        self.n_sample = 0
+
+    def __len__(self):
+        return min(self.n_sample, self.capacity)
+
+    def append(self, t, values, commanded, mismatch):
+        ind = self.n_sample % self.capacity
+        self.t[ind] = t
+        self.values[ind] = values
+        self.commanded[ind] = commanded
+        self.mismatch[ind] = mismatch
+        self.n_sample += 1
+
+    def _order(self):
+        # Indices of the stored samples from the oldest to the latest
+        if self.n_sample <= self.capacity:
+            return np.arange(self.n_sample)
+        return np.roll(np.arange(self.capacity),
+                       -(self.n_sample % self.capacity))
+
+    def data(self):
+        """Copy of the stored samples in chronological order
+
+        Returns
+        -------
+        data : dict
+            't', 'values', 'commanded' and 'mismatch', see Attributes
+
+        """
+        order = self._order()
+        return {'t': self.t[order], 'values': self.values[order],
+                'commanded': self.commanded[order],
+                'mismatch': self.mismatch[order]}
+
+    def field(self, name, chn):
+        # Read-back time series of one field of one channel
+        order = self._order()
+        return (self.t[order], self.values[order, self.chns.index(chn),
+                                           self.fields.index(name)])
+
+
+class TelemetryPoller():
+    """Background thread polling the read-back of a SignalGenerator
+
+    Parameters
+    ----------
+    sig_gen : SignalGenerator
+        Connected signal generator
+    rate : float (default 2.0)
+        Polls per second
+    capacity : int (default 3600)
+        Number of samples kept in the series
+    fields : list of str (default FIELDS)
+        Fields polled on every channel
+    chns : list of int | None (default None)
+        Polled channels, if None all channels of the dialect
+    quiet : float (default 0.05)
+        A poll is deferred until no command was sent for quiet seconds
+    timeout : float (default 0.5)
+        Timeout of a poll in seconds
+    rtol, atol : float (default 1e-3, 1e-3)
+        A read-back value differs from the commanded value if the absolute
+        difference exceeds atol + rtol * abs(commanded)
+    on_mismatch : callable | None (default None)
+        Called with (t, chn, field, commanded, read) for every mismatch
+
+    Attributes
+    ----------
+    series : TelemetrySeries
+    errors : deque of tuple
+        (t, answer) of the errors read from the error queue
+    stats : dict
+        Number of 'polls', 'yielded' (deferred) and 'failed' polls and of
+        'round_trips'
+
+    """
+    def __init__(self, sig_gen, rate=2.0, capacity=3600, fields=FIELDS,
+                 chns=None, quiet=0.05, timeout=0.5, rtol=1e-3, atol=1e-3,
+                 on_mismatch=None):
+        self.sig_gen = sig_gen
+        self.interval = 1 / rate
+        self.quiet = quiet
+        self.timeout = timeout
+        self.rtol, self.atol = rtol, atol
+        self.on_mismatch = on_mismatch
+        encoder = sig_gen.encoder
+        chns = encoder.dialect.channels if chns is None else chns
+        self.series = TelemetrySeries(capacity, chns, fields)
+        self.errors = collections.deque(maxlen=capacity)
+        self.stats = {'polls': 0, 'yielded': 0, 'failed': 0,
+                      'round_trips': 0}
+
+        # Index of the distinct query of every field, e.g., Siglent answers
+        # all parameters of a channel at once
+        queries, self._index = {}, {}
+        for chn in self.series.chns:
+            for field in self.series.fields:
+                text = encoder.text(field + '?', chn)
+                self._index[chn, field] = queries.setdefault(text,
+                                                             len(queries))
+        self._queries = list(queries) + [encoder.text('error?', 1)]
+        self._message = encoder.dialect.separator.join(self._queries)
+        self.pipeline = True
+        # Set after a timeout, a late answer is read before the next poll
+        self._stale = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='pytes-telemetry')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+
+    def _run(self):
+        wait = self.interval
+        while not self._stop.wait(wait):
+            n_yielded = self.stats['yielded']
+            self.poll()
+            # A deferred poll is repeated as soon as the commands pause
+            wait = min(self.quiet, self.interval) \
+                if self.stats['yielded'] > n_yielded else self.interval
+
+    def poll(self):
+        """Query the instrument once unless a command is in progress
+
+        Returns
+        -------
+        sample : dict | None
+            't', 'values', 'commanded' and 'mismatch' of the sample, None
+            if the poll yielded to a command or failed
+
+        """
+        sig_gen = self.sig_gen
+        lock = sig_gen._io_lock
+        if sig_gen.clock.now() - sig_gen._t_io < self.quiet or \
+                not lock.acquire(blocking=False):
+            self.stats['yielded'] += 1
+            return None
+        try:
+            # The commanded values of all commands sent before the poll
+            commanded = np.array([[sig_gen.commanded.get(chn, {}).get(
+                field, np.nan) for field in self.series.fields]
+                for chn in self.series.chns])
+            t = sig_gen.clock.now()
+            try:
+                replies = self._query()
+            except Exception as e:
+                print(f'Telemetry poll failed: {e}')
+                self._stale = True
+                self.stats['failed'] += 1
+                return None
+        finally:
+            lock.release()
+        self.stats['polls'] += 1
+
+        values = np.array([[parse_reply(field, replies[self._index[
+            chn, field]]) for field in self.series.fields]
+            for chn in self.series.chns])
+        error = replies[-1].strip()
+        if error and not re.match(r'[+]?0\b', error):
+            self.errors.append((t, error))
+        # NaN, i.e., unknown, compares as equal
+        mismatch = np.abs(values - commanded) > \
+            self.atol + self.rtol * np.abs(commanded)
+        self.series.append(t, values, commanded, mismatch)
+        if self.on_mismatch is not None:
+            for i, j in zip(*np.nonzero(mismatch)):
+                self.on_mismatch(t, self.series.chns[i],
+                                 self.series.fields[j], commanded[i, j],
+                                 values[i, j])
+        return {'t': t, 'values': values, 'commanded': commanded,
+                'mismatch': mismatch}
+
+    def _query(self):
+        # Answers of all queries, with the I/O lock held
+        protocol = self.sig_gen.protocol
+        if self._stale:
+            self._drain()
+        if self.pipeline:
+            self.stats['round_trips'] += 1
+            replies = self._split(protocol.query_cmd(
+                self._message, length=4096, timeout=self.timeout))
+            if len(replies) == len(self._queries):
+                return replies
+            # Only one query per message is answered
+            print('Telemetry: pipelined queries are not supported by the '
+                  'instrument, polling query by query')
+            self.pipeline = False
+            self._drain()
+        replies = []
+        for query in self._queries:
+            self.stats['round_trips'] += 1
+            replies.append(self._split(protocol.query_cmd(
+                query, length=1024, timeout=self.timeout))[0])
+        return replies
+
+    def _drain(self):
+        # Discard late answers of earlier polls
+        for _ in range(10):
+            try:
+                if not self.sig_gen.protocol.read_cmd(length=4096,
+                                                      timeout=0.0):
+                    break
+            except Exception:
+                break
+        self._stale = False
+
+    @staticmethod
+    def _split(reply):
+        if isinstance(reply, bytes):
+            reply = reply.decode('utf8', errors='replace')
+        return re.split(r'[;\n]', str(reply).strip())
+
+    def mismatches(self):
+        """All mismatches stored in the series
+
+        Returns
+        -------
+        mismatches : list of tuple
+            (t, chn, field, commanded, read), in chronological order
+
+        """
+        data = self.series.data()
+        return [(data['t'][i], self.series.chns[j], self.series.fields[k],
+                 data['commanded'][i, j, k], data['values'][i, j, k])
+                for i, j, k in zip(*np.nonzero(data['mismatch']))]
+
+    def report(self):
+        # Counts of polls and mismatches and the latest errors
+        data = self.series.data()
+        return dict(self.stats, samples=len(self.series),
+                    mismatch_samples=int(data['mismatch'].any(
+                        axis=(1, 2)).sum()),
+                    errors=list(self.errors)[-5:],
+                    pipeline=self.pipeline)
@@ -0,0 +1,290 @@
+"""
+Timeline execution of stimulation sessions.
+
+A session (e.g. fade in -> hold -> fade out -> off) is described as a
+Timeline, i.e., an ordered list of steps with offsets relative to the session
+start. The TimelineExecutor runs each timeline in its own worker thread so
+that both channels can run independently or synchronized (shared start time),
+can be aborted immediately, and never block the Tk main loop. Progress is
+reported through a thread-safe queue which the GUI drains via `after`.
+All times are taken from a pluggable clock, see pytes.clock.
+
+If a tolerance is given, a step starting later than its offset plus the
+tolerance, e.g., because the previous step blocked beyond its slot, is not
+executed. The session is aborted with an OverrunError instead.
+"""
+
+import queue
+import threading
+
+from pytes import estop
+from pytes.clock import REAL_CLOCK
+
+
+class OverrunError(RuntimeError):
+    # Raised when a step cannot start within the tolerance of its offset
+    pass
+
+
+class Step():
+    """A single action of a timeline
+
+    Parameters
+    ----------
+    t : float
+        Offset in seconds relative to the start of the session
+    func : callable
+        Function to call once the offset is reached
+    args : tuple (default ())
+        Positional arguments passed to func
+    kwargs : dict | None (default None)
+        Keyword arguments passed to func
+    label : str (default '')
+        Short description of the step, e.g., 'on', 'fade', 'off'
+
+    """
+    def __init__(self, t, func, args=(), kwargs=None, label=''):
+        self.t = float(t)
+        self.func = func
+        self.args = args
+        self.kwargs = {} if kwargs is None else kwargs
+        self.label = label
+
+    def __repr__(self):
+        return f'Step(t={self.t:.3f}, label={self.label!r})'
+
+
+class Timeline():
+    """Ordered collection of steps of one stimulation session
+
+    Parameters
+    ----------
+    on_abort : list of Step | None (default None)
+        Steps executed right away (ignoring their offsets) when the session
+        is aborted, e.g., switching off the output
+
+    """
+    def __init__(self, on_abort=None):
+        self.steps = []
+        self.on_abort = [] if on_abort is None else on_abort
+
+    def add(self, t, func, args=(), kwargs=None, label=''):
+        self.steps.append(Step(t, func, args=args, kwargs=kwargs,
+                               label=label))
+        return self
+
+    def sorted_steps(self):
+        # Stable sort keeps the insertion order of simultaneous steps
+        return sorted(self.steps, key=lambda step: step.t)
+
+    @property
+    def duration(self):
+        if not self.steps:
+            return 0.0
+        return max(step.t for step in self.steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+
+class Session():
+    """Running instance of a timeline, created by TimelineExecutor.start
+
+    Attributes
+    ----------
+    key : hashable
+        Identifier of the session, e.g., the output channel
+    t_start : float
+        Monotonic time at which the session (offset 0) starts
+    t_end : float
+        Monotonic time at which the last step is planned
+    records : list of tuple
+        (label, planned time, actual start time, finish time) of every
+        executed step, all in monotonic seconds
+    aborted : bool
+        True if the session was aborted before its last step
+    error : Exception | None
+        Error of the step which aborted the session, e.g., an OverrunError
+
+    """
+    def __init__(self, key, timeline, t_start, bridge, spin=0.0,
+                 clock=REAL_CLOCK, tolerance=None):
+        self.key = key
+        self.timeline = timeline
+        self.t_start = t_start
+        self.t_end = t_start + timeline.duration
+        self.bridge = bridge
+        self.records = []
+        self.aborted = False
+        self.error = None
+        self.clock = clock
+        # Busy-waiting would never end in virtual time
+        self.spin = 0.0 if clock.virtual else spin
+        self.tolerance = tolerance
+        self._t_created = clock.now()
+        self._abort_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f'pytes-session-{key}')
+
+    def remaining(self, now=None):
+        # Residual duration of the session in seconds
+        if now is None:
+            now = self.clock.now()
+        return max(0.0, self.t_end - now)
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def abort(self):
+        self._abort_event.set()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _post(self, *msg):
+        if self.bridge is not None:
+            self.bridge.put((self.key,) + msg)
+
+    def _fail(self, step, error):
+        # A failing or late step must not leave the output running
+        self.error = error
+        self._abort_event.set()
+        self._post('error', step.label, error)
+
+    def _call(self, step):
+        try:
+            step.func(*step.args, **step.kwargs)
+        except Exception as e:
+            self._fail(step, e)
+
+    def _run(self):
+        self.clock.attach(self._t_created)
+        self._post('start', self.t_start, self.t_end)
+        for step in self.timeline.sorted_steps():
+            t_plan = self.t_start + step.t
+            # Waiting on the event instead of sleeping makes abort immediate,
+            # the last `spin` seconds are busy-waited for a precise onset
+            while not self._abort_event.is_set():
+                delay = t_plan - self.clock.now()
+                if delay <= 0:
+                    break
+                if delay > self.spin:
+                    self.clock.wait_until(self._abort_event,
+                                          t_plan - self.spin)
+            if self._abort_event.is_set():
+                break
+            t_actual = self.clock.now()
+            if self.tolerance is not None and \
+                    t_actual - t_plan > self.tolerance:
+                self._fail(step, OverrunError(
+                    f'Step {step.label!r} of session {self.key} started '
+                    f'{t_actual - t_plan:.3f} s after its offset '
+                    f'{step.t:.3f} s, the tolerance is {self.tolerance} s'))
+                break
+            self._call(step)
+            self.records.append((step.label, t_plan, t_actual,
+                                 self.clock.now()))
+            self._post('step', step.label, t_plan, t_actual)
+
+        if self._abort_event.is_set():
+            self.aborted = True
+            for step in self.timeline.on_abort:
+                try:
+                    step.func(*step.args, **step.kwargs)
+                except Exception as e:
+                    self._post('error', step.label, e)
+                self._post('step', step.label, None, self.clock.now())
+        self._post('done', self.aborted)
+
+
+class TimelineExecutor():
+    """Run timelines in worker threads, at most one session per key
+
+    Parameters
+    ----------
+    bridge : queue.Queue | None (default None)
+        Thread-safe queue receiving progress messages in the form of
+        (key, kind, ...), where kind is 'start', 'step', 'error' or 'done'.
+        If None, a new queue is created.
+    clock : RealClock | VirtualClock (default REAL_CLOCK)
+        Clock of all sessions, see pytes.clock
+
+    """
+    def __init__(self, bridge=None, clock=REAL_CLOCK):
+        self.bridge = queue.Queue() if bridge is None else bridge
+        self.clock = clock
+        self.sessions = {}
+        estop.register_abortable(self)
+
+    def start(self, key, timeline, t_start=None, delay=0.0, spin=0.0,
+              tolerance=None):
+        """Start a timeline in a new worker thread
+
+        Parameters
+        ----------
+        key : hashable
+            Identifier of the session, e.g., output channel 1 or 2
+        timeline : Timeline
+            Steps to execute
+        t_start : float | None (default None)
+            Monotonic start time. Passing the same value to several sessions
+            synchronizes them. If None, the session starts after delay.
+        delay : float (default 0.0)
+            Delay in seconds before the session starts, if t_start is None
+        spin : float (default 0.0)
+            Duration in seconds before each step which is busy-waited
+            instead of slept, trading CPU time for timing precision
+        tolerance : float | None (default None)
+            Maximum delay in seconds of the start of a step. A later step
+            aborts the session with an OverrunError. If None, steps are
+            executed however late they are.
+
+        Returns
+        -------
+        session : Session
+
+        """
+        if self.running(key):
+            raise RuntimeError(f'Session {key} is still running')
+        if t_start is None:
+            t_start = self.clock.now() + delay
+        session = Session(key, timeline, t_start, self.bridge, spin=spin,
+                          clock=self.clock, tolerance=tolerance)
+        self.sessions[key] = session
+        session._thread.start()
+        return session
+
+    def start_sync(self, timelines, delay=0.05, spin=0.0, tolerance=None):
+        # Start several timelines, given as {key: timeline}, at the same time
+        t_start = self.clock.now() + delay
+        return {key: self.start(key, timeline, t_start=t_start, spin=spin,
+                                tolerance=tolerance)
+                for key, timeline in timelines.items()}
+
+    def running(self, key):
+        session = self.sessions.get(key)
+        return session is not None and session.is_alive()
+
+    def abort(self, key=None):
+        # Abort the session of given key, or all sessions if key is None
+        keys = list(self.sessions) if key is None else [key]
+        for tmp_key in keys:
+            if tmp_key in self.sessions:
+                self.sessions[tmp_key].abort()
+
+    def emergency_stop(self):
+        # Abort all sessions, their output-off steps run in the workers
+        self.abort()
+
+    def join(self, timeout=None):
+        for session in list(self.sessions.values()):
+            session.join(timeout)
+
+    def poll(self):
+        # Drain all pending progress messages without blocking
+        msgs = []
+        while True:
+            try:
+                msgs.append(self.bridge.get_nowait())
+            except queue.Empty:
+                return msgs
@@ -0,0 +1,187 @@
+"""
+Read-back verification of uploaded arbitrary waveforms.
+
+After arb_func, the waveform memory of a channel is compared with the DAC
+codes which were sent (SignalGenerator._arb). Two methods are available:
+    block : The whole memory is read with one binary block query
+            ('arb_block?' of the dialect, IEEE 488.2 definite length block
+            of little-endian 16-bit codes).
+    sampled : A subset of the points is read with 'arb_value?' queries,
+              which are sent in pipelined batches of one message each.
+              The points are evenly spaced with a random phase, such that
+              repeated verifications cover different points, and always
+              include the first and the last point.
+
+The number of points held by the instrument ('arb_points?') is checked as
+well. With the default of 32 sampled points, a verification takes one
+round-trip and is cheap enough to run before every session.
+"""
+
+import re
+import zlib
+
+import numpy as np
+
+
+# Layout of the DAC codes in a binary block answer
+BLOCK_DTYPE = '<u2'
+
+
+def sample_indices(n_points, n_samples, rng=None):
+    """Evenly spaced indices with a random phase
+
+    Parameters
+    ----------
+    n_points : int
+        Number of points of the waveform
+    n_samples : int
+        Number of sampled points, all points if n_samples >= n_points
+    rng : numpy.random.Generator | None (default None)
+
+    Returns
+    -------
+    indices : 1-D array of int
+        Sorted 0-based indices including 0 and n_points - 1
+
+    """
+    if n_samples >= n_points:
+        return np.arange(n_points)
+    rng = np.random.default_rng() if rng is None else rng
+    step = n_points / n_samples
+    indices = (np.arange(n_samples) * step + rng.uniform(0, step)).astype(int)
+    return np.unique(np.concatenate([[0, n_points - 1], indices]))
+
+
+def checksum(codes):
+    # CRC-32 of the codes in the layout of BLOCK_DTYPE
+    return zlib.crc32(np.asarray(codes).astype(BLOCK_DTYPE).tobytes())
+
+
+def _split(reply):
+    if isinstance(reply, bytes):
+        reply = reply.decode('utf8', errors='replace')
+    return [i for i in re.split(r'[;\n]', str(reply).strip()) if i != '']
+
+
+def _codes(replies):
+    # Integer codes of the answers, -1 if unreadable
+    codes = np.full(len(replies), -1, dtype=np.int64)
+    for ind, reply in enumerate(replies):
+        try:
+            codes[ind] = int(float(reply.strip().strip('"')))
+        except ValueError:
+            pass
+    return codes
+
+
+def _read_sampled(sig_gen, chn, indices, batch, timeout, report):
+    # Codes of the points at the indices, batch queries per message
+    encoder, protocol = sig_gen.encoder, sig_gen.protocol
+    codes = np.empty(len(indices), dtype=np.int64)
+    for start in range(0, len(indices), batch):
+        queries = [encoder.text('arb_value?', chn, ind + 1)
+                   for ind in indices[start:start+batch]]
+        replies = []
+        if report['pipeline']:
+            report['round_trips'] += 1
+            replies = _split(sig_gen._io(
+                'query', protocol.query_cmd,
+                encoder.dialect.separator.join(queries),
+                length=16 * len(queries) + 64, timeout=timeout))
+            if len(replies) != len(queries):
+                # Only one query per message is answered, the rest of the
+                # batch is read query by query
+                report['pipeline'] = False
+                replies = replies[:1]
+        for query in queries[len(replies):]:
+            report['round_trips'] += 1
+            replies += _split(sig_gen._io('query', protocol.query_cmd, query,
+                                          length=64, timeout=timeout))[:1]
+        codes[start:start+len(queries)] = _codes(replies)
+    return codes
+
+
+def verify_arb(sig_gen, chn, method='auto', n_samples=32, batch=64,
+               timeout=1.0, seed=None):
+    """Compare the waveform memory of a channel with the uploaded data
+
+    Parameters
+    ----------
+    sig_gen : SignalGenerator
+        Signal generator which uploaded the data with arb_func
+    chn : 1 | 2
+        Output channel
+    method : 'auto' | 'block' | 'sampled' (default 'auto')
+        Read-back method, see module docstring. 'auto' uses 'block' if the
+        dialect supports it, 'sampled' otherwise.
+    n_samples : int (default 32)
+        Number of points read by the 'sampled' method
+    batch : int (default 64)
+        Maximum number of queries sent in one message
+    timeout : float (default 1.0)
+        Timeout of every answer in seconds
+    seed : int | None (default None)
+        Seed of the phase of the sampled points
+
+    Returns
+    -------
+    report : dict
+        'match' is True if the number of points and all checked codes are
+        equal. 'mismatches' holds the 0-based indices of the differing
+        points, 'expected' and 'read' their codes. 'checksum' and
+        'checksum_read' are the CRC-32 of the checked points, 'duration'
+        the time of the verification in seconds.
+
+    """
+    encoder = sig_gen.encoder
+    if chn not in sig_gen._arb:
+        raise ValueError(f'No arbitrary data was uploaded to CH{chn}')
+    if method == 'auto':
+        method = 'block' if encoder.supports('arb_block?') else 'sampled'
+    key = {'block': 'arb_block?', 'sampled': 'arb_value?'}.get(method)
+    if key is None:
+        raise ValueError(f'Unsupported method {method}')
+    if not encoder.supports(key):
+        raise NotImplementedError(f'Read-back of the arbitrary data is not '
+                                  f'supported by {encoder.dialect.name}')
+
+    expected = np.asarray(sig_gen._arb[chn]['data'], dtype=np.int64)
+    report = {'chn': chn, 'method': method, 'n_points': len(expected),
+              'points_read': None, 'round_trips': 0, 'pipeline': True}
+    t_start = sig_gen.clock.now()
+    if encoder.supports('arb_points?'):
+        report['round_trips'] += 1
+        try:
+            report['points_read'] = int(float(_split(sig_gen._io(
+                'query', sig_gen.protocol.query_cmd,
+                encoder.text('arb_points?', chn), length=64,
+                timeout=timeout))[0]))
+        except (ValueError, IndexError):
+            pass
+
+    if method == 'block':
+        report['round_trips'] += 1
+        payload = sig_gen._io('query', sig_gen.protocol.query_block,
+                              encoder.text('arb_block?', chn),
+                              timeout=timeout)
+        read = np.frombuffer(payload, dtype=BLOCK_DTYPE).astype(np.int64)
+        indices = np.arange(len(expected))
+        # Missing points read as -1, surplus points are not compared
+        read = np.concatenate([read[:len(expected)], np.full(
+            max(0, len(expected) - len(read)), -1, dtype=np.int64)])
+    else:
+        indices = sample_indices(len(expected), n_samples,
+                                 np.random.default_rng(seed))
+        read = _read_sampled(sig_gen, chn, indices, batch, timeout, report)
+
+    differ = read != expected[indices]
+    report.update(
+        n_checked=len(indices),
+        mismatches=indices[differ], expected=expected[indices[differ]],
+        read=read[differ],
+        checksum=checksum(expected[indices]),
+        checksum_read=checksum(np.clip(read, 0, None)),
+        duration=sig_gen.clock.now() - t_start)
+    report['match'] = bool(not differ.any() and report['points_read'] in
+                           [None, len(expected)])
+    return report
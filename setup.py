@@ -25,8 +25,14 @@ setup(
     package_dir={'pytes': 'pytes'},
     package_data={'pytes': ['example_data/*.pkl','Figures/*.png','Figures/*.jpeg']},
     classifiers=[
-        "Programming Language :: Python :: 3.7",
+        "Programming Language :: Python :: 3.8",
         "License :: 3-clause BSD",
     ],
     license="3-clause BSD",
+    # multiprocessing.shared_memory, see pytes.isolated
+    python_requires=">=3.8",
+    entry_points={
+        'console_scripts': ['pytes=pytes.cli:main',
+                            'pytes-gui=pytes.pytes_gui:main'],
+    },
 )
@@ -0,0 +1,74 @@
+import pytest
+
+from pytes.capabilities import (DEFAULT_CAPABILITIES, capabilities_from_idn,
+                                validate_schedule)
+from pytes.clock import VirtualClock
+from pytes.protocol import (ProtocolError, ProtocolRunner, check_schedule,
+                            compile_protocol, dry_run)
+from pytes.signal_generator import SignalGenerator
+
+
+def tacs(freq=10, to=1, offset=0):
+    return {'channels': {1: [
+        {'block': 'config', 'mode': 'tACS', 'amp': 1, 'freq': freq,
+         'phase': 0, 'offset': offset},
+        {'block': 'on'},
+        {'block': 'ramp', 'to': to, 'duration': 2},
+        {'block': 'off'}]}}
+
+
+def test_valid_schedule_passes():
+    schedule = compile_protocol(tacs(to=2))
+    assert validate_schedule(schedule) == []
+    check_schedule(schedule)
+
+
+def test_violations_are_located():
+    schedule = compile_protocol(tacs(freq=30e6, to=25))
+    violations = validate_schedule(schedule, DEFAULT_CAPABILITIES)
+    assert [(i['t'], i['param']) for i in violations] == [
+        (0.0, 'frequency'), (2.0, 'amp'), (2.0, 'peak')]
+    for i in violations:
+        assert schedule[i['index']].t == i['t']
+    # 19 Vpp at 1.5 s is within both limits
+    assert all(i['value'] != 19 for i in violations)
+
+
+def test_limits_depend_on_the_model():
+    schedule = compile_protocol(tacs(freq=30e6))
+    rigol = capabilities_from_idn('Rigol Technologies,DG1062Z,DG1ZA0,00.01')
+    assert rigol.name == 'Rigol DG1062Z'
+    assert validate_schedule(schedule, rigol) == []
+    assert capabilities_from_idn('Unknown,XY1,0,0') is DEFAULT_CAPABILITIES
+
+
+def test_offset_counts_towards_the_peak_voltage():
+    violations = validate_schedule(compile_protocol(tacs(offset=9.8)))
+    assert {i['param'] for i in violations} == {'peak'}
+
+
+def test_arb_samples_out_of_range():
+    schedule = compile_protocol({'channels': {1: [
+        {'block': 'config', 'mode': 'arb', 'data': [0, 1, 3, -3],
+         'sps': 100},
+        {'block': 'on'}, {'block': 'hold', 'duration': 1},
+        {'block': 'off'}]}})
+    violations = validate_schedule(schedule)
+    assert len(violations) == 1
+    assert list(violations[0]['samples']) == [2, 3]
+    keysight = capabilities_from_idn('Keysight,33522B,MY0,1')
+    assert 'not supported' in validate_schedule(
+        schedule, keysight)[0]['message']
+
+
+def test_runner_refuses_before_any_command():
+    clock = VirtualClock()
+    sig_gen = SignalGenerator(protocol='MOCK', clock=clock)
+    n_init = len(sig_gen.protocol.log)
+    runner = ProtocolRunner(sig_gen, spin=0.0, clock=clock)
+    with pytest.raises(ProtocolError, match='3 violations'):
+        runner.run(compile_protocol(tacs(freq=30e6, to=25)), delay=0.0)
+    assert len(sig_gen.protocol.log) == n_init
+    assert runner.records == []
+    with pytest.raises(ProtocolError, match='maximum frequency'):
+        dry_run(tacs(freq=30e6))
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from pytes.clock import VirtualClock
+from pytes.closed_loop import (ARPhaseEstimator, EcHTEstimator,
+                               PhaseLockedController, replay)
+from pytes.signal_generator import SignalGenerator
+
+
+FS = 1000
+FREQ = 10.3
+
+
+def _controller(estimator, **kwargs):
+    clock = VirtualClock()
+    sig_gen = SignalGenerator(protocol='MOCK', clock=clock)
+    sig_gen.protocol.latency = 0.004
+    return PhaseLockedController(sig_gen, FS, estimator=estimator,
+                                 freq=FREQ, deadband=0, clock=clock,
+                                 **kwargs)
+
+
+def _wrapped(values, ref):
+    return (np.asarray(values) - ref + 180) % 360 - 180
+
+
+@pytest.mark.parametrize('estimator', [
+    ARPhaseEstimator(FS, band=(8, 12)), EcHTEstimator(FS, freq=FREQ)])
+def test_phase_offset_constant_on_stationary_sine(estimator):
+    controller = _controller(estimator)
+    controller.start()
+    t = np.arange(10 * FS) / FS
+    history = replay(controller, np.sin(2 * np.pi * FREQ * t), chunk=10)
+    values = history[:, 3][~np.isnan(history[:, 3])]
+    assert len(values) > 50
+    # The generator phase advances with the stimulation frequency, the
+    # commanded offset must not
+    deviation = _wrapped(values[5:], values[5])
+    assert np.ptp(deviation) < 10
+
+
+def test_target_phase_shifts_offset():
+    t = np.arange(5 * FS) / FS
+    signal = np.sin(2 * np.pi * FREQ * t)
+    offsets = []
+    for target in [0, 90]:
+        controller = _controller(EcHTEstimator(FS, freq=FREQ),
+                                 target_phase=target)
+        controller.set_reference(0.0)
+        history = replay(controller, signal, chunk=10)
+        offsets.append(history[~np.isnan(history[:, 3]), 3][-1])
+    assert abs(_wrapped(offsets[1], offsets[0] + 90)) < 1
+
+
+def test_history_is_bounded():
+    controller = _controller(EcHTEstimator(FS, freq=FREQ), history_len=50)
+    t = np.arange(2 * FS) / FS
+    history = replay(controller, np.sin(2 * np.pi * FREQ * t), chunk=5)
+    assert len(controller.history) == 50
+    assert len(history) > 50
@@ -0,0 +1,106 @@
+import os
+import select
+import sys
+import time
+
+import pytest
+
+from pytes.emulator import FakeInstrument
+
+
+linux = pytest.mark.skipif(not sys.platform.startswith('linux'),
+                           reason='The emulator requires Linux')
+
+
+def test_pipelined_commands_and_queries():
+    instrument = FakeInstrument()
+    assert instrument.handle(
+        ':OUTPut1 ON;:SOUR1:VOLT 1.5;:OUTPut1?;:SOUR1:VOLT?') == ['ON', '1.5']
+    # Long forms and newline separated commands
+    assert instrument.handle(
+        ':SOURce2:VOLTage:OFFSet 0.3\n:SOUR2:VOLT:OFFS?') == ['0.3']
+    # Commands written without terminator are split at the rooted headers
+    assert instrument.handle(':OUTPut2 ON:SOUR2:FREQ 40*OPC?') == ['1']
+    assert instrument.channels[2].output
+    assert instrument.channels[2].freq == 40
+
+
+def test_error_queue():
+    instrument = FakeInstrument()
+    assert instrument.handle(
+        ':SOUR1:FOO 1;:SOUR1:DATA:VAL VOLATILE,1,20000;:SYST:ERR?;'
+        ':SYST:ERR?;:SYST:ERR?') == ['-113,"Undefined header"',
+                                     '-224,"Illegal parameter value"',
+                                     '0,"No error"']
+    instrument.handle('*FOO')
+    instrument.handle('*CLS')
+    assert instrument.errors == []
+
+
+def test_waveform_and_engine_settings():
+    instrument = FakeInstrument()
+    assert instrument.handle(
+        ':SOUR1:APPL:SIN 10,2,0.5,90;:SOUR1:APPL?;'
+        ':SOUR1:DATA:POIN VOLATILE,4;:SOUR1:DATA:VAL VOLATILE,2,100;'
+        ':SOUR1:DATA:VAL? VOLATILE,2;:SOUR1:DATA:VAL? VOLATILE,3;'
+        ':SOUR1:DATA:POIN?') == ['"SIN,10,2,0.5,90"', '100', '8192', '4']
+    assert instrument.handle(
+        ':SOUR1:SWE:STAT ON;:SOUR1:SWE:STAT?') == ['ON']
+    assert instrument.handle('*RST;:SOUR1:VOLT?;:SOUR1:SWE:STAT?') == \
+        ['5', '0']
+
+
+def _exchange(path, message, timeout=1.0):
+    # Write one message to the fake device and read its reply, None if
+    # there is no reply within timeout
+    fd = os.open(path, os.O_RDWR)
+    try:
+        os.write(fd, message)
+        ready, _, _ = select.select([fd], [], [], timeout)
+        return os.read(fd, 1024) if ready else None
+    finally:
+        os.close(fd)
+
+
+@linux
+def test_fake_device_on_a_pty(tmp_path):
+    from pytes.emulator import FakeDevice
+    dev = FakeDevice(str(tmp_path), latency=0.05).start()
+    try:
+        assert os.path.islink(tmp_path / 'usbtmc0')
+        t_start = time.monotonic()
+        assert _exchange(dev.path, b':OUTPut1 ON;:OUTPut1?\n') == b'ON\n'
+        assert time.monotonic() - t_start >= 0.05
+        assert dev.stats == {'messages': 1, 'bytes_in': 22, 'replies': 1,
+                             'dropped': 0}
+    finally:
+        dev.stop()
+    assert not os.path.lexists(tmp_path / 'usbtmc0')
+
+
+@linux
+def test_dropped_replies(tmp_path):
+    from pytes.emulator import FakeDevice
+    dev = FakeDevice(str(tmp_path), drop_rate=1.0, seed=0).start()
+    try:
+        assert _exchange(dev.path, b'*IDN?\n', timeout=0.2) is None
+        # The command is executed, only its reply is lost
+        _exchange(dev.path, b':OUTPut1 ON\n', timeout=0.2)
+        assert dev.instrument.channels[1].output
+        assert dev.stats['dropped'] == 1 and dev.stats['replies'] == 0
+    finally:
+        dev.stop()
+
+
+@linux
+def test_emulator_process(tmp_path):
+    from pytes.emulator import EmulatorProcess
+    from pytes.signal_generator import USBTMC
+    with EmulatorProcess(str(tmp_path), n_dev=2) as emulator:
+        ports = USBTMC(inst=False).available_port_list(str(tmp_path))
+        assert sorted(ports) == sorted(emulator.paths)
+        assert _exchange(emulator.paths[1], b'*IDN?\n') == \
+            b'Rigol Technologies,DG1062Z,EMU0001,00.01.14\n'
+    assert emulator.stats[emulator.paths[1]]['replies'] == 1
+    assert emulator.stats[emulator.paths[0]]['messages'] == 0
+    assert not any(os.path.lexists(path) for path in emulator.paths)
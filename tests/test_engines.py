@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from pytes.scpi import KEYSIGHT_33500
+from pytes.signal_generator import SignalGenerator
+
+
+@pytest.fixture
+def sig_gen():
+    return SignalGenerator(protocol='MOCK')
+
+
+def _sent(sig_gen, n_init):
+    return [cmd for _, cmd in sig_gen.protocol.log[n_init:]]
+
+
+def test_sweep_in_one_message(sig_gen):
+    n_init = len(sig_gen.protocol.log)
+    timeline = sig_gen.sweep(100, 1000, 2.0, spacing='log', chn=2,
+                             trigger_source='bus')
+    assert _sent(sig_gen, n_init) == [
+        ':SOUR2:FREQ:STAR 100;:SOUR2:FREQ:STOP 1000;:SOUR2:SWE:TIME 2;'
+        ':SOUR2:SWE:SPAC LOG;:SOUR2:SWE:TRIG:SOUR MAN;:SOUR2:SWE:STAT ON']
+    assert not timeline['repeat']
+    assert timeline['t'][[0, -1]] == pytest.approx([0, 2])
+    # Logarithmic spacing, the geometric mean at half of the duration
+    assert timeline['freq'][50] == pytest.approx(np.sqrt(100 * 1000))
+    # The frequency is changed by the instrument
+    assert 'frequency' not in sig_gen.commanded.get(2, {})
+
+
+def test_burst_timeline(sig_gen):
+    sig_gen.protocol.responses[':SOUR1:FREQ?'] = '50'
+    n_init = len(sig_gen.protocol.log)
+    timeline = sig_gen.burst(5, 1.0, chn=1)
+    assert _sent(sig_gen, n_init) == [
+        ':SOUR1:FREQ?',
+        ':SOUR1:BURS:MODE TRIG;:SOUR1:BURS:NCYC 5;:SOUR1:BURS:INT:PER 1;'
+        ':SOUR1:BURS:TRIG:SOUR INT;:SOUR1:BURS:STAT ON']
+    assert timeline['freq'] == 50
+    assert timeline['t_off'] == pytest.approx(0.1)
+    assert timeline['repeat']
+
+
+def test_burst_with_frequency(sig_gen):
+    n_init = len(sig_gen.protocol.log)
+    sig_gen.burst(3, 0.5, chn=1, freq=20)
+    # No query, the frequency is set in the same message
+    assert _sent(sig_gen, n_init) == [
+        ':SOUR1:FREQ 20;:SOUR1:BURS:MODE TRIG;:SOUR1:BURS:NCYC 3;'
+        ':SOUR1:BURS:INT:PER 0.5;:SOUR1:BURS:TRIG:SOUR INT;'
+        ':SOUR1:BURS:STAT ON']
+    assert sig_gen.commanded[1]['frequency'] == 20
+
+
+def test_invalid_engine_settings(sig_gen):
+    n_init = len(sig_gen.protocol.log)
+    with pytest.raises(ValueError, match='positive'):
+        sig_gen.sweep(0, 100, 1.0)
+    with pytest.raises(ValueError, match='Unsupported'):
+        sig_gen.sweep(10, 100, 1.0, spacing='cubic')
+    with pytest.raises(ValueError, match='positive integer'):
+        sig_gen.burst(2.5, 1.0, freq=10)
+    # 20 cycles at 10 Hz do not fit into a period of 1 s
+    with pytest.raises(ValueError, match='longer than the period'):
+        sig_gen.burst(20, 1.0, freq=10)
+    assert _sent(sig_gen, n_init) == []
+
+
+def test_engine_off_is_restored(sig_gen):
+    sig_gen.sweep(10, 20, 1.0, chn=1)
+    sig_gen.engine_off(chn=1)
+    assert sig_gen.protocol.log[-1][1] == \
+        ':SOUR1:SWE:STAT OFF;:SOUR1:BURS:STAT OFF'
+    # The engine state replaces the sweep in the journal of the recovery
+    assert sig_gen._journal[1]['engine'] == \
+        b':SOUR1:SWE:STAT OFF;:SOUR1:BURS:STAT OFF\n'
+
+
+def test_keysight_trigger_keywords():
+    sig_gen = SignalGenerator(protocol='MOCK', dialect=KEYSIGHT_33500)
+    sig_gen.sweep(10, 20, 1.0, chn=1, trigger_source='external')
+    assert sig_gen.protocol.log[-1][1].endswith(
+        ':TRIG1:SOUR EXT;:SOUR1:SWE:STAT ON')
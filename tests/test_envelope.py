@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from pytes.clock import VirtualClock
+from pytes.envelope import compile_envelope, simplify
+from pytes.protocol import ProtocolRunner, compile_protocol
+from pytes.signal_generator import SignalGenerator
+
+
+def trajectory(n_sample=5000, rate=100.0, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_sample) / rate
+    values = 1 + 0.5 * np.sin(2 * np.pi * 0.05 * t) + \
+        0.002 * rng.standard_normal(n_sample)
+    return t, values
+
+
+def staircase(t, schedule):
+    # Output of the instrument holding every setpoint until the next one
+    t_set = np.array([cmd.t for cmd in schedule])
+    v_set = np.array([cmd.kwargs['value'] for cmd in schedule])
+    return v_set[np.searchsorted(t_set, t, side='right') - 1]
+
+
+@pytest.mark.parametrize('method', ['hold', 'linear'])
+def test_staircase_within_tolerance(method):
+    t, values = trajectory()
+    tol = 0.01
+    schedule, report = compile_envelope(t, values, tol, method=method)
+    dev = np.abs(staircase(t, schedule) - values)
+    assert dev.max() <= tol + 1e-12
+    assert report['max_deviation'] == pytest.approx(dev.max())
+    assert report['n_commands'] == len(schedule)
+    assert report['reduction'] > 5
+
+
+def test_hold_needs_fewest_setpoints():
+    t, values = trajectory()
+    n_hold = simplify(t, values, 0.01, method='hold')[2]['n_commands']
+    n_linear = simplify(t, values, 0.01, method='linear')[2]['n_commands']
+    assert n_hold <= n_linear
+
+
+def test_envelope_block_executes_setpoints():
+    t, values = trajectory(n_sample=500)
+    config = {'channels': {1: [
+        {'block': 'config', 'mode': 'tACS', 'amp': 1, 'freq': 10,
+         'phase': 0, 'offset': 0},
+        {'block': 'on'},
+        {'block': 'envelope', 'values': values.tolist(), 'rate': 100,
+         'tol': 0.01, 'method': 'linear'},
+        {'block': 'off'}]}}
+    schedule = compile_protocol(config)
+    envelope = [cmd for cmd in schedule if cmd.label == 'envelope']
+    assert np.abs(staircase(t, envelope) - values).max() <= 0.01 + 1e-12
+    clock = VirtualClock()
+    sig_gen = SignalGenerator(protocol='MOCK', clock=clock)
+    ProtocolRunner(sig_gen, spin=0.0, clock=clock).run(schedule, delay=0.0)
+    sent = [cmd for _, cmd in sig_gen.protocol.log
+            if cmd.startswith(':SOUR1:VOLT ')]
+    assert len(sent) == len(envelope)
+
+
+def test_invalid_trajectory():
+    with pytest.raises(ValueError, match='increasing'):
+        simplify([0, 0, 1], [1, 1, 1], 0.01)
+    with pytest.raises(ValueError, match='Unsupported method'):
+        simplify([0, 1], [1, 1], 0.01, method='cubic')
@@ -0,0 +1,85 @@
+import math
+import sys
+
+import pytest
+
+from pytes.clock import VirtualClock
+from pytes.events import (FADE_STEP, OUTPUT_OFF, OUTPUT_ON, PARAM, TRIGGER,
+                          Event, EventListener, EventPublisher)
+from pytes.signal_generator import SignalGenerator
+
+
+def _fields(event):
+    return tuple(getattr(event, name) for name in Event.__slots__)
+
+
+def test_event_round_trip():
+    event = Event(PARAM, 2, 7, -5, 2**62, 0.25, ':SOUR2:VOLT 0.25 µA')
+    data = event.encode()
+    assert len(data) == 32 + len(event.cmd.encode('utf8'))
+    assert _fields(Event.decode(data)) == _fields(event)
+    # NaN value and no command
+    event = Event.decode(Event(TRIGGER, 0, 0, 1, 2).encode())
+    assert math.isnan(event.value) and event.cmd == ''
+    # Trailing bytes after the command are ignored
+    assert Event.decode(data + b'xx').cmd == ':SOUR2:VOLT 0.25 µA'
+
+
+def _publish_and_receive(address, listener):
+    publisher = EventPublisher(address)
+    publisher.publish(OUTPUT_ON, 1, 10, 20, cmd=':OUTPut1 ON')
+    publisher.publish(PARAM, None, 30, 40, 1.5, ':SOUR1:VOLT 1.5')
+    publisher.close()
+    events = list(listener)
+    listener.close()
+    assert [_fields(event)[:6] for event in events[1:]] == \
+        [(PARAM, 0, 1, 30, 40, 1.5)]
+    assert events[0].seq == 0 and events[0].cmd == ':OUTPut1 ON'
+    assert publisher.dropped == 0
+
+
+def test_udp_round_trip():
+    listener = EventListener(('127.0.0.1', 0), timeout=0.5)
+    _publish_and_receive(listener._sock.getsockname(), listener)
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='Unix sockets only')
+def test_unix_datagram_round_trip(tmp_path):
+    address = str(tmp_path / 'events.sock')
+    listener = EventListener(address, timeout=0.5)
+    _publish_and_receive(address, listener)
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='Unix sockets only')
+def test_events_without_receiver_are_dropped(tmp_path):
+    publisher = EventPublisher(str(tmp_path / 'nobody.sock'))
+    publisher.publish(OUTPUT_ON, 1, 0, 0)
+    publisher.close()
+    assert publisher.dropped == 1
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='Unix sockets only')
+def test_events_of_the_signal_generator(tmp_path):
+    address = str(tmp_path / 'events.sock')
+    listener = EventListener(address, timeout=0.5)
+    clock = VirtualClock()
+    sig_gen = SignalGenerator(protocol='MOCK', clock=clock)
+    sig_gen.publish_events(address)
+    sig_gen.on(1)
+    sig_gen.tacs_amp(1.5, chn=1)
+    sig_gen.arm(chn=1)
+    clock.sleep(1)
+    sig_gen.fire()
+    sig_gen.disarm()
+    sig_gen.fade(amp=1, fade_dur=1, chn=1, step_per_sec=2)
+    sig_gen.events.close()
+    events = list(listener)
+    listener.close()
+    assert [event.kind for event in events] == [
+        OUTPUT_ON, PARAM, PARAM, TRIGGER, OUTPUT_OFF] + [FADE_STEP] * 3
+    assert [event.seq for event in events] == list(range(8))
+    assert events[1].value == 1.5 and events[1].cmd == ':SOUR1:VOLT 1.5'
+    # The timestamps are taken from the clock of the signal generator
+    assert events[3].t_before == events[3].t_after == 1_000_000_000
+    assert events[-1].value == 1.0
+    assert events[-1].t_before - events[-2].t_before == 500_000_000
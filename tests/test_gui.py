@@ -0,0 +1,137 @@
+import pytest
+
+pytest.importorskip('tkinter')
+
+from pytes.clock import VirtualClock  # noqa: E402
+from pytes.pytes_gui import ChannelConfig, PyTESWindow  # noqa: E402
+from pytes.signal_generator import SignalGenerator  # noqa: E402
+
+
+def _tacs(amp='1', freq='10', phase='0', offset='0', fade_dur=''):
+    return ChannelConfig('tACS', ['', amp, freq, phase, offset, fade_dur,
+                                  ''])
+
+
+def test_entries_are_typed():
+    config = _tacs(fade_dur=' 5 ')
+    assert (config.amp, config.freq, config.fade_dur) == (1.0, 10.0, 5.0)
+    assert config.stim_dur is None
+    # Entries not used by the mode may hold anything
+    config = ChannelConfig('tDCS', ['', '-1', 'x', '', '', '', ''])
+    assert config.amp == -1 and config.freq is None
+    with pytest.raises(ValueError, match='Frequency'):
+        _tacs(freq='abc')
+    with pytest.raises(ValueError, match='Fade In/Out'):
+        _tacs(fade_dur='3 s')
+
+
+def test_only_the_changes_are_sent():
+    config = _tacs()
+    assert config.commands(None) == {'sin': [10.0, 1.0, 0.0, 0.0]}
+    assert config.commands(config) == {}
+    # A duration does not change the signal
+    assert _tacs(fade_dur='5').commands(config) == {}
+    assert _tacs(freq='20', phase='90').commands(config) == \
+        {'frequency': 20.0, 'phase': 90.0}
+    # A mode change and the other modes configure the channel completely
+    dc = ChannelConfig('tDCS', ['', '1', '', '', '', '', ''])
+    assert dc.commands(config) == {'dc': 1.0}
+    assert dc.replace(amp=-1.0).commands(dc) == {'dc': -1.0}
+    assert dc.replace(freq=5.0).commands(dc) == {}
+    arb = ChannelConfig('Arb', ['data.pkl', '', '', '', '', '', ''])
+    assert arb.commands(arb) == {}
+    assert arb.replace(arb_path='other.pkl').commands(arb) == \
+        {'arb': 'other.pkl'}
+
+
+class _Window():
+    # Callbacks scheduled with after, run on demand
+    def __init__(self):
+        self.callbacks = {}
+        self._id = 0
+
+    def after(self, ms, func):
+        self._id += 1
+        self.callbacks[f'after#{self._id}'] = (ms, func)
+        return f'after#{self._id}'
+
+    def after_cancel(self, after_id):
+        del self.callbacks[after_id]
+
+
+@pytest.fixture
+def gui():
+    # The update logic of the window without widgets, no display required
+    gui = object.__new__(PyTESWindow)
+    gui.window = _Window()
+    gui.sig_gen = SignalGenerator(protocol='MOCK', clock=VirtualClock())
+    gui.dev_available = True
+    gui.configs = {1: None, 2: None}
+    gui.applied = {1: None, 2: None}
+    gui.debounce_ms = 300
+    gui._pending = {}
+    gui.entries = {1: _tacs(), 2: _tacs()}
+    gui.outputs = {1: False, 2: False}
+    gui.drawn = []
+    gui.read_channel = lambda chn: gui.entries[chn]
+    gui.ax_plt = lambda t, values, chn: gui.drawn.append(chn)
+    gui.output_on = lambda chn: gui.outputs[chn]
+    gui.executor = type('Executor', (), {'running': lambda self, chn:
+                                         False})()
+    return gui
+
+
+def _sent(gui, n_init):
+    return [cmd for _, cmd in gui.sig_gen.protocol.log[n_init:]]
+
+
+def test_chn_update_sends_the_diff(gui):
+    n_init = len(gui.sig_gen.protocol.log)
+    gui.chn_update(1)
+    assert _sent(gui, n_init) == [':SOUR1:APPL:SIN 10,1,0,0']
+    assert gui.drawn == [1]
+    n_init = len(gui.sig_gen.protocol.log)
+    gui.entries[1] = _tacs(freq='20', fade_dur='5')
+    gui.chn_update(1)
+    assert _sent(gui, n_init) == [':SOUR1:FREQ 20']
+    assert gui.drawn == [1, 1]
+    # Neither a redraw nor a command if only the duration changed
+    n_init = len(gui.sig_gen.protocol.log)
+    gui.entries[1] = _tacs(freq='20', fade_dur='10')
+    assert gui.chn_update(1).fade_dur == 10
+    assert _sent(gui, n_init) == [] and gui.drawn == [1, 1]
+
+
+def test_live_edits_do_not_reach_a_live_output(gui):
+    gui.chn_update(1)
+    gui.outputs[1] = True
+    n_init = len(gui.sig_gen.protocol.log)
+    gui.entries[1] = _tacs(amp='2')
+    gui.chn_update(1, live=True)
+    assert _sent(gui, n_init) == []
+    # Drawn, and sent with the next explicit update
+    assert gui.configs[1].amp == 2 and gui.applied[1].amp == 1
+    gui.chn_update(1)
+    assert _sent(gui, n_init) == [':SOUR1:VOLT 2']
+
+
+def test_invalid_live_edit_is_ignored(gui, monkeypatch):
+    def half_typed(chn):
+        raise ValueError('Voltage must be a number, got "1e"')
+    monkeypatch.setattr(gui, 'read_channel', half_typed)
+    assert gui.chn_update(1, live=True) is None
+
+
+def test_edits_are_debounced(gui):
+    n_init = len(gui.sig_gen.protocol.log)
+    for _ in range(5):
+        gui.schedule_update(1)
+    gui.schedule_update(2)
+    # One pending update per channel, the earlier ones are cancelled
+    assert len(gui.window.callbacks) == 2
+    assert set(gui._pending) == {1, 2}
+    ms, func = gui.window.callbacks[gui._pending[1]]
+    assert ms == 300
+    func()
+    assert 1 not in gui._pending
+    assert _sent(gui, n_init) == [':SOUR1:APPL:SIN 10,1,0,0']
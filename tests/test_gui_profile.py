@@ -0,0 +1,140 @@
+import json
+import sys
+import time
+
+import pytest
+
+tkinter = pytest.importorskip('tkinter')
+
+from pytes.gui_profile import (TkProfiler, callback_name,  # noqa: E402
+                               device_command)
+from pytes.signal_generator import MockDriver  # noqa: E402
+
+
+class _Tk():
+    # Interpreter of the fake window, records the scheduled commands
+    def __init__(self):
+        self.calls = []
+
+    def call(self, *args):
+        self.calls.append(args)
+
+
+class _Window():
+    # Root window without display, the main loop is driven by the test
+    def __init__(self):
+        self.tk = _Tk()
+        self.registered = []
+
+    def register(self, func):
+        self.registered.append(func)
+        return f'cmd{len(self.registered)}'
+
+    _register = register
+
+
+@pytest.fixture
+def profiler():
+    profiler = TkProfiler(_Window(), threshold=0.05, heartbeat=0.01,
+                          sample_interval=0.005)
+    yield profiler
+    profiler.stop()
+
+
+def _callback(func, widget='.button'):
+    # Widget command as wrapped by tkinter while the profiler is installed
+    return tkinter.CallWrapper(func, None, widget)
+
+
+def test_callback_names():
+    def on_click():
+        pass
+    assert callback_name(on_click) == \
+        'test_callback_names.<locals>.on_click'
+    assert callback_name(lambda: None).startswith(
+        'test_callback_names.<locals>.<lambda> (test_gui_profile.py:')
+    assert callback_name(MockDriver().set_cmd) == 'MockDriver.set_cmd'
+    window = _Window()
+    tkinter.Misc.after(window, 10, on_click)
+    assert callback_name(window.registered[0]) == \
+        'after test_callback_names.<locals>.on_click'
+
+
+def test_device_command():
+    driver = MockDriver()
+    frames = []
+    driver.clock = type('Clock', (), {
+        'sleep': lambda self, dur: frames.append(sys._getframe()),
+        'now': lambda self: 0.0})()
+    driver.latency = 1
+    driver.set_cmd(':OUTPut1 ON')
+    assert device_command(frames[0]) == 'set_cmd: :OUTPut1 ON'
+    assert device_command(frames[0].f_back.f_back) is None
+
+
+def test_stall_is_attributed_to_the_innermost_callback(profiler):
+    driver = MockDriver(latency=0.2)
+    profiler.start()
+    assert tkinter.CallWrapper is not profiler._wrapper
+
+    def send():
+        driver.set_cmd(':SOUR1:VOLT 2')
+
+    def update():
+        _callback(send, '.entry')()
+    _callback(update)()
+    profiler._beat()
+    assert len(profiler.stalls) == 1
+    stall = profiler.stalls[0]
+    assert stall['duration'] >= 0.15
+    assert stall['handler'].endswith('<locals>.send')
+    assert stall['device'] == 'set_cmd: :SOUR1:VOLT 2'
+    assert any('set_cmd' in line for line in stall['stack'])
+    assert len(stall['samples']) >= 10
+    summary = {row['name'].split('.')[-1]: row
+               for row in profiler.summary()}
+    assert summary['send']['stalls'] == 1
+    assert summary['update']['stalls'] == 0
+    assert summary['update']['calls'] == 1
+    # The next heartbeat is scheduled, the heartbeat itself is not timed
+    assert profiler.window.tk.calls[-1] == ('after', 10, 'cmd1')
+    assert len(profiler.events) == 2
+
+
+def test_stall_without_samples(profiler):
+    # The watchdog does not sample before the stall ended
+    profiler.sample_interval = 10.0
+    profiler.start()
+    _callback(lambda: time.sleep(0.01))()
+    _callback(lambda: time.sleep(0.1), '.plot')()
+    profiler._beat()
+    stall = profiler.stalls[0]
+    assert stall['samples'] == [] and stall['device'] is None
+    # The longest callback since the previous heartbeat
+    assert profiler.summary()[0]['name'] == stall['handler']
+    # No stall if the heartbeat is on time
+    profiler._beat()
+    assert len(profiler.stalls) == 1
+
+
+def test_report_and_trace(profiler, tmp_path):
+    profiler.sample_interval = 10.0
+    profiler.start()
+    _callback(lambda: time.sleep(0.08))()
+    profiler._beat()
+    report = profiler.report()
+    assert report['heartbeats'] == 1 and len(report['stalls']) == 1
+    assert 'samples' not in report['stalls'][0]
+    trace = json.load(open(profiler.export(str(tmp_path / 'trace.json'))))
+    names = [event['name'] for event in trace['traceEvents']]
+    assert names.count('thread_name') == 2
+    assert any(name.startswith('stall in ') for name in names)
+
+
+def test_install_once(profiler):
+    profiler.install()
+    with pytest.raises(RuntimeError, match='installed'):
+        TkProfiler(_Window()).install()
+    wrapper = profiler._wrapper
+    profiler.uninstall()
+    assert tkinter.CallWrapper is wrapper
@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Cumulative import time in seconds, generous for slow CI machines
+BUDGET = {'pytes.signal_generator': 1.5, 'pytes.pytes_gui': 2.0}
+HEAVY = ['pyvisa', 'matplotlib', 'yaml']
+
+
+def _import(module):
+    # Import the module in a fresh interpreter, returns the loaded modules
+    # and the cumulative import time in seconds reported by -X importtime
+    code = (f'import sys, {module}\n'
+            'print("\\n".join(sorted(sys.modules)))')
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          capture_output=True, text=True, cwd=ROOT, env=env,
+                          check=True)
+    cumulative = None
+    for line in proc.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            cumulative = int(fields[1]) / 1e6
+    return set(proc.stdout.split()), cumulative
+
+
+def test_signal_generator_import_is_light():
+    modules, cumulative = _import('pytes.signal_generator')
+    for name in HEAVY + ['tkinter', 'pytes.protocol', 'pytes.timeline',
+                        'pytes.capabilities']:
+        assert name not in modules
+    assert cumulative < BUDGET['pytes.signal_generator']
+
+
+def test_gui_import_has_no_side_effects():
+    pytest.importorskip('tkinter')
+    modules, cumulative = _import('pytes.pytes_gui')
+    # Importing must neither load the plots nor open a window, nor the
+    # protocol compiler
+    for name in HEAVY + ['pytes.protocol']:
+        assert name not in modules
+    assert cumulative < BUDGET['pytes.pytes_gui']
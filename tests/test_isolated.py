@@ -0,0 +1,80 @@
+import os
+import time
+from multiprocessing import shared_memory
+
+import pytest
+
+from pytes import estop, isolated
+from pytes.isolated import IsolatedSignalGenerator, ShmRing
+
+
+def test_ring_round_trip_and_wrap():
+    ring = ShmRing(capacity=256)
+    try:
+        other = ShmRing(name=ring.name)
+        for i in range(100):
+            payload = os.urandom(i % 60)
+            assert ring.push(payload)
+            assert other.pop() == payload
+        assert other.pop() is None
+        while ring.push(b'x' * 40):
+            pass
+        assert len(ring) > 0
+        other.close()
+    finally:
+        ring.close()
+
+
+def test_emergency_stop_and_rearm():
+    control = IsolatedSignalGenerator('MOCK', protocol='MOCK')
+    try:
+        control.on(chn=1)
+        seq = control.send('fade', amp=1, fade_dur=10, chn=1)
+        time.sleep(0.5)
+        t_stop = time.monotonic()
+        report = estop.emergency_stop(verbose=False)
+        # The latency includes the acknowledged off command of the I/O
+        # process
+        assert report['latency'][repr(control)] > 0
+        assert repr(control) not in report['failed']
+        # The fade in progress ends right away
+        control._wait_ack(seq)
+        assert time.monotonic() - t_stop < 1.0
+        with pytest.raises(RuntimeError, match='rearm'):
+            control.fade(amp=1, fade_dur=1, chn=1)
+        control.rearm()
+        control.on(chn=1)
+    finally:
+        control.close()
+
+
+def test_failed_startup_releases_shared_memory(monkeypatch):
+    names = []
+
+    class RecordingRing(ShmRing):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            names.append(self.name)
+
+    monkeypatch.setattr(isolated, 'ShmRing', RecordingRing)
+    with pytest.raises(RuntimeError, match='failed to connect'):
+        IsolatedSignalGenerator('MOCK', protocol='UNKNOWN')
+    assert len(names) == 2
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+
+def test_stop_of_a_dead_process_is_reported():
+    control = IsolatedSignalGenerator('MOCK', protocol='MOCK',
+                                      stop_timeout=0.2)
+    try:
+        control._proc.terminate()
+        control._proc.join(5.0)
+        t_stop = time.monotonic()
+        report = estop.emergency_stop(verbose=False)
+        assert time.monotonic() - t_stop < 1.0
+        assert repr(control) in report['failed']
+        assert repr(control) not in report['latency']
+    finally:
+        control.close()
@@ -0,0 +1,120 @@
+import time
+
+import numpy as np
+import pytest
+
+from pytes.clock import VirtualClock
+from pytes.protocol import (ProtocolError, ProtocolRunner, check_schedule,
+                            compile_protocol, dry_run)
+from pytes.signal_generator import SignalGenerator
+from pytes.timeline import OverrunError
+
+
+def tacs(chn_hold=2.0):
+    return [{'block': 'config', 'mode': 'tACS', 'amp': 1, 'freq': 10,
+             'phase': 0, 'offset': 0},
+            {'block': 'on'},
+            {'block': 'ramp', 'to': 2, 'duration': 2},
+            {'block': 'hold', 'duration': chn_hold},
+            {'block': 'off'}]
+
+
+def test_commands_at_their_offsets():
+    result = dry_run({'channels': {1: tacs()}})
+    commands = result['commands']
+    assert commands[0] == (0.0, ':SOUR1:APPL:SIN 10,1,0,0')
+    ramp = [(t, cmd) for t, cmd in commands if cmd.startswith(':SOUR1:VOLT')]
+    assert [t for t, _ in ramp] == pytest.approx([0.5, 1.0, 1.5, 2.0])
+    assert ramp[-1][1] == ':SOUR1:VOLT 2'
+    assert commands[-1] == (pytest.approx(4.0), ':OUTPut1 OFF')
+    assert result['duration'] == pytest.approx(4.0)
+    for rec in result['records'][2:]:
+        assert rec['error'] == pytest.approx(0.0)
+
+
+def test_hour_long_session_in_virtual_time():
+    t0 = time.perf_counter()
+    result = dry_run({'channels': {1: tacs(chn_hold=3600)}})
+    assert time.perf_counter() - t0 < 2.0
+    assert result['commands'][-1] == (pytest.approx(3602.0),
+                                      ':OUTPut1 OFF')
+
+
+def test_channels_are_not_delayed_by_each_other():
+    # The latency of CH1 does not shift the commands of CH2
+    result = dry_run({'channels': {1: tacs(), 2: tacs(chn_hold=1.0)}},
+                     latency=0.01)
+    times = {cmd: t for t, cmd in result['commands']}
+    assert times[':SOUR1:VOLT 1.25'] == pytest.approx(0.51)
+    assert times[':SOUR2:VOLT 1.25'] == pytest.approx(0.51)
+    assert times[':OUTPut2 OFF'] == pytest.approx(3.01)
+    assert times[':OUTPut1 OFF'] == pytest.approx(4.01)
+    assert [t for t, _ in result['commands']] == \
+        sorted(t for t, _ in result['commands'])
+
+
+def test_late_command_aborts_the_run():
+    # The upload of the arbitrary data delays the output of CH1 beyond
+    # the tolerance
+    data = np.sin(np.linspace(0, 2 * np.pi, 200)).tolist()
+    schedule = compile_protocol({'channels': {
+        1: [{'block': 'config', 'mode': 'arb', 'data': data, 'sps': 100},
+            {'block': 'on'}, {'block': 'hold', 'duration': 1},
+            {'block': 'off'}],
+        2: tacs(chn_hold=60)}})
+    clock = VirtualClock()
+    sig_gen = SignalGenerator(protocol='MOCK', clock=clock)
+    sig_gen.protocol.latency = 0.01
+    n_init = len(sig_gen.protocol.log)
+    runner = ProtocolRunner(sig_gen, spin=0.0, clock=clock, tolerance=0.1)
+    with pytest.raises(OverrunError, match="'CH1 on'"):
+        runner.run(schedule, delay=0.0)
+    commands = [cmd for _, cmd in sig_gen.protocol.log[n_init:]]
+    assert ':OUTPut1 ON' not in commands
+    # Every thread has its own virtual time, CH2 is aborted or finished
+    # depending on when the failure of CH1 is seen, both end off
+    for chn in [1, 2]:
+        output = [cmd for cmd in commands
+                  if cmd.startswith(f':OUTPut{chn} ')]
+        assert output[-1] == f':OUTPut{chn} OFF'
+
+
+def test_cathodal_tdcs():
+    schedule = compile_protocol({'channels': {1: [
+        {'block': 'config', 'mode': 'tDCS', 'amp': -0.002},
+        {'block': 'on'},
+        {'block': 'ramp', 'to': -1, 'duration': 1},
+        {'block': 'hold', 'duration': 1},
+        {'block': 'ramp', 'to': -0.002, 'duration': 1},
+        {'block': 'off'}]}})
+    assert schedule[0].kwargs == {'para_dict': {'dc': -0.002}}
+    levels = [cmd.kwargs['value'] for cmd in schedule
+              if cmd.method == 'offset']
+    assert levels == pytest.approx([-0.501, -1, -0.501, -0.002])
+    commands = [cmd for _, cmd in dry_run(schedule)['commands']]
+    assert ':SOUR1:VOLT:OFFS -1' in commands
+
+
+def test_cathodal_sham_keeps_its_polarity():
+    schedule = compile_protocol({'channels': {2: [
+        {'block': 'config', 'mode': 'tDCS', 'amp': -0.002},
+        {'block': 'sham', 'amp': -1, 'ramp': 1, 'duration': 5}]}})
+    levels = [cmd.kwargs['value'] for cmd in schedule
+              if cmd.method == 'offset']
+    assert max(levels) == -0.002 and min(levels) == -1
+
+
+def test_dc_level_limits():
+    def config(amp, mode='tDCS'):
+        return {'channels': {1: [{'block': 'config', 'mode': mode,
+                                  'amp': amp, 'freq': 10}]}}
+
+    for amp in [0.001, -0.001, float('nan')]:
+        with pytest.raises(ProtocolError, match='magnitude'):
+            compile_protocol(config(amp))
+    # The amplitude of a sine is peak-to-peak
+    with pytest.raises(ProtocolError, match='non-negative'):
+        compile_protocol(config(-1, mode='tACS'))
+    # The capabilities limit the magnitude
+    with pytest.raises(ProtocolError, match='maximum voltage'):
+        check_schedule(compile_protocol(config(-12)))
@@ -0,0 +1,105 @@
+import pytest
+
+from pytes.clock import VirtualClock
+from pytes.signal_generator import BaseDriver, SignalGenerator
+
+
+@pytest.fixture
+def sig_gen():
+    return SignalGenerator(protocol='MOCK', clock=VirtualClock())
+
+
+def _log(sig_gen):
+    return [cmd for _, cmd in sig_gen.protocol.log]
+
+
+def test_lost_link_restores_the_channels(sig_gen):
+    sig_gen.para_set({'sin': [10, 1, 0, 0]}, chn=1, delay=0)
+    sig_gen.amp(1.5, chn=1)
+    sig_gen.on(chn=1)
+    sig_gen.off(chn=2)
+    sig_gen.protocol.disconnect(0.3)
+    n_sent = len(sig_gen.protocol.log)
+    # A state command is remembered before it is sent, hence restored
+    sig_gen.frequency(20, chn=1)
+
+    report = sig_gen.recoveries[-1]
+    assert report['attempts'] > 1
+    assert report['duration'] >= 0.3
+    assert report['lost'] is None
+    # The whole state in one message, the outputs last
+    restored = _log(sig_gen)[n_sent:]
+    assert restored == [':SOUR1:APPL:SIN 10,1,0,0;:SOUR1:VOLT 1.5;'
+                        ':SOUR1:FREQ 20;:OUTPut1 ON;:OUTPut2 OFF']
+    assert sig_gen.commanded[1] == {'frequency': 20, 'amp': 1.5,
+                                    'offset': 0, 'phase': 0, 'output': 1}
+
+
+def test_lost_write_is_reported(sig_gen):
+    sig_gen.on(chn=1)
+    sig_gen.protocol.disconnect(0.1)
+    sig_gen.set_cmd('*CLS')
+    assert sig_gen.recoveries[-1]['lost'] == '*CLS'
+    assert _log(sig_gen)[-1] == ':OUTPut1 ON'
+
+
+def test_emergency_stop_is_kept_by_the_recovery(sig_gen):
+    sig_gen.on(chn=1)
+    sig_gen.emergency_stop()
+    sig_gen.rearm()
+    sig_gen.protocol.disconnect(0.1)
+    sig_gen.amp(1, chn=1)
+    assert _log(sig_gen)[-1].endswith(':OUTPut1 OFF;:OUTPut2 OFF')
+
+
+def test_link_not_recovered(sig_gen):
+    sig_gen.on(chn=1)
+    sig_gen.protocol.disconnect(1000)
+    with pytest.raises(ConnectionError, match='not recovered after 8'):
+        sig_gen.amp(1, chn=1)
+
+
+class _ReopenedDriver(BaseDriver):
+    # Driver relying on the default reopen of BaseDriver
+    lost = False
+    opened = 0
+
+    def __init__(self, dev=None):
+        self.dev = dev
+        type(self).opened += 1
+        self.log = []
+
+    def set_cmd(self, scpi_command='', dev_fd=None):
+        if type(self).lost:
+            type(self).lost = False
+            raise OSError('Link lost')
+        self.log.append(scpi_command)
+
+    def query_cmd(self, scpi_command, length=100, dev_fd=None,
+                  timeout=None):
+        return 'PyTES,Test,0,0'
+
+
+def test_default_reopen(sig_gen):
+    sig_gen.protocol = _ReopenedDriver(dev='DEV')
+    sig_gen.on(chn=1)
+    _ReopenedDriver.lost = True
+    sig_gen.amp(1, chn=1)
+    assert _ReopenedDriver.opened == 2
+    assert sig_gen.protocol.dev == 'DEV'
+    assert sig_gen.recoveries[-1]['dev'] == 'DEV'
+    # The log of the reopened driver holds the restored state only
+    assert sig_gen.protocol.log == [':SOUR1:VOLT 1;:OUTPut1 ON']
+
+
+def test_driver_without_reopen(sig_gen):
+    class Driver():
+        def write_raw(self, data):
+            raise OSError('Link lost')
+
+        def link_lost(self, error):
+            return True
+
+    sig_gen.protocol = Driver()
+    with pytest.raises(ConnectionError, match='cannot reopen'):
+        sig_gen.on(chn=1)
@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+from pytes import estop
+from pytes.scheduling import CommandScheduler, LatencyModel
+from pytes.signal_generator import SignalGenerator
+
+
+@pytest.fixture
+def sig_gen():
+    sig_gen = SignalGenerator(protocol='MOCK')
+    yield sig_gen
+    if sig_gen.scheduler is not None:
+        sig_gen.scheduler.stop()
+    sig_gen.rearm()
+
+
+def _log(sig_gen):
+    return [cmd for _, cmd in sig_gen.protocol.log]
+
+
+def test_scheduled_command_is_dispatched(sig_gen):
+    item = sig_gen.schedule(time.monotonic() + 0.02, ':OUTPut1 ON')
+    assert item.wait(1.0)
+    assert not item.cancelled
+    assert ':OUTPut1 ON' in _log(sig_gen)
+    assert sig_gen.scheduler.report()['n'] == 1
+
+
+def test_pending_command_cancelled_by_emergency_stop(sig_gen):
+    item = sig_gen.schedule(time.monotonic() + 0.5, ':OUTPut1 ON')
+    sig_gen.emergency_stop()
+    assert item.wait(1.0)
+    assert item.cancelled
+    time.sleep(0.6)
+    assert ':OUTPut1 ON' not in _log(sig_gen)
+
+
+def test_command_waiting_for_dispatch_not_sent_after_stop(sig_gen):
+    # With a long spin, the command is taken from the queue right away and
+    # busy-waits for its dispatch time when the stop arrives
+    sig_gen.scheduler = CommandScheduler(sig_gen, model=LatencyModel(),
+                                         spin=1.0, realtime=False)
+    item = sig_gen.schedule(time.monotonic() + 0.3, sig_gen.on)
+    time.sleep(0.1)
+    assert not sig_gen.scheduler._heap
+    estop.emergency_stop(verbose=False)
+    assert item.wait(1.0)
+    assert item.cancelled
+    assert item.t_write_start is None
+    log = _log(sig_gen)
+    assert not any('ON' in cmd for cmd in log)
+
+
+def test_emergency_stop_needs_rearm(sig_gen):
+    sig_gen.emergency_stop()
+    assert sig_gen.stopped
+    with pytest.raises(RuntimeError):
+        sig_gen.fade(amp=1, fade_dur=1, chn=1)
+    with pytest.raises(RuntimeError):
+        sig_gen.arb_func([0, 1, 0], sps=100, chn=1)
+    sig_gen.rearm()
+    assert not sig_gen.stopped
+    sig_gen.fade(amp=1, fade_dur=0.5, chn=1, step_per_sec=20)
+    assert _log(sig_gen)[-1] == ':SOUR1:VOLT 1'
+
+
+def test_emergency_stop_does_not_wait_for_a_blocked_write(sig_gen):
+    # The scheduled write runs into the backoff of the link recovery
+    sig_gen.protocol.disconnect(100)
+    item = sig_gen.schedule(time.monotonic() + 0.01, ':OUTPut1 ON')
+    t_end = time.monotonic() + 1.0
+    while not sig_gen._recovering and time.monotonic() < t_end:
+        time.sleep(0.001)
+    assert sig_gen._recovering
+    t0 = time.monotonic()
+    report = estop.emergency_stop(verbose=False)
+    assert time.monotonic() - t0 < 0.2
+    assert report['worst'] < 0.2
+    # The recovery ends on the stop instead of its remaining backoff
+    assert item.wait(1.0)
+    assert isinstance(item.exception, ConnectionError)
+    assert ':OUTPut1 ON' not in _log(sig_gen)
+    assert _log(sig_gen)[-1] == ':OUTPut1 OFF;:OUTPut2 OFF'
@@ -0,0 +1,73 @@
+import timeit
+
+import pytest
+
+from pytes.scpi import (DIALECTS, KEYSIGHT_33500, RIGOL_DG1000Z, SIGLENT_SDG,
+                        CommandEncoder, dialect_from_idn)
+from pytes.signal_generator import SignalGenerator
+
+
+@pytest.mark.parametrize('dialect, expected', [
+    (RIGOL_DG1000Z, [b':SOUR1:VOLT 0.5\n', b':OUTPut2 ON\n',
+                     b':SOUR1:APPL:SIN 10,1,0,0\n']),
+    (KEYSIGHT_33500, [b':SOUR1:VOLT 0.5\n', b':OUTP2 ON\n',
+                      b':SOUR1:APPL:SIN 10,1,0;:SOUR1:PHAS 0\n']),
+    (SIGLENT_SDG, [b'C1:BSWV AMP,0.5\n', b'C2:OUTP ON\n',
+                   b'C1:BSWV WVTP,SINE,FRQ,10,AMP,1,OFST,0,PHSE,0\n'])])
+def test_encode(dialect, expected):
+    encoder = CommandEncoder(dialect)
+    assert [encoder.encode('amp', 1, 0.5), encoder.encode('on', 2),
+            encoder.encode('sin', 1, 10, 1, 0, 0)] == expected
+    # Numbers are formatted with the precision of the dialect
+    assert encoder.text('amp', 1, 1 / 3).endswith('0.3333333333')
+
+
+@pytest.mark.parametrize('dialect', [i for i in DIALECTS
+                                     if i is not SIGLENT_SDG])
+def test_scpi_headers_are_rooted(dialect):
+    # A relative header after a separator continues the previous path
+    encoder = CommandEncoder(dialect)
+    for key, template in dialect.templates.items():
+        if template is None:
+            continue
+        for cmd in template.split(dialect.separator):
+            assert cmd[0] in ':*', f'{dialect.name} {key}: {cmd}'
+    message = encoder.join([encoder.encode('sweep_off', 1),
+                            encoder.encode('burst_off', 1),
+                            encoder.encode('on', 1)])
+    assert all(cmd[:1] == b':' for cmd in message.strip().split(b';'))
+
+
+def test_join_keysight_engine_off():
+    sig_gen = SignalGenerator(protocol='MOCK', dialect=KEYSIGHT_33500)
+    sig_gen.engine_off(chn=1)
+    assert sig_gen.protocol.log[-1][1] == \
+        ':SOUR1:SWE:STAT OFF;:SOUR1:BURS:STAT OFF'
+    assert sig_gen._off_all == b':OUTP1 OFF;:OUTP2 OFF\n'
+
+
+def test_dialect_from_idn():
+    assert dialect_from_idn('Rigol Technologies,DG1062Z,x,1') is \
+        RIGOL_DG1000Z
+    assert dialect_from_idn('Keysight Technologies,33522B,x,1') is \
+        KEYSIGHT_33500
+    assert dialect_from_idn('Siglent,SDG2042X,x,1') is SIGLENT_SDG
+    assert dialect_from_idn('PyTES,MockDriver,0,0.0.1') is RIGOL_DG1000Z
+
+
+def test_encode_is_faster_than_string_formatting():
+    # The former path built every command as a string and encoded it
+    encoder = CommandEncoder()
+    suffix = {'amp': ':VOLT'}
+
+    def string_path(chn=1, para='amp', value=0.5):
+        return f':SOUR{str(chn)}{suffix[para]} {str(value)}\n'.encode(
+            encoding='utf8')
+
+    def encoder_path(chn=1, value=0.5):
+        return encoder.encode('amp', chn, value)
+
+    assert string_path() == encoder_path()
+    t_string, t_encoder = [min(timeit.repeat(func, number=20000, repeat=7))
+                           for func in [string_path, encoder_path]]
+    assert t_encoder < t_string
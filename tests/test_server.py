@@ -0,0 +1,137 @@
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from pytes.server import ControlServer, SignalGeneratorClient
+from pytes.signal_generator import SignalGenerator
+
+
+pytestmark = pytest.mark.skipif(os.name == 'nt',
+                                reason='Unix sockets are not available')
+
+
+@pytest.fixture
+def server(tmp_path):
+    created = []
+
+    def factory(dev):
+        # A slow connect widens the window for concurrent clients
+        time.sleep(0.2)
+        created.append(dev)
+        return SignalGenerator(dev=dev, protocol='MOCK')
+
+    server = ControlServer(path=str(tmp_path / 'pytes.sock'),
+                           sig_gen_factory=factory)
+    server.created = created
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result(5.0)
+    server.loop = loop
+    yield server
+    server.server.close()
+    _run(server, _cancel_workers())
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5.0)
+    loop.close()
+
+
+def _run(server, coro):
+    return asyncio.run_coroutine_threadsafe(coro, server.loop).result(5.0)
+
+
+async def _cancel_workers():
+    tasks = [task for task in asyncio.all_tasks()
+             if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _workers():
+    return sum(getattr(task.get_coro(), '__name__', '') == '_device_worker'
+               for task in asyncio.all_tasks())
+
+
+def test_concurrent_clients_share_one_device(server):
+    errors, barrier = [], threading.Barrier(4)
+
+    def client(chn):
+        try:
+            with SignalGeneratorClient(dev='MOCK1', path=server.path) as sg:
+                barrier.wait()
+                sg.on(chn=chn % 2 + 1)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10.0)
+    assert not errors
+    assert server.created == ['MOCK1']
+    assert list(server.devices) == ['MOCK1']
+    assert _run(server, _workers()) == 1
+    log = [cmd for _, cmd in server.devices['MOCK1'].sig_gen.protocol.log]
+    assert log.count(':OUTPut1 ON') + log.count(':OUTPut2 ON') == 4
+
+
+def test_pipelined_requests_keep_their_order(server):
+    with SignalGeneratorClient(dev='MOCK2', path=server.path) as sg:
+        assert sg.ping() == 'pong'
+        calls = [('amp', {'value': 0.1 * (i + 1), 'chn': 1})
+                 for i in range(10)]
+        sg.batch(calls)
+        with pytest.raises(RuntimeError, match='Private method'):
+            sg.call('_io')
+    log = [cmd for _, cmd in server.devices['MOCK2'].sig_gen.protocol.log
+           if cmd.startswith(':SOUR1:VOLT')]
+    assert [float(cmd.split()[1]) for cmd in log] == \
+        pytest.approx([0.1 * (i + 1) for i in range(10)])
+
+
+def test_nested_arrays_are_serialized(server):
+    with SignalGeneratorClient(dev='MOCK3', path=server.path,
+                               timeout=5.0) as sg:
+        timeline = sg.sweep(10, 20, 1.0, chn=1)
+        assert timeline['mode'] == 'sweep'
+        assert len(timeline['t']) == len(timeline['freq']) == 101
+        assert timeline['freq'][0] == 10 and timeline['freq'][-1] == 20
+        # The pre-encoded trigger is returned as text
+        armed = sg.arm(chn=1)
+        assert armed['chns'] == [1] and armed['data'].startswith('*TRG')
+        # A result json cannot serialize is answered with an error
+        with pytest.raises(RuntimeError, match='not JSON serializable'):
+            sg.event_kind(1)
+        assert sg.ping() == 'pong'
+
+
+def test_invalid_requests_are_answered(server):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(5.0)
+        sock.connect(server.path)
+        reader = sock.makefile('rb')
+        for line in [b'[1, 2]\n', b'not json\n']:
+            sock.sendall(line)
+            res = json.loads(reader.readline())
+            assert res['id'] is None and res['result'] is None
+            assert 'JSON object' in res['error']
+        reader.close()
+
+
+def test_client_timeout(tmp_path):
+    path = str(tmp_path / 'silent.sock')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+        listener.bind(path)
+        listener.listen(1)
+        with SignalGeneratorClient(path=path, timeout=0.1) as sg:
+            t0 = time.monotonic()
+            with pytest.raises(TimeoutError):
+                sg.ping()
+            assert time.monotonic() - t0 < 2.0
@@ -0,0 +1,127 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from pytes.clock import VirtualClock
+from pytes.signal_generator import SignalGenerator
+from pytes.telemetry import TelemetryPoller, TelemetrySeries, parse_reply
+
+
+@pytest.fixture
+def sig_gen():
+    return SignalGenerator(protocol='MOCK', clock=VirtualClock())
+
+
+def test_parse_reply():
+    assert parse_reply('output', 'ON\n') == 1
+    assert parse_reply('output', b'0') == 0
+    assert parse_reply('amp', '+1.000000E+00') == 1
+    siglent = 'C1:BSWV WVTP,SINE,FRQ,10HZ,AMP,1V,OFST,0.5V,PHSE,0'
+    assert parse_reply('frequency', siglent) == 10
+    assert parse_reply('offset', siglent) == 0.5
+    assert np.isnan(parse_reply('amp', 'garbage'))
+
+
+def test_series_keeps_the_latest_samples():
+    series = TelemetrySeries(3, [1], ['amp'])
+    for t in range(5):
+        series.append(t, [[t]], [[t]], [[False]])
+    assert len(series) == 3
+    assert list(series.data()['t']) == [2, 3, 4]
+    assert list(series.field('amp', 1)[1]) == [2, 3, 4]
+
+
+def test_one_round_trip_per_poll(sig_gen):
+    sig_gen.set_cmd(':SOUR1:VOLT 1')
+    sig_gen.commanded[1] = {'output': 1, 'amp': 1.0}
+    found = []
+    poller = TelemetryPoller(sig_gen, chns=[1], quiet=0,
+                             on_mismatch=lambda *args: found.append(args))
+    sig_gen.protocol.responses[poller._message] = \
+        '1;0.5;1000;0;-222,"Data out of range"'
+    n_init = len(sig_gen.protocol.log)
+    sample = poller.poll()
+    assert len(sig_gen.protocol.log) == n_init + 1
+    assert sample['values'].tolist() == [[1, 0.5, 1000, 0]]
+    # Only the amplitude differs, the frequency was never commanded
+    assert sample['mismatch'].tolist() == [[False, True, False, False]]
+    assert found == [(0.0, 1, 'amp', 1.0, 0.5)]
+    assert poller.mismatches() == found
+    assert poller.errors[0][1] == '-222,"Data out of range"'
+    report = poller.report()
+    assert report['round_trips'] == 1 and report['mismatch_samples'] == 1
+
+
+def test_fall_back_to_one_query_per_message(sig_gen):
+    poller = TelemetryPoller(sig_gen, chns=[1], quiet=0)
+    sig_gen.protocol.responses[':SOUR1:VOLT?'] = '0.5'
+    sample = poller.poll()
+    assert not poller.pipeline
+    assert sample['values'][0, 1] == 0.5
+    # The pipelined message and then each of the 5 queries
+    assert poller.stats['round_trips'] == 6
+    poller.poll()
+    assert poller.stats['round_trips'] == 11
+
+
+def test_poll_yields_to_commands(sig_gen):
+    poller = TelemetryPoller(sig_gen, quiet=0.05)
+    sig_gen.set_cmd('*CLS')
+    assert poller.poll() is None
+    sig_gen.clock.sleep(0.05)
+    # A command in progress in another thread
+    held, release = threading.Event(), threading.Event()
+
+    def command():
+        with sig_gen._io_lock:
+            held.set()
+            release.wait(1.0)
+    thread = threading.Thread(target=command)
+    thread.start()
+    held.wait(1.0)
+    assert poller.poll() is None
+    release.set()
+    thread.join()
+    assert poller.stats['yielded'] == 2
+    assert poller.poll() is not None
+
+
+def test_poller_interval_and_stop():
+    sig_gen = SignalGenerator(protocol='MOCK')
+    poller = sig_gen.start_telemetry(rate=50, quiet=0)
+    time.sleep(0.3)
+    # About 15 polls in 0.3 s at 50 Hz, none before the first interval
+    assert 5 <= poller.stats['polls'] <= 16
+    poller.stop()
+    assert not poller._thread.is_alive()
+    n_polls = poller.stats['polls']
+    time.sleep(0.1)
+    assert poller.stats['polls'] == n_polls
+    # A new poller replaces and stops the previous one
+    poller = sig_gen.start_telemetry(rate=50, quiet=0)
+    assert sig_gen.telemetry is poller
+    poller.stop()
+
+
+def test_deferred_poll_is_repeated_after_the_quiet_time():
+    sig_gen = SignalGenerator(protocol='MOCK')
+    poller = TelemetryPoller(sig_gen, rate=2, quiet=0.02)
+    release = threading.Event()
+
+    def command():
+        with sig_gen._io_lock:
+            release.wait(1.0)
+    thread = threading.Thread(target=command)
+    thread.start()
+    poller.start()
+    time.sleep(0.55)
+    release.set()
+    thread.join()
+    # The poll deferred at 0.5 s is repeated within quiet, not after the
+    # next interval
+    time.sleep(0.1)
+    poller.stop()
+    assert poller.stats['yielded'] >= 1
+    assert poller.stats['polls'] == 1
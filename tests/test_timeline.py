@@ -0,0 +1,106 @@
+import threading
+
+import pytest
+
+from pytes.clock import VirtualClock
+from pytes.timeline import OverrunError, Step, Timeline, TimelineExecutor
+
+
+def _recorder(clock):
+    calls = []
+
+    def record(label):
+        calls.append((clock.now(), label))
+    return calls, record
+
+
+def test_steps_run_at_their_offsets():
+    clock = VirtualClock()
+    calls, record = _recorder(clock)
+    timeline = Timeline()
+    for t, label in [(2.0, 'off'), (0.0, 'on'), (0.5, 'fade')]:
+        timeline.add(t, record, args=(label,), label=label)
+    executor = TimelineExecutor(clock=clock)
+    session = executor.start(1, timeline, delay=1.0)
+    session.join(5.0)
+    assert calls == [(1.0, 'on'), (1.5, 'fade'), (3.0, 'off')]
+    assert [rec[0] for rec in session.records] == ['on', 'fade', 'off']
+    assert not session.aborted
+    kinds = [msg[1] for msg in executor.poll()]
+    assert kinds[0] == 'start' and kinds[-1] == 'done'
+
+
+def test_sync_start_shares_the_start_time():
+    clock = VirtualClock()
+    calls, record = _recorder(clock)
+    timelines = {}
+    for chn in [1, 2]:
+        timelines[chn] = Timeline().add(0, record, args=(f'CH{chn} on',))
+        timelines[chn].add(1.0 * chn, record, args=(f'CH{chn} off',))
+    executor = TimelineExecutor(clock=clock)
+    sessions = executor.start_sync(timelines, delay=0.25)
+    executor.join(5.0)
+    assert sessions[1].t_start == sessions[2].t_start == 0.25
+    assert sorted(calls) == [(0.25, 'CH1 on'), (0.25, 'CH2 on'),
+                             (1.25, 'CH1 off'), (2.25, 'CH2 off')]
+
+
+def test_blocking_step_does_not_delay_other_channel():
+    clock = VirtualClock()
+    calls, record = _recorder(clock)
+    timelines = {1: Timeline().add(0, clock.sleep, args=(10.0,),
+                                   label='upload'),
+                 2: Timeline().add(0.1, record, args=('on',))
+                 .add(2.1, record, args=('off',))}
+    executor = TimelineExecutor(clock=clock)
+    executor.start_sync(timelines, delay=0.0)
+    executor.join(5.0)
+    assert calls == [(0.1, 'on'), (2.1, 'off')]
+
+
+def test_abort_runs_off_steps_immediately():
+    calls = []
+    started = threading.Event()
+
+    def on():
+        calls.append('on')
+        started.set()
+    timeline = Timeline(on_abort=[Step(0, calls.append, args=('off',))])
+    timeline.add(0, on).add(60, calls.append, args=('late',))
+    executor = TimelineExecutor()
+    session = executor.start(1, timeline)
+    assert started.wait(2.0)
+    assert executor.running(1)
+    with pytest.raises(RuntimeError):
+        executor.start(1, Timeline())
+    executor.abort(1)
+    session.join(2.0)
+    assert not session.is_alive()
+    assert session.aborted
+    assert calls == ['on', 'off']
+
+
+def test_failing_step_aborts_the_session():
+    calls = []
+
+    def fail():
+        raise OSError('link lost')
+    timeline = Timeline(on_abort=[Step(0, calls.append, args=('off',))])
+    timeline.add(0, fail, label='on').add(1, calls.append, args=('hold',))
+    session = TimelineExecutor(clock=VirtualClock()).start(1, timeline)
+    session.join(5.0)
+    assert isinstance(session.error, OSError)
+    assert calls == ['off']
+
+
+def test_overrun_beyond_tolerance_aborts():
+    clock = VirtualClock()
+    calls, record = _recorder(clock)
+    timeline = Timeline(on_abort=[Step(0, record, args=('off',))])
+    timeline.add(0, clock.sleep, args=(0.5,), label='slow')
+    timeline.add(0.1, record, args=('on',), label='on')
+    session = TimelineExecutor(clock=clock).start(1, timeline,
+                                                  tolerance=0.1)
+    session.join(5.0)
+    assert isinstance(session.error, OverrunError)
+    assert calls == [(0.5, 'off')]
@@ -0,0 +1,75 @@
+import pytest
+
+from pytes.clock import VirtualClock
+from pytes.scpi import SIGLENT_SDG
+from pytes.signal_generator import SignalGenerator
+
+
+@pytest.fixture
+def sig_gen():
+    return SignalGenerator(protocol='MOCK')
+
+
+def _sent(sig_gen, n_init):
+    return [cmd for _, cmd in sig_gen.protocol.log[n_init:]]
+
+
+def test_arm_ahead_and_fire_one_write(sig_gen):
+    n_init = len(sig_gen.protocol.log)
+    armed = sig_gen.arm({'amp': 1}, chn=[1, 2])
+    assert _sent(sig_gen, n_init) == [
+        ':SOUR1:VOLT 1', ':SOUR2:VOLT 1',
+        ':SOUR1:BURS:MODE INF;:SOUR1:BURS:TRIG:SOUR MAN;:SOUR1:BURS:STAT ON;'
+        ':OUTPut1 ON;:SOUR2:BURS:MODE INF;:SOUR2:BURS:TRIG:SOUR MAN;'
+        ':SOUR2:BURS:STAT ON;:OUTPut2 ON']
+    # A single *TRG starts both channels
+    assert armed['data'] == b'*TRG\n'
+    n_init = len(sig_gen.protocol.log)
+    t_before, t_after = sig_gen.fire()
+    assert t_before <= t_after
+    assert _sent(sig_gen, n_init) == ['*TRG']
+    sig_gen.disarm()
+    assert sig_gen.protocol.log[-1][1] == \
+        ':OUTPut1 OFF;:SOUR1:BURS:STAT OFF;:OUTPut2 OFF;:SOUR2:BURS:STAT OFF'
+    assert sig_gen.commanded[1]['output'] == 0
+    with pytest.raises(RuntimeError, match='arm'):
+        sig_gen.fire()
+
+
+def test_arm_cycles_per_trigger(sig_gen):
+    sig_gen.arm(chn=1, cycles=3)
+    assert sig_gen.protocol.log[-1][1].startswith(
+        ':SOUR1:BURS:MODE TRIG;:SOUR1:BURS:NCYC 3;')
+
+
+def test_external_trigger(sig_gen):
+    calls = []
+    sig_gen.arm(chn=1, trigger_source='external',
+                trigger_line=lambda: calls.append(1))
+    n_init = len(sig_gen.protocol.log)
+    sig_gen.fire()
+    # The trigger line replaces the trigger command
+    assert calls == [1] and _sent(sig_gen, n_init) == []
+    sig_gen.arm(chn=1, trigger_source='external')
+    with pytest.raises(RuntimeError, match='external trigger'):
+        sig_gen.fire()
+    with pytest.raises(ValueError, match='trigger_source'):
+        sig_gen.arm(chn=1, trigger_source='immediate')
+
+
+def test_one_trigger_per_distinct_command():
+    sig_gen = SignalGenerator(protocol='MOCK', dialect=SIGLENT_SDG)
+    armed = sig_gen.arm(chn=[1, 2])
+    assert armed['data'] == b'C1:BTWV MTRIG;C2:BTWV MTRIG\n'
+
+
+def test_measure_fire_in_virtual_time():
+    clock = VirtualClock()
+    sig_gen = SignalGenerator(protocol='MOCK', clock=clock)
+    sig_gen.protocol.latency = 0.001
+    report = sig_gen.measure_fire(n_round=10, interval=0.05, chn=1)
+    assert report['fire']['p50_ms'] == pytest.approx(1.0)
+    assert report['arm']['max_ms'] == pytest.approx(1.0)
+    # The channels are disarmed at the end
+    assert sig_gen._armed is None
+    assert sig_gen.protocol.log[-1][1] == ':OUTPut1 OFF;:SOUR1:BURS:STAT OFF'
@@ -0,0 +1,76 @@
+import sys
+
+import numpy as np
+import pytest
+
+from pytes.signal_generator import SignalGenerator
+from pytes.verify import checksum, sample_indices
+
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'),
+                                reason='The emulator requires Linux')
+
+
+@pytest.fixture(scope='module')
+def sig_gen(tmp_path_factory):
+    from pytes.emulator import EmulatorProcess
+    emulator = EmulatorProcess(str(tmp_path_factory.mktemp('fakedev')))
+    emulator.start()
+    try:
+        sig_gen = SignalGenerator(dev=emulator.paths[0], protocol='USBTMC')
+        data = 2 * np.sin(np.linspace(0, 2 * np.pi, 500))
+        sig_gen.arb_func(data, sps=1e5, chn=1)
+        yield sig_gen
+    finally:
+        emulator.stop()
+
+
+def test_sample_indices_cover_both_ends():
+    indices = sample_indices(1000, 32, np.random.default_rng(0))
+    assert indices[0] == 0 and indices[-1] == 999
+    assert np.all(np.diff(indices) > 0)
+    assert len(sample_indices(10, 32)) == 10
+
+
+def test_upload_is_verified(sig_gen):
+    report = sig_gen.arb_checks[1]
+    assert report['match']
+    assert report['points_read'] == 500
+    assert report['checksum'] == report['checksum_read']
+    # The sampled points are read in one pipelined message
+    assert report['pipeline']
+    assert report['round_trips'] <= 3
+
+
+def test_corrupted_point_is_reported(sig_gen):
+    expected = sig_gen._arb[1]['data']
+    wrong = (int(expected[250]) + 1000) % 16384
+    sig_gen.set_cmd(f':SOUR1:DATA:VAL VOLATILE,251,{wrong}')
+    try:
+        report = sig_gen.verify_arb(chn=1, n_samples=1000)
+        assert not report['match']
+        assert list(report['mismatches']) == [250]
+        assert list(report['read']) == [wrong]
+        assert list(report['expected']) == [expected[250]]
+        assert report['checksum'] != report['checksum_read']
+    finally:
+        sig_gen.set_cmd(f':SOUR1:DATA:VAL VOLATILE,251,{expected[250]}')
+    assert sig_gen.verify_arb(chn=1, n_samples=1000)['match']
+
+
+def test_missing_points_are_reported(sig_gen):
+    data = sig_gen._arb[1]['data']
+    sig_gen.set_cmd(':SOUR1:DATA:POIN VOLATILE,400')
+    report = sig_gen.verify_arb(chn=1)
+    assert not report['match']
+    assert report['points_read'] == 400
+    # Upload again for the other tests
+    sig_gen.arb_func((data * 5 / 16383) - 2.5, sps=1e5, chn=1)
+    assert sig_gen.arb_checks[1]['match']
+
+
+def test_mock_driver_skips_verification():
+    sig_gen = SignalGenerator(protocol='MOCK')
+    sig_gen.arb_func(np.zeros(10), sps=100, chn=1)
+    assert sig_gen.verify_arb(chn=1) is None
+    assert checksum([1, 2]) != checksum([2, 1])